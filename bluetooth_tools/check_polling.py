@@ -0,0 +1,55 @@
+import csv
+import asyncio
+import logging
+import datetime
+import tempfile
+from fake_bleak import FakeBleakClient, FAKE_DEVICE_ADDRESSES, FAKE_CHARACTERISTIC_UUIDS
+from polling import parse_polled_characteristic, poll_devices, POLL_TIMESTAMP_FORMAT
+
+# Checks with the fake backend that polling reconnects to devices whose connection drops, and keeps writing
+# readings afterwards, both when reading on an interval and when subscribed. Run with `python check_polling.py`.
+
+CHECK_DROP_AFTER_SECONDS = 0.5
+CHECK_DURATION_SECONDS = 2.0
+CHECK_RECONNECT_SECONDS = 0.1
+
+class DroppingBleakClient(FakeBleakClient):
+    drop_after_seconds = CHECK_DROP_AFTER_SECONDS
+    connect_counts = {}
+
+    async def connect(self):
+        connected = await super().connect()
+        DroppingBleakClient.connect_counts[self.address] = DroppingBleakClient.connect_counts.get(self.address, 0) + 1
+        return connected
+
+def check_reconnecting(subscribe):
+    DroppingBleakClient.connect_counts = {}
+    device_addresses = FAKE_DEVICE_ADDRESSES[:2]
+    with tempfile.TemporaryDirectory() as output_dir:
+        started_at = datetime.datetime.now()
+        output_paths = asyncio.run(poll_devices(
+            DroppingBleakClient, device_addresses,
+            [parse_polled_characteristic(f"{FAKE_CHARACTERISTIC_UUIDS[0]}=Leaf Moisture:<f")],
+            output_dir, interval_seconds=0.1, subscribe=subscribe, duration_seconds=CHECK_DURATION_SECONDS,
+            reconnect_seconds=CHECK_RECONNECT_SECONDS
+        ))
+        for device_address, output_path in zip(device_addresses, output_paths):
+            with open(output_path, newline="") as output_file:
+                reading_rows = list(csv.reader(output_file))[2:]
+            reading_times = [datetime.datetime.strptime(reading_row[0], POLL_TIMESTAMP_FORMAT) for reading_row in reading_rows]
+            connect_count = DroppingBleakClient.connect_counts.get(device_address, 0)
+            # A reading a second after the first drop can only come from a later connection.
+            readings_after_drop = sum(
+                (reading_time - started_at).total_seconds() > CHECK_DROP_AFTER_SECONDS + 1.0 for reading_time in reading_times
+            )
+            if connect_count < 2 or readings_after_drop == 0:
+                raise Exception(f"{device_address} did not recover from a dropped connection when "
+                    f"{'subscribed' if subscribe else 'polled'}, connected {connect_count} times with "
+                    f"{readings_after_drop} readings after the drop")
+            print(f"{device_address} {'subscribed' if subscribe else 'polled'}: connected {connect_count} times, "
+                f"{len(reading_rows)} readings, {readings_after_drop} after the first drop")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    check_reconnecting(subscribe=False)
+    check_reconnecting(subscribe=True)
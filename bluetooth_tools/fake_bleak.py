@@ -0,0 +1,92 @@
+import asyncio
+import struct
+import collections
+
+# Stands in for bleak's BleakScanner and BleakClient, so commands run (and can be tested) without adapters or sensors.
+
+FAKE_DEVICE_ADDRESSES = ["FA:KE:00:00:00:01", "FA:KE:00:00:00:02", "FA:KE:00:00:00:03"]
+FAKE_SERVICE_UUID = "0000fe40-cc7a-482a-984a-7f2ed5b3e58f"
+FAKE_CHARACTERISTIC_UUIDS = ["0000fe41-8e22-4541-9d4c-21edae82ed19", "0000fe42-8e22-4541-9d4c-21edae82ed19"]
+FAKE_NOTIFY_SECONDS = 0.1
+
+FakeDevice = collections.namedtuple("FakeDevice", ["name", "address"])
+FakeService = collections.namedtuple("FakeService", ["uuid", "characteristics"])
+FakeCharacteristic = collections.namedtuple("FakeCharacteristic", ["uuid"])
+
+class FakeBleakScanner:
+    @staticmethod
+    async def discover():
+        await asyncio.sleep(0)
+        return [FakeDevice("TXTX", device_address) for device_address in FAKE_DEVICE_ADDRESSES]
+
+class FakeBleakClient:
+    # Seconds after connecting that the connection drops, like a device going out of range, never if None.
+    drop_after_seconds = None
+
+    def __init__(self, device_address, disconnected_callback=None):
+        self.address = device_address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.read_count = 0
+        self.notify_tasks = {}
+        self.services = [FakeService(FAKE_SERVICE_UUID, [
+            FakeCharacteristic(characteristic_uuid) for characteristic_uuid in FAKE_CHARACTERISTIC_UUIDS
+        ])]
+
+    async def connect(self):
+        await asyncio.sleep(0.01)
+        # Like a device out of range, so reconnecting can be exercised.
+        if self.address not in FAKE_DEVICE_ADDRESSES:
+            raise Exception(f"Device with address {self.address} was not found.")
+        self.is_connected = True
+        if self.drop_after_seconds is not None:
+            asyncio.get_running_loop().call_later(self.drop_after_seconds, self.drop_connection)
+        return True
+
+    def drop_connection(self):
+        if not self.is_connected:
+            return
+        for notify_task in self.notify_tasks.values():
+            notify_task.cancel()
+        self.notify_tasks = {}
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def disconnect(self):
+        for notify_task in self.notify_tasks.values():
+            notify_task.cancel()
+        self.notify_tasks = {}
+        self.is_connected = False
+        return True
+
+    def get_fake_value(self, characteristic_uuid):
+        if not self.is_connected:
+            raise Exception("Not connected")
+        if characteristic_uuid not in FAKE_CHARACTERISTIC_UUIDS:
+            raise Exception(f"Characteristic {characteristic_uuid} was not found!")
+        # A slow ramp per device and characteristic, little endian like the radar values sent by the firmware.
+        self.read_count += 1
+        return bytearray(struct.pack("<f", FAKE_CHARACTERISTIC_UUIDS.index(characteristic_uuid) * 100 + self.read_count / 10))
+
+    async def read_gatt_char(self, characteristic_uuid):
+        await asyncio.sleep(0.005)
+        return self.get_fake_value(characteristic_uuid)
+
+    async def start_notify(self, characteristic_uuid, callback):
+        self.get_fake_value(characteristic_uuid)
+        async def notify():
+            while True:
+                await asyncio.sleep(FAKE_NOTIFY_SECONDS)
+                callback(characteristic_uuid, self.get_fake_value(characteristic_uuid))
+        self.notify_tasks[characteristic_uuid] = asyncio.create_task(notify())
+
+    async def stop_notify(self, characteristic_uuid):
+        self.notify_tasks.pop(characteristic_uuid).cancel()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
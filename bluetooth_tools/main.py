@@ -1,9 +1,21 @@
+import os
 import asyncio
+import logging
 import argparse
-from bleak import BleakScanner, BleakClient
+from polling import parse_polled_characteristic, poll_devices
+
+def get_backend(backend_name):
+    if backend_name == "fake":
+        from fake_bleak import FakeBleakScanner, FakeBleakClient
+        return FakeBleakScanner, FakeBleakClient
+    from bleak import BleakScanner, BleakClient
+    return BleakScanner, BleakClient
 
 def main():
     root_parser = argparse.ArgumentParser()
+    root_parser.add_argument("--backend", choices=["bleak", "fake"], default="bleak",
+        help="Bluetooth backend, fake simulates a few devices without an adapter.")
+    root_parser.add_argument("--log-level", default="INFO")
     def root_command(program_arguments):
         root_parser.print_help()
     root_parser.set_defaults(command=root_command)
@@ -12,45 +24,78 @@ def main():
 
     scan_parser = root_subparsers.add_parser("scan")
     def scan_command(program_arguments):
-        asyncio.get_event_loop().run_until_complete(scan_devices())
+        scanner_class, _ = get_backend(program_arguments.backend)
+        asyncio.run(scan_devices(scanner_class))
     scan_parser.set_defaults(command=scan_command)
 
     info_parser = root_subparsers.add_parser("info")
     info_parser.add_argument("--mac")
     info_parser.add_argument("--characteristic")
     def info_command(program_arguments):
-        asyncio.get_event_loop().run_until_complete(
-            device_information(program_arguments.mac)
-        )
-        if program_arguments.characteristic:
-            asyncio.get_event_loop().run_until_complete(
-                read_characteristic(
-                    program_arguments.mac,
-                    program_arguments.characteristic
-                )
-            )
-
+        _, client_class = get_backend(program_arguments.backend)
+        asyncio.run(device_information(client_class, program_arguments.mac, program_arguments.characteristic))
     info_parser.set_defaults(command=info_command)
 
+    poll_parser = root_subparsers.add_parser("poll")
+    poll_parser.add_argument("--mac", action="append", required=True,
+        help="Address of a device to poll, repeat for each device.")
+    poll_parser.add_argument("--characteristic", action="append", required=True,
+        help="Characteristic to read, like '<uuid>', '<uuid>=Leaf Moisture' or '<uuid>=Leaf Moisture:<f' "
+        "to decode the value with a struct format (hex by default, or utf8). Repeat for each characteristic.")
+    poll_parser.add_argument("--interval", type=float, default=1.0,
+        help="Seconds between readings of each device.")
+    poll_parser.add_argument("--subscribe", action="store_true",
+        help="Write a reading for every notification instead of reading on an interval.")
+    poll_parser.add_argument("--max-concurrency", type=int, default=4,
+        help="Number of connection attempts and reads in flight across all devices.")
+    poll_parser.add_argument("--duration", type=float,
+        help="Seconds to poll for, until interrupted if excluded.")
+    poll_parser.add_argument("--reconnect-delay", type=float, default=5.0,
+        help="Seconds to wait before reconnecting to a device that failed.")
+    poll_parser.add_argument("--output-dir", default=".",
+        help="Directory to write a csv of readings per device to, loadable as an environment file.")
+    def poll_command(program_arguments):
+        if not os.path.isdir(program_arguments.output_dir):
+            raise Exception(f"The output directory is invalid... {program_arguments.output_dir}")
+        if program_arguments.interval <= 0 or program_arguments.max_concurrency <= 0:
+            raise Exception("The interval and maximum concurrency should be positive.")
+        _, client_class = get_backend(program_arguments.backend)
+        try:
+            asyncio.run(poll_devices(
+                client_class,
+                program_arguments.mac,
+                [parse_polled_characteristic(characteristic) for characteristic in program_arguments.characteristic],
+                program_arguments.output_dir,
+                program_arguments.interval,
+                program_arguments.subscribe,
+                program_arguments.max_concurrency,
+                program_arguments.duration,
+                program_arguments.reconnect_delay
+            ))
+        except KeyboardInterrupt:
+            print("Stopped polling")
+    poll_parser.set_defaults(command=poll_command)
+
     program_arguments = root_parser.parse_args()
+    logging.basicConfig(level=program_arguments.log_level.upper(),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     program_arguments.command(program_arguments)
 
-async def scan_devices():
-    devices = await BleakScanner.discover()
+async def scan_devices(scanner_class):
+    devices = await scanner_class.discover()
     for device in devices:
         print(f"Device: {device.name}, Address: {device.address}")
 
-async def device_information(device_address):
-    async with BleakClient(device_address) as client:
+async def device_information(client_class, device_address, characteristic_uuid=None):
+    # The characteristic is read over the same connection the services were listed with.
+    async with client_class(device_address) as client:
         for service in client.services:
             print(f"Service: {service.uuid}")
             for char in service.characteristics:
                 print(f"  Characteristic: {char.uuid}")
-
-async def read_characteristic(device_address, characteristic_uuid):
-    async with BleakClient(device_address) as client:
-        value = await client.read_gatt_char(characteristic_uuid)
-        print(f"Value: {value}")
+        if characteristic_uuid:
+            value = await client.read_gatt_char(characteristic_uuid)
+            print(f"Value: {value}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,188 @@
+import os
+import csv
+import math
+import struct
+import asyncio
+import logging
+import datetime
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Microsecond resolution and ISO ordering, which the environment loader of data_analysis parses like its own timestamps.
+POLL_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+POLL_VALUE_FORMATS = ["hex", "utf8"]
+
+# Seconds between checks that a subscribed device is still connected, in case a backend never reports the drop.
+DISCONNECT_CHECK_SECONDS = 1.0
+
+PolledCharacteristic = collections.namedtuple("PolledCharacteristic", ["uuid", "column_name", "value_format"])
+
+def parse_polled_characteristic(characteristic_spec):
+    # Like "<uuid>", "<uuid>=Leaf Moisture" or "<uuid>=Leaf Moisture:<f" (a struct format, hex or utf8).
+    uuid, _, column_spec = characteristic_spec.partition("=")
+    column_name, _, value_format = column_spec.partition(":")
+    column_name = column_name or uuid
+    value_format = value_format or "hex"
+    if value_format not in POLL_VALUE_FORMATS:
+        try:
+            struct.calcsize(value_format)
+        except struct.error:
+            raise Exception(f"Value format should be {POLL_VALUE_FORMATS} or a struct format, was... {value_format}")
+    return PolledCharacteristic(uuid, column_name, value_format)
+
+def get_characteristic_column_names(polled_characteristic):
+    value_format = polled_characteristic.value_format
+    if value_format in POLL_VALUE_FORMATS:
+        return [polled_characteristic.column_name]
+    value_count = len(struct.unpack(value_format, bytes(struct.calcsize(value_format))))
+    if value_count == 1:
+        return [polled_characteristic.column_name]
+    return [f"{polled_characteristic.column_name}_{value_index + 1}" for value_index in range(value_count)]
+
+def decode_characteristic_value(polled_characteristic, value):
+    value = bytes(value)
+    if polled_characteristic.value_format == "hex":
+        return [value.hex()]
+    if polled_characteristic.value_format == "utf8":
+        return [value.decode("utf-8", errors="replace").strip()]
+    return list(struct.unpack(polled_characteristic.value_format, value))
+
+class ReadingWriter:
+    # One file per device, laid out like the environment files: a header, a row of units, then a row per reading.
+    def __init__(self, output_dir, device_address, polled_characteristics):
+        started_at = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.output_path = os.path.join(output_dir, f"{device_address.replace(':', '-')}_{started_at}.csv")
+        self.output_file = open(self.output_path, "w", newline="")
+        self.csv_writer = csv.writer(self.output_file)
+        self.column_names = [
+            column_name for polled_characteristic in polled_characteristics
+            for column_name in get_characteristic_column_names(polled_characteristic)
+        ]
+        self.csv_writer.writerow(["TIMESTAMP", "RECORD", *self.column_names])
+        self.csv_writer.writerow(["TS", "RN", *[
+            polled_characteristic.value_format for polled_characteristic in polled_characteristics
+            for _ in get_characteristic_column_names(polled_characteristic)
+        ]])
+        self.record_count = 0
+
+    def write(self, reading_time, column_values):
+        self.csv_writer.writerow([
+            reading_time.strftime(POLL_TIMESTAMP_FORMAT), self.record_count,
+            *[column_values.get(column_name, "") for column_name in self.column_names]
+        ])
+        # Flushed per reading so the file can be followed, or loaded, while polling continues.
+        self.output_file.flush()
+        self.record_count += 1
+
+    def close(self):
+        self.output_file.close()
+
+def get_column_values(polled_characteristic, value):
+    return dict(zip(
+        get_characteristic_column_names(polled_characteristic),
+        decode_characteristic_value(polled_characteristic, value)
+    ))
+
+async def read_characteristics(client, polled_characteristics):
+    column_values = {}
+    for polled_characteristic in polled_characteristics:
+        column_values.update(get_column_values(
+            polled_characteristic, await client.read_gatt_char(polled_characteristic.uuid)
+        ))
+    return column_values
+
+async def wait_until_stopped_or_disconnected(client, stop_event, disconnected_event):
+    # Notifications simply stop when a device drops its connection, so the drop is raised here for the caller
+    # to reconnect, on bleak's disconnected callback or on is_connected turning false.
+    while not stop_event.is_set():
+        if disconnected_event.is_set() or not client.is_connected:
+            raise Exception("The device disconnected")
+        waiting_tasks = [asyncio.create_task(stop_event.wait()), asyncio.create_task(disconnected_event.wait())]
+        try:
+            await asyncio.wait(waiting_tasks, timeout=DISCONNECT_CHECK_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiting_task in waiting_tasks:
+                waiting_task.cancel()
+
+async def poll_connected_device(client, polled_characteristics, reading_writer, interval_seconds, subscribe,
+    operation_limit, stop_event, disconnected_event):
+    if subscribe:
+        def handle_notification(polled_characteristic):
+            def write_notification(_characteristic, value):
+                reading_writer.write(datetime.datetime.now(), get_column_values(polled_characteristic, value))
+            return write_notification
+        for polled_characteristic in polled_characteristics:
+            async with operation_limit:
+                await client.start_notify(polled_characteristic.uuid, handle_notification(polled_characteristic))
+        await wait_until_stopped_or_disconnected(client, stop_event, disconnected_event)
+        return
+
+    loop = asyncio.get_running_loop()
+    next_reading_time = loop.time()
+    while not stop_event.is_set():
+        if disconnected_event.is_set():
+            raise Exception("The device disconnected")
+        reading_time = datetime.datetime.now()
+        async with operation_limit:
+            column_values = await read_characteristics(client, polled_characteristics)
+        reading_writer.write(reading_time, column_values)
+        # Readings stay on the interval grid, skipping intervals that were missed rather than bunching up.
+        next_reading_time += interval_seconds
+        reading_lag = loop.time() - next_reading_time
+        if reading_lag > 0:
+            next_reading_time += math.ceil(reading_lag / interval_seconds) * interval_seconds
+        try:
+            await asyncio.wait_for(stop_event.wait(), next_reading_time - loop.time())
+        except asyncio.TimeoutError:
+            pass
+
+async def poll_device(client_class, device_address, polled_characteristics, reading_writer, interval_seconds, subscribe,
+    operation_limit, stop_event, reconnect_seconds):
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        # Backends may report a drop from another thread, so the event is set through the loop.
+        disconnected_event = asyncio.Event()
+        client = client_class(device_address,
+            disconnected_callback=lambda _client, disconnected_event=disconnected_event:
+                loop.call_soon_threadsafe(disconnected_event.set))
+        try:
+            # Adapters only establish a few connections at a time, so connecting counts against the limit too.
+            async with operation_limit:
+                await client.connect()
+            logger.info("Connected to %s", device_address)
+            await poll_connected_device(client, polled_characteristics, reading_writer, interval_seconds, subscribe,
+                operation_limit, stop_event, disconnected_event)
+        except Exception as e:
+            logger.warning("Polling %s failed, reconnecting in %ss, was... %s", device_address, reconnect_seconds, e)
+            try:
+                await asyncio.wait_for(stop_event.wait(), reconnect_seconds)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.debug("Disconnecting from %s failed, was... %s", device_address, e)
+
+async def poll_devices(client_class, device_addresses, polled_characteristics, output_dir, interval_seconds=1.0,
+    subscribe=False, max_concurrency=4, duration_seconds=None, reconnect_seconds=5.0):
+    operation_limit = asyncio.Semaphore(max_concurrency)
+    stop_event = asyncio.Event()
+    reading_writers = [
+        ReadingWriter(output_dir, device_address, polled_characteristics) for device_address in device_addresses
+    ]
+    for reading_writer in reading_writers:
+        logger.info("Writing readings to %s", reading_writer.output_path)
+    if duration_seconds is not None:
+        asyncio.get_running_loop().call_later(duration_seconds, stop_event.set)
+    try:
+        await asyncio.gather(*[
+            poll_device(client_class, device_address, polled_characteristics, reading_writer, interval_seconds, subscribe,
+                operation_limit, stop_event, reconnect_seconds)
+            for device_address, reading_writer in zip(device_addresses, reading_writers)
+        ])
+    finally:
+        for reading_writer in reading_writers:
+            reading_writer.close()
+    return [reading_writer.output_path for reading_writer in reading_writers]
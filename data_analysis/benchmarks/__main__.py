@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import resource
+import numpy as np
+import h5py
+import data_files
+from data_files.radar_h5 import get_radar_data_around_timestamp, get_radar_sample_count, iterate_radar_data_chunks, \
+    open_radar_file, repack_radar_file
+from data_files.radar_pyramid import build_radar_pyramid, get_radar_data_level_of_detail, RadarPyramid
+from data_files.environments_excel import load_environment_information, get_environment_column_between_timestamps, \
+    get_environment_information_around_timestamp
+from benchmarks.synthetic_data import get_synthetic_fixture
+
+BENCHMARKS = []
+# Prepares the context of a benchmark before it is timed, for state that is not part of what it measures.
+BENCHMARK_SETUPS = {}
+def benchmark(benchmark_name, setup=None):
+    def register_benchmark(benchmark_function):
+        BENCHMARKS.append((benchmark_name, benchmark_function))
+        if setup is not None:
+            BENCHMARK_SETUPS[benchmark_name] = setup
+        return benchmark_function
+    return register_benchmark
+
+BENCHMARK_QUERY_COUNT = 1000
+
+def get_random_timestamps(benchmark_context, query_count):
+    random_generator = np.random.default_rng(0)
+    start_timestamp, end_timestamp = benchmark_context['overlap']
+    offsets = random_generator.uniform(0, (end_timestamp - start_timestamp).total_seconds(), query_count)
+    return [start_timestamp + datetime.timedelta(seconds=offset) for offset in offsets]
+
+@benchmark('find_greatest_overlap')
+def benchmark_find_greatest_overlap(benchmark_context):
+    # A fresh handle so building the radar time index is part of the measurement.
+    with h5py.File(benchmark_context['radar_h5_file'], 'r') as radar_file:
+        data_files.find_greatest_overlap(radar_file, benchmark_context['environment_information'])
+    return 1
+
+@benchmark('load_environment_information')
+def benchmark_load_environment_information(benchmark_context):
+    return load_environment_information(benchmark_context['environment_file']).shape[0]
+
+@benchmark('get_radar_data_around_timestamp')
+def benchmark_get_radar_data_around_timestamp(benchmark_context):
+    for query_timestamp in benchmark_context['query_timestamps']:
+        get_radar_data_around_timestamp(benchmark_context['radar_file'], query_timestamp, datetime.timedelta(seconds=1))
+    return len(benchmark_context['query_timestamps'])
+
+@benchmark('get_overlap_as_aggregated_cold')
+def benchmark_get_overlap_as_aggregated_cold(benchmark_context):
+    cache_directory = tempfile.mkdtemp()
+    try:
+        return data_files.get_overlap_as_aggregated(
+            benchmark_context['radar_file'], benchmark_context['environment_information'],
+            benchmark_context['environment_file'], cache_directory=cache_directory
+        ).moistures.shape[0]
+    finally:
+        shutil.rmtree(cache_directory)
+
+@benchmark('get_overlap_as_aggregated_warm')
+def benchmark_get_overlap_as_aggregated_warm(benchmark_context):
+    return data_files.get_overlap_as_aggregated(
+        benchmark_context['radar_file'], benchmark_context['environment_information'],
+        benchmark_context['environment_file'], cache_directory=benchmark_context['cache_directory']
+    ).moistures.shape[0]
+
+@benchmark('environment_between_timestamps')
+def benchmark_environment_between_timestamps(benchmark_context):
+    for query_timestamp in benchmark_context['query_timestamps']:
+        get_environment_column_between_timestamps(
+            benchmark_context['environment_information'], 'Leaf Moisture',
+            query_timestamp, query_timestamp + datetime.timedelta(hours=1)
+        )
+    return len(benchmark_context['query_timestamps'])
+
+@benchmark('environment_around_timestamp')
+def benchmark_environment_around_timestamp(benchmark_context):
+    for query_timestamp in benchmark_context['query_timestamps']:
+        get_environment_information_around_timestamp(
+            benchmark_context['environment_information'], query_timestamp, datetime.timedelta(seconds=30)
+        )
+    return len(benchmark_context['query_timestamps'])
+
+@benchmark('radar_pyramid_build')
+def benchmark_radar_pyramid_build(benchmark_context):
+    pyramid_path = os.path.join(benchmark_context['cache_directory'], 'benchmark_build.pyramid.h5')
+    build_radar_pyramid(benchmark_context['radar_file'], pyramid_path)
+    os.remove(pyramid_path)
+    return get_radar_sample_count(benchmark_context['radar_file'])
+
+# Pixel width of the heatmap that level of detail queries are made for.
+BENCHMARK_HEATMAP_WIDTH = 1500
+
+@benchmark('radar_pyramid_region')
+def benchmark_radar_pyramid_region(benchmark_context):
+    random_generator = np.random.default_rng(0)
+    sample_count = get_radar_sample_count(benchmark_context['radar_file'])
+    for _ in range(BENCHMARK_QUERY_COUNT // 10):
+        region_start, region_stop = np.sort(random_generator.integers(0, sample_count, 2))
+        get_radar_data_level_of_detail(benchmark_context['radar_file'], benchmark_context['radar_pyramid'],
+            region_start, region_stop + 1, BENCHMARK_HEATMAP_WIDTH)
+    return BENCHMARK_QUERY_COUNT // 10
+
+# Samples per read when iterating the whole recording, so even the shorter fixtures span several reads.
+BENCHMARK_CHUNK_SIZE = 10000
+
+@benchmark('iterate_radar_data_chunks')
+def benchmark_iterate_radar_data_chunks(benchmark_context):
+    for _, sensors_data in iterate_radar_data_chunks(benchmark_context['radar_file'], BENCHMARK_CHUNK_SIZE):
+        sensors_data.sum(axis=0)
+    return get_radar_sample_count(benchmark_context['radar_file'])
+
+@benchmark('iterate_repacked_radar_data_chunks')
+def benchmark_iterate_repacked_radar_data_chunks(benchmark_context):
+    with open_radar_file(benchmark_context['repacked_radar_h5_file'], 'sequential') as radar_file:
+        for _, sensors_data in iterate_radar_data_chunks(radar_file, BENCHMARK_CHUNK_SIZE):
+            sensors_data.sum(axis=0)
+        return get_radar_sample_count(radar_file)
+
+@benchmark('versus_aggregation')
+def benchmark_versus_aggregation(benchmark_context):
+    radar_and_moisture = benchmark_context['radar_and_moisture']
+    moisture_aggregates = data_files.aggregate_radar_by_moisture(
+        radar_and_moisture.moistures, radar_and_moisture.radar_levels
+    )
+    moisture_aggregates.means[:, np.arange(0, moisture_aggregates.means.shape[1], 2)].sum(axis=1)
+    return radar_and_moisture.moistures.shape[0]
+
+@benchmark('model_fit')
+def benchmark_model_fit(benchmark_context):
+    from sklearn.linear_model import LinearRegression
+    radar_and_moisture = benchmark_context['radar_and_moisture']
+    benchmark_context['moisture_model'] = LinearRegression().fit(
+        radar_and_moisture.radar_levels, radar_and_moisture.moistures
+    )
+    return radar_and_moisture.moistures.shape[0]
+
+@benchmark('model_predict')
+def benchmark_model_predict(benchmark_context):
+    radar_and_moisture = benchmark_context['radar_and_moisture']
+    benchmark_context['moisture_model'].predict(radar_and_moisture.radar_levels)
+    return radar_and_moisture.moistures.shape[0]
+
+def set_up_portable_model(benchmark_context):
+    from subcommands.model.artifact import save_model_artifact, load_model_artifact
+    if 'moisture_model' not in benchmark_context:
+        benchmark_model_fit(benchmark_context)
+    artifact_path = os.path.join(benchmark_context['cache_directory'], 'benchmark.model.npz')
+    save_model_artifact(artifact_path, benchmark_context['moisture_model'])
+    benchmark_context['portable_moisture_model'] = load_model_artifact(artifact_path)
+
+@benchmark('portable_model_predict', setup=set_up_portable_model)
+def benchmark_portable_model_predict(benchmark_context):
+    radar_and_moisture = benchmark_context['radar_and_moisture']
+    benchmark_context['portable_moisture_model'].predict(radar_and_moisture.radar_levels)
+    return radar_and_moisture.moistures.shape[0]
+
+# Libraries that registering the subcommands of main.py must not import, only running one of them may.
+STARTUP_HEAVY_MODULES = ['numpy', 'pandas', 'h5py', 'matplotlib', 'sklearn', 'mpld3', 'readline']
+DATA_ANALYSIS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_cli_startup(repeats):
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(DATA_ANALYSIS_DIRECTORY, 'main.py'), '--help'],
+            cwd=DATA_ANALYSIS_DIRECTORY, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start_time)
+
+    import_check = subprocess.run([sys.executable, '-c',
+        'import sys, json, main; main.build_argument_parser(); '
+        'print(json.dumps([name for name in {} if name in sys.modules]))'.format(STARTUP_HEAVY_MODULES)
+    ], cwd=DATA_ANALYSIS_DIRECTORY, capture_output=True, text=True, check=True)
+    return {
+        'seconds': min(durations),
+        'median_seconds': float(np.median(durations)),
+        'heavy_modules': json.loads(import_check.stdout)
+    }
+
+def check_cli_startup(startup_result, startup_budget):
+    failures = []
+    if startup_result['seconds'] > startup_budget:
+        failures.append('main.py --help took {:.3f}s, over the budget of {:.3f}s'.format(
+            startup_result['seconds'], startup_budget
+        ))
+    if len(startup_result['heavy_modules']) > 0:
+        failures.append('Registering the subcommands imported... {}'.format(startup_result['heavy_modules']))
+    return failures
+
+def measure_benchmark(benchmark_function, benchmark_context, repeats):
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        processed_count = benchmark_function(benchmark_context)
+        durations.append(time.perf_counter() - start_time)
+
+    # Memory is traced in a separate run since tracing slows down allocation heavy code.
+    tracemalloc.start()
+    benchmark_function(benchmark_context)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': min(durations),
+        'median_seconds': float(np.median(durations)),
+        'peak_bytes': peak_bytes,
+        'processed': processed_count
+    }
+
+def run_benchmarks_for_duration(fixture_dir, duration_name, sample_rate, environment_format, selected_names, repeats):
+    radar_h5_file, environment_file = get_synthetic_fixture(fixture_dir, duration_name, sample_rate, environment_format)
+    cache_directory = tempfile.mkdtemp()
+    try:
+        with h5py.File(radar_h5_file, 'r') as radar_file:
+            environment_information = load_environment_information(environment_file)
+            benchmark_context = {
+                'radar_h5_file': radar_h5_file,
+                'environment_file': environment_file,
+                'radar_file': radar_file,
+                'environment_information': environment_information,
+                'overlap': data_files.find_greatest_overlap(radar_file, environment_information),
+                'cache_directory': cache_directory,
+                'radar_and_moisture': data_files.get_overlap_as_aggregated(
+                    radar_file, environment_information, environment_file, cache_directory=cache_directory
+                )
+            }
+            benchmark_context['query_timestamps'] = get_random_timestamps(benchmark_context, BENCHMARK_QUERY_COUNT)
+            pyramid_path = os.path.join(cache_directory, 'benchmark.pyramid.h5')
+            build_radar_pyramid(radar_file, pyramid_path)
+            benchmark_context['radar_pyramid'] = RadarPyramid(h5py.File(pyramid_path, 'r'))
+            benchmark_context['repacked_radar_h5_file'] = os.path.join(cache_directory, 'benchmark.repacked.h5')
+            repack_radar_file(radar_file, benchmark_context['repacked_radar_h5_file'])
+
+            benchmark_results = {}
+            for benchmark_name, benchmark_function in BENCHMARKS:
+                if selected_names is not None and benchmark_name not in selected_names:
+                    continue
+                if benchmark_name in BENCHMARK_SETUPS:
+                    BENCHMARK_SETUPS[benchmark_name](benchmark_context)
+                benchmark_results[benchmark_name] = measure_benchmark(benchmark_function, benchmark_context, repeats)
+                logging.info('{}/{}: {:.4f}s, peak {} bytes'.format(
+                    duration_name, benchmark_name, benchmark_results[benchmark_name]['seconds'],
+                    benchmark_results[benchmark_name]['peak_bytes']
+                ))
+            benchmark_context['radar_pyramid'].close()
+            return benchmark_results
+    finally:
+        shutil.rmtree(cache_directory)
+
+def compare_with_baseline(benchmark_report, baseline_report, tolerance):
+    regressions = []
+    for duration_name, benchmark_results in benchmark_report['results'].items():
+        for benchmark_name, benchmark_result in benchmark_results.items():
+            baseline_result = baseline_report['results'].get(duration_name, {}).get(benchmark_name)
+            if baseline_result is None:
+                continue
+            for measure_name in ['seconds', 'peak_bytes']:
+                if benchmark_result[measure_name] > tolerance * max(baseline_result[measure_name], 1e-6):
+                    regressions.append('{}/{} {} went from {} to {}'.format(
+                        duration_name, benchmark_name, measure_name,
+                        baseline_result[measure_name], benchmark_result[measure_name]
+                    ))
+    return regressions
+
+def print_benchmark_report(benchmark_report):
+    print('{:<8} {:<34} {:>12} {:>14} {:>10}'.format('scale', 'benchmark', 'seconds', 'peak bytes', 'processed'))
+    if 'startup' in benchmark_report:
+        print('{:<8} {:<34} {:>12.4f} {:>14} {:>10}'.format('cli', 'main.py --help', benchmark_report['startup']['seconds'], '', ''))
+    for duration_name, benchmark_results in benchmark_report['results'].items():
+        for benchmark_name, benchmark_result in benchmark_results.items():
+            print('{:<8} {:<34} {:>12.4f} {:>14} {:>10}'.format(
+                duration_name, benchmark_name, benchmark_result['seconds'],
+                benchmark_result['peak_bytes'], benchmark_result['processed']
+            ))
+
+def main():
+    root_argument_parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    root_argument_parser.add_argument('-l', '--log-level', type=int, default=logging.INFO)
+    root_argument_parser.add_argument('-d', '--durations', default='1h',
+        help='Comma separated lengths of synthetic recordings to benchmark, e.g., \'6h,1d,1w\'.')
+    root_argument_parser.add_argument('-s', '--sample-rate', type=float, default=2,
+        help='Radar samples per second of the synthetic recordings.')
+    root_argument_parser.add_argument('-f', '--environment-format', choices=['csv', 'xlsx'], default='csv')
+    root_argument_parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'fit4701_benchmarks'),
+        help='Directory the synthetic fixtures are generated in and reused from.')
+    root_argument_parser.add_argument('-b', '--benchmarks',
+        help='Comma separated names of the benchmarks to run, all by default.')
+    root_argument_parser.add_argument('-r', '--repeats', type=int, default=3)
+    root_argument_parser.add_argument('-o', '--output',
+        help='Path to write the JSON report to, e.g., to record a new baseline.')
+    root_argument_parser.add_argument('--baseline',
+        help='Path to a previous JSON report, exits with an error on regressions against it.')
+    root_argument_parser.add_argument('--tolerance', type=float, default=1.5,
+        help='Factor a measure may grow by relative to the baseline before counting as a regression.')
+    root_argument_parser.add_argument('--startup-budget', type=float, default=0.5,
+        help='Seconds \'main.py --help\' may take before the startup benchmark fails.')
+    root_argument_parser.add_argument('--startup-only', action='store_true',
+        help='Only measure the startup time of main.py, without generating any fixtures.')
+    program_arguments = root_argument_parser.parse_args()
+    logging.basicConfig(level=program_arguments.log_level, format='%(asctime)s '
+    '- %(name)s - %(levelname)s - %(message)s')
+
+    selected_names = None if program_arguments.benchmarks is None else program_arguments.benchmarks.split(',')
+    benchmark_report = {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sample_rate': program_arguments.sample_rate,
+        'results': {}
+    }
+    benchmark_report['startup'] = measure_cli_startup(program_arguments.repeats)
+    logging.info('main.py --help: {:.4f}s'.format(benchmark_report['startup']['seconds']))
+    for duration_name in [] if program_arguments.startup_only else program_arguments.durations.split(','):
+        benchmark_report['results'][duration_name] = run_benchmarks_for_duration(
+            program_arguments.fixture_dir, duration_name, program_arguments.sample_rate,
+            program_arguments.environment_format, selected_names, program_arguments.repeats
+        )
+    benchmark_report['max_rss_kilobytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print_benchmark_report(benchmark_report)
+
+    if program_arguments.output is not None:
+        with open(program_arguments.output, 'w') as output_file:
+            json.dump(benchmark_report, output_file, indent=2)
+        logging.info('Wrote benchmark report to... {}'.format(program_arguments.output))
+
+    startup_failures = check_cli_startup(benchmark_report['startup'], program_arguments.startup_budget)
+    for startup_failure in startup_failures:
+        logging.error('Startup: {}'.format(startup_failure))
+
+    regressions = []
+    if program_arguments.baseline is not None:
+        with open(program_arguments.baseline, 'r') as baseline_file:
+            baseline_report = json.load(baseline_file)
+        regressions = compare_with_baseline(benchmark_report, baseline_report, program_arguments.tolerance)
+        for regression in regressions:
+            logging.error('Regression: {}'.format(regression))
+    if len(startup_failures) > 0 or len(regressions) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import csv
+import logging
+import datetime
+import numpy as np
+import h5py
+from data_files.environments_excel import ENVIRONMENT_TIMESTAMP_FORMAT
+
+SYNTHETIC_LEVEL_COUNT = 414
+SYNTHETIC_START = datetime.datetime(2023, 10, 30, 0, 0)
+SYNTHETIC_WRITE_CHUNK_SIZE = 100000
+
+def parse_duration(duration):
+    units = {'m': 60, 'h': 60 * 60, 'd': 60 * 60 * 24, 'w': 60 * 60 * 24 * 7}
+    if len(duration) < 2 or duration[-1] not in units or not duration[:-1].isnumeric():
+        raise Exception('Duration should be a number followed by one of {}, was... {}'.format(list(units), duration))
+    return datetime.timedelta(seconds=int(duration[:-1]) * units[duration[-1]])
+
+def get_synthetic_moisture(epoch_seconds):
+    # A slow daily cycle plus a drying trend, so the radar levels have something to track.
+    elapsed_days = (epoch_seconds - SYNTHETIC_START.timestamp()) / (60 * 60 * 24)
+    return 15 + 3 * np.sin(2 * np.pi * elapsed_days) - 0.5 * elapsed_days
+
+def write_synthetic_radar_file(radar_h5_file, duration, sample_rate, seed=0):
+    random_generator = np.random.default_rng(seed)
+    sample_count = int(duration.total_seconds() * sample_rate)
+    start_epoch_seconds = SYNTHETIC_START.timestamp()
+    level_gains = random_generator.uniform(-5, 5, SYNTHETIC_LEVEL_COUNT)
+    level_offsets = random_generator.uniform(100, 300, SYNTHETIC_LEVEL_COUNT)
+
+    with h5py.File(radar_h5_file, 'w') as radar_file:
+        radar_file['timestamp'] = start_epoch_seconds
+        sample_times = radar_file.create_dataset('sample_times', (sample_count,), dtype=np.float64)
+        sensors_dataset = radar_file.create_dataset(
+            'data', (sample_count, 1, SYNTHETIC_LEVEL_COUNT), dtype=np.uint16,
+            chunks=(min(sample_count, 1024), 1, SYNTHETIC_LEVEL_COUNT)
+        )
+        for chunk_start in range(0, sample_count, SYNTHETIC_WRITE_CHUNK_SIZE):
+            chunk_stop = min(chunk_start + SYNTHETIC_WRITE_CHUNK_SIZE, sample_count)
+            chunk_times = start_epoch_seconds + np.arange(chunk_start, chunk_stop) / sample_rate
+            chunk_moistures = get_synthetic_moisture(chunk_times)
+            chunk_data = level_offsets + np.outer(chunk_moistures, level_gains) \
+                + random_generator.normal(0, 20, (chunk_stop - chunk_start, SYNTHETIC_LEVEL_COUNT))
+            sample_times[chunk_start:chunk_stop] = chunk_times
+            sensors_dataset[chunk_start:chunk_stop, 0] = np.clip(chunk_data, 0, np.iinfo(np.uint16).max)
+    logging.info('Wrote {} synthetic radar samples to... {}'.format(sample_count, radar_h5_file))
+
+def write_synthetic_environment_file(environment_file, duration, seed=0):
+    random_generator = np.random.default_rng(seed)
+    # Start a little early and end a little late so the overlap is decided by the radar file.
+    row_count = int(duration.total_seconds() // 60) + 4
+    environment_timestamps = [SYNTHETIC_START + datetime.timedelta(minutes=row_index - 2) for row_index in range(row_count)]
+    moistures = get_synthetic_moisture(np.array([timestamp.timestamp() for timestamp in environment_timestamps]))
+    moistures = np.round(moistures + random_generator.normal(0, 0.2, row_count), 1)
+
+    rows = [['TIMESTAMP', 'RECORD', 'Leaf Moisture'], ['TS', 'RN', '%']]
+    rows += [
+        [timestamp.strftime(ENVIRONMENT_TIMESTAMP_FORMAT), row_index, moisture]
+        for row_index, (timestamp, moisture) in enumerate(zip(environment_timestamps, moistures))
+    ]
+    if os.path.splitext(environment_file)[1].lower() == '.csv':
+        with open(environment_file, 'w', newline='') as csv_file:
+            csv.writer(csv_file).writerows(rows)
+    else:
+        import pandas as pd
+        pd.DataFrame(rows[1:], columns=rows[0]).to_excel(environment_file, index=False)
+    logging.info('Wrote {} synthetic environment rows to... {}'.format(row_count, environment_file))
+
+def get_synthetic_fixture(fixture_dir, duration_name, sample_rate, environment_format='csv'):
+    duration = parse_duration(duration_name)
+    fixture_name = 'synthetic_{}_{}hz'.format(duration_name, sample_rate)
+    radar_h5_file = os.path.join(fixture_dir, fixture_name + '.h5')
+    environment_file = os.path.join(fixture_dir, fixture_name + '.' + environment_format)
+    os.makedirs(fixture_dir, exist_ok=True)
+    if not os.path.isfile(radar_h5_file):
+        write_synthetic_radar_file(radar_h5_file, duration, sample_rate)
+    if not os.path.isfile(environment_file):
+        write_synthetic_environment_file(environment_file, duration)
+    return radar_h5_file, environment_file
@@ -1,9 +1,15 @@
 import os
-import pickle
 import logging
 import datetime
-from data_files.radar_h5 import get_radar_file_start_timestamp, get_radar_file_end_timestamp, get_radar_data_around_timestamp 
-from data_files.environments_excel import get_environment_information_start_timestamp, get_environment_information_end_timestamp 
+import collections
+import numpy as np
+from data_files import preprocessed_cache
+from data_files.resampling import get_environment_interval_windows, get_grid_windows, resample_radar_over_windows
+from profiling import profile_stage, profiled
+from data_files.radar_h5 import get_radar_file_start_timestamp, get_radar_file_end_timestamp, get_radar_data_around_timestamp, \
+    get_radar_time_index, read_radar_data_at_indices, datetime_to_epoch_seconds, timedelta_to_seconds, DEFAULT_CHUNK_SIZE
+from data_files.environments_excel import get_environment_information_start_timestamp, get_environment_information_end_timestamp, \
+    get_environment_information_around_timestamp, get_environment_information_epoch_seconds
 
 def find_greatest_overlap(radar_file, environment_information):
     radar_start, radar_end = get_radar_file_start_timestamp(radar_file), get_radar_file_end_timestamp(radar_file)
@@ -23,48 +29,156 @@ def find_greatest_overlap(radar_file, environment_information):
 def join_environment_and_radar_with_tolerance(radar_file, environment_data, join_frequency):
     latest_start, earliest_end = find_greatest_overlap(radar_file, environment_data) 
 
-    environment_and_radar = []
-    
+    join_timestamps = []
     current_timestamp = latest_start
     while current_timestamp <= earliest_end:
+        join_timestamps.append(current_timestamp)
+        current_timestamp += join_frequency 
+
+    radar_indices = get_radar_time_index(radar_file).find_nearest_indices(
+        [datetime_to_epoch_seconds(join_timestamp) for join_timestamp in join_timestamps],
+        timedelta_to_seconds(join_frequency / 2)
+    )
+    corresponding_radar = read_radar_data_at_indices(radar_file, radar_indices[radar_indices >= 0])
+    
+    environment_and_radar = []
+    radar_position = 0
+    for join_timestamp, radar_index in zip(join_timestamps, radar_indices):
+        if radar_index >= 0:
+            radar_data = corresponding_radar[radar_position]
+            radar_position += 1
+        else:
+            radar_data = None
         environment_and_radar.append((
-            current_timestamp,
-            get_radar_data_around_timestamp(radar_file, current_timestamp, join_frequency / 2),
-            get_environment_information_around_timestamp(current_timestamp, join_frequency / 2) 
+            join_timestamp,
+            radar_data,
+            get_environment_information_around_timestamp(environment_data, join_timestamp, join_frequency / 2) 
         ))
-
-        current_timestamp += join_frequency 
     
     return environment_and_radar
         
-PREPROCESSED_DATA_FILE = 'data/radar_and_moisture_preprocessed.pkl'
-def get_overlap_as_aggregated(radar_file, environment_information):
+RadarAndMoisture = collections.namedtuple('RadarAndMoisture', [
+    'environment_positions', 'environment_epoch_seconds', 'radar_indices', 'moistures', 'radar_levels'
+])
+
+def flatten_radar_rows(radar_rows):
+    return radar_rows[:, 0] if radar_rows.ndim == 3 else radar_rows
+
+def iterate_environment_and_radar_as_of(radar_file, environment_information, leniency_timedelta=datetime.timedelta(seconds=1),
+    chunk_size=DEFAULT_CHUNK_SIZE, dataset_name='data'):
     latest_start, earliest_end = find_greatest_overlap(radar_file, environment_information) 
 
-    if not os.path.isfile(PREPROCESSED_DATA_FILE):
-        radar_and_moisture = []
-        for row_index, _environment_information in enumerate(environment_information.iterrows()):   
-            logging.debug('At index {} of {}'.format(row_index, environment_information.shape[0]))
-
-            environment_timestamp = _environment_information[1]['TIMESTAMP'] 
-            
-            if environment_timestamp < latest_start or environment_timestamp > earliest_end:
-                logging.debug('Skipping finding corresponding radar data, latest start is... {}, earliest end is... {} and '
-                'environment timestamp is... {}'.format(latest_start, earliest_end, environment_timestamp))
-                continue
-            
-            corresponding_radar = get_radar_data_around_timestamp(radar_file, environment_timestamp, datetime.timedelta(seconds=1))
-            
-            if corresponding_radar is None:
-                logging.warning('No corresponding radar data found for environment data of timestamp... {}'.format(environment_timestamp)) 
-                continue 
-            
-            radar_and_moisture.append((_environment_information, corresponding_radar))
-        with open(PREPROCESSED_DATA_FILE, 'wb') as save_file:
-            pickle.dump(radar_and_moisture, save_file)
-            logging.info('Pickled processed radar and moisture to {}.'.format(PREPROCESSED_DATA_FILE))
+    environment_epoch_seconds = get_environment_information_epoch_seconds(environment_information)
+    is_within_overlap = (environment_epoch_seconds >= datetime_to_epoch_seconds(latest_start)) \
+        & (environment_epoch_seconds <= datetime_to_epoch_seconds(earliest_end))
+    logging.debug('Skipping {} environment rows outside of overlap {} to {}'.format(
+        np.count_nonzero(~is_within_overlap), latest_start, earliest_end))
+
+    radar_indices = np.full(environment_epoch_seconds.shape, -1, dtype=np.int64)
+    radar_indices[is_within_overlap] = get_radar_time_index(radar_file).find_nearest_indices(
+        environment_epoch_seconds[is_within_overlap], timedelta_to_seconds(leniency_timedelta)
+    )
+    is_unmatched = is_within_overlap & (radar_indices < 0)
+    if np.any(is_unmatched):
+        logging.warning('No corresponding radar data found for {} environment rows'.format(np.count_nonzero(is_unmatched)))
+
+    environment_positions = np.flatnonzero(radar_indices >= 0)
+    radar_indices = radar_indices[environment_positions]
+    moistures = environment_information['Leaf Moisture'].to_numpy()
+    # Always yield at least one (possibly empty) chunk so callers see the shape of the radar levels.
+    for chunk_start in range(0, max(1, environment_positions.shape[0]), chunk_size):
+        chunk_positions = environment_positions[chunk_start:chunk_start + chunk_size]
+        chunk_radar_indices = radar_indices[chunk_start:chunk_start + chunk_size]
+        yield RadarAndMoisture(
+            environment_positions=chunk_positions,
+            environment_epoch_seconds=environment_epoch_seconds[chunk_positions],
+            radar_indices=chunk_radar_indices,
+            moistures=moistures[chunk_positions].astype(np.float64),
+            radar_levels=flatten_radar_rows(
+                read_radar_data_at_indices(radar_file, chunk_radar_indices, chunk_size, dataset_name)
+            ),
+        )
+
+def concatenate_radar_and_moisture(radar_and_moisture_chunks):
+    return RadarAndMoisture(*[np.concatenate(field_chunks) for field_chunks in zip(*radar_and_moisture_chunks)])
+
+def join_environment_and_radar_as_of(radar_file, environment_information, leniency_timedelta=datetime.timedelta(seconds=1),
+    chunk_size=DEFAULT_CHUNK_SIZE, dataset_name='data'):
+    return concatenate_radar_and_moisture(list(iterate_environment_and_radar_as_of(
+        radar_file, environment_information, leniency_timedelta, chunk_size, dataset_name
+    )))
+
+MoistureAggregates = collections.namedtuple('MoistureAggregates', ['moistures', 'counts', 'means', 'variances'])
+
+@profiled('aggregate')
+def aggregate_radar_by_moisture(moistures, radar_levels):
+    sorted_order = np.argsort(moistures, kind='stable')
+    sorted_moistures = np.asarray(moistures)[sorted_order]
+    sorted_radar = np.asarray(radar_levels, dtype=np.float64)[sorted_order]
+
+    unique_moistures, group_starts, group_counts = np.unique(sorted_moistures, return_index=True, return_counts=True)
+    if unique_moistures.shape[0] == 0:
+        empty_levels = np.empty((0, sorted_radar.shape[1]))
+        return MoistureAggregates(unique_moistures, group_counts, empty_levels, empty_levels)
+    group_means = np.add.reduceat(sorted_radar, group_starts, axis=0) / group_counts[:, np.newaxis]
+    group_square_means = np.add.reduceat(np.square(sorted_radar), group_starts, axis=0) / group_counts[:, np.newaxis]
+    return MoistureAggregates(
+        moistures=unique_moistures,
+        counts=group_counts,
+        means=group_means,
+        variances=np.maximum(group_square_means - np.square(group_means), 0)
+    )
+
+def join_environment_and_radar_resampled(radar_file, environment_information, resample_options,
+    chunk_size=DEFAULT_CHUNK_SIZE, dataset_name='data'):
+    # Every radar sample within a window (an environment interval or a step of the grid) is reduced to
+    # the statistics of the window, instead of joining just the nearest sample.
+    if resample_options.join_frequency_seconds is None:
+        resampling_windows = get_environment_interval_windows(environment_information)
     else:
-        with open(PREPROCESSED_DATA_FILE, 'rb') as save_file:
-            radar_and_moisture = pickle.load(save_file)
-    
+        latest_start, earliest_end = find_greatest_overlap(radar_file, environment_information)
+        resampling_windows = get_grid_windows(environment_information, datetime_to_epoch_seconds(latest_start),
+            datetime_to_epoch_seconds(earliest_end), resample_options.join_frequency_seconds)
+    resampled_radar = resample_radar_over_windows(radar_file, resampling_windows, resample_options.statistics,
+        chunk_size, dataset_name)
+    moistures = environment_information['Leaf Moisture'].to_numpy()
+    return RadarAndMoisture(
+        environment_positions=resampled_radar.environment_positions,
+        environment_epoch_seconds=resampled_radar.epoch_seconds,
+        radar_indices=resampled_radar.first_radar_indices,
+        moistures=moistures[resampled_radar.environment_positions].astype(np.float64),
+        radar_levels=resampled_radar.radar_levels
+    )
+
+PREPROCESSED_JOIN_MODE = 'as_of'
+def get_overlap_as_aggregated(radar_file, environment_information, environment_file, chunk_size=DEFAULT_CHUNK_SIZE,
+    leniency_timedelta=datetime.timedelta(seconds=1), cache_directory=preprocessed_cache.CACHE_DIRECTORY, dataset_name='data',
+    resample_options=None):
+    cache_parameters = {'join_mode': PREPROCESSED_JOIN_MODE, 'leniency_seconds': timedelta_to_seconds(leniency_timedelta)}
+    if dataset_name != 'data':
+        # Only added for feature stores, so the keys of joins of the radar data cube stay as they were.
+        cache_parameters['dataset_name'] = dataset_name
+    if resample_options is not None:
+        cache_parameters = {'join_mode': 'resample', 'dataset_name': dataset_name, **resample_options._asdict()}
+    cache_key = preprocessed_cache.get_cache_key([radar_file.filename, environment_file], cache_parameters)
+    with profile_stage('load.preprocessed_cache') as load_stage:
+        cached_arrays = preprocessed_cache.load_cached_arrays(cache_key, cache_directory)
+        if cached_arrays is not None:
+            load_stage.add_rows(cached_arrays['moistures'].shape[0])
+    if cached_arrays is not None:
+        return RadarAndMoisture(**cached_arrays)
+
+    with profile_stage('join') as join_stage:
+        if resample_options is None:
+            radar_and_moisture = join_environment_and_radar_as_of(radar_file, environment_information, leniency_timedelta,
+                chunk_size, dataset_name)
+        else:
+            radar_and_moisture = join_environment_and_radar_resampled(radar_file, environment_information,
+                resample_options, chunk_size, dataset_name)
+        join_stage.add_rows(radar_and_moisture.moistures.shape[0])
+    preprocessed_cache.store_cached_arrays(
+        cache_key, radar_and_moisture._asdict(),
+        'Radar and moisture of {} and {}'.format(radar_file.filename, environment_file),
+        cache_directory
+    )
     return radar_and_moisture
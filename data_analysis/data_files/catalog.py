@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+import data_files
+from data_files.radar_h5 import get_radar_time_index, datetime_to_epoch_seconds, open_radar_file, DEFAULT_CHUNK_SIZE, \
+    REPACKED_RADAR_SUFFIX
+from data_files.environments_excel import load_environment_information, get_environment_information_epoch_seconds, \
+    ENVIRONMENT_SIDECAR_SUFFIX
+from data_files.feature_store import FEATURE_STORE_SUFFIX
+from data_files.radar_pyramid import RADAR_PYRAMID_SUFFIX
+from profiling import profile_stage
+
+CATALOG_FILE = 'catalog.json'
+RADAR_EXTENSIONS = ['.h5', '.hdf5']
+ENVIRONMENT_EXTENSIONS = ['.xlsx', '.xls', '.csv']
+# Files derived from recordings are written next to them, they are never recordings themselves.
+DERIVED_FILE_SUFFIXES = [ENVIRONMENT_SIDECAR_SUFFIX, FEATURE_STORE_SUFFIX, RADAR_PYRAMID_SUFFIX, REPACKED_RADAR_SUFFIX]
+
+def get_catalog_path(dataset_dir):
+    return os.path.join(dataset_dir, CATALOG_FILE)
+
+def get_dataset_file_span(dataset_file, file_kind):
+    if file_kind == 'radar':
+        with h5py.File(dataset_file, 'r') as radar_file:
+            if 'data' not in radar_file or 'sample_times' not in radar_file:
+                raise Exception('The h5 file has no radar data or sample times')
+            radar_time_index = get_radar_time_index(radar_file)
+            return radar_time_index.get_start_epoch_seconds(), radar_time_index.get_end_epoch_seconds()
+    environment_epoch_seconds = get_environment_information_epoch_seconds(load_environment_information(dataset_file))
+    if environment_epoch_seconds.shape[0] == 0:
+        return None, None
+    return float(environment_epoch_seconds.min()), float(environment_epoch_seconds.max())
+
+def get_dataset_file_kind(dataset_file):
+    if any(dataset_file.lower().endswith(derived_suffix) for derived_suffix in DERIVED_FILE_SUFFIXES):
+        return None
+    file_extension = os.path.splitext(dataset_file)[1].lower()
+    if file_extension in RADAR_EXTENSIONS:
+        return 'radar'
+    if file_extension in ENVIRONMENT_EXTENSIONS:
+        return 'environment'
+    return None
+
+def load_catalog(dataset_dir):
+    catalog_path = get_catalog_path(dataset_dir)
+    if not os.path.isfile(catalog_path):
+        return {'entries': []}
+    with open(catalog_path, 'r') as catalog_file:
+        return json.load(catalog_file)
+
+def build_catalog(dataset_dir):
+    previous_entries = {catalog_entry['name']: catalog_entry for catalog_entry in load_catalog(dataset_dir)['entries']}
+    catalog_entries = []
+    for file_name in sorted(os.listdir(dataset_dir)):
+        dataset_file = os.path.join(dataset_dir, file_name)
+        file_kind = get_dataset_file_kind(dataset_file)
+        if file_kind is None or not os.path.isfile(dataset_file):
+            continue
+        file_status = os.stat(dataset_file)
+        previous_entry = previous_entries.get(file_name)
+        if previous_entry is not None and previous_entry['size'] == file_status.st_size \
+        and previous_entry['mtime_ns'] == file_status.st_mtime_ns:
+            catalog_entries.append(previous_entry)
+            continue
+
+        logging.info('Indexing time span of {} file... {}'.format(file_kind, dataset_file))
+        try:
+            span_start, span_end = get_dataset_file_span(dataset_file, file_kind)
+        except Exception as e:
+            logging.warning('Could not index {}, was... {}'.format(dataset_file, e))
+            continue
+        catalog_entries.append({
+            'name': file_name,
+            'kind': file_kind,
+            'size': file_status.st_size,
+            'mtime_ns': file_status.st_mtime_ns,
+            'start': None if span_start is None else float(span_start),
+            'end': None if span_end is None else float(span_end)
+        })
+
+    catalog = {'entries': catalog_entries}
+    with open(get_catalog_path(dataset_dir), 'w') as catalog_file:
+        json.dump(catalog, catalog_file, indent=2)
+    return catalog
+
+def parse_date_range(date_range):
+    if date_range is None:
+        return None, None
+    if len(date_range.split(',')) != 2:
+        raise Exception('Date range should be like \'2023-10-30,2023-11-02\', was... {}'.format(date_range))
+    return tuple(
+        None if date_bound.strip() == '' else datetime.datetime.fromisoformat(date_bound.strip())
+        for date_bound in date_range.split(',')
+    )
+
+def find_overlapping_pairs(catalog, range_start=None, range_end=None):
+    range_start = -np.inf if range_start is None else datetime_to_epoch_seconds(range_start)
+    range_end = np.inf if range_end is None else datetime_to_epoch_seconds(range_end)
+    def get_entries(file_kind):
+        return [
+            catalog_entry for catalog_entry in catalog['entries']
+            if catalog_entry['kind'] == file_kind and catalog_entry['start'] is not None
+            and catalog_entry['start'] < range_end and catalog_entry['end'] >= range_start
+        ]
+    return [
+        (radar_entry['name'], environment_entry['name'])
+        for radar_entry in get_entries('radar')
+        for environment_entry in get_entries('environment')
+        if radar_entry['start'] <= environment_entry['end'] and environment_entry['start'] <= radar_entry['end']
+    ]
+
+def get_dataset_file_pairs(dataset_dir, date_range=None):
+    range_start, range_end = parse_date_range(date_range)
+    return [
+        (os.path.join(dataset_dir, radar_name), os.path.join(dataset_dir, environment_name))
+        for radar_name, environment_name in find_overlapping_pairs(build_catalog(dataset_dir), range_start, range_end)
+    ]
+
+def select_radar_and_moisture_in_range(radar_and_moisture, range_start=None, range_end=None):
+    is_within_range = np.ones(radar_and_moisture.moistures.shape, dtype=bool)
+    if range_start is not None:
+        is_within_range &= radar_and_moisture.environment_epoch_seconds >= datetime_to_epoch_seconds(range_start)
+    if range_end is not None:
+        is_within_range &= radar_and_moisture.environment_epoch_seconds < datetime_to_epoch_seconds(range_end)
+    return data_files.RadarAndMoisture(*[field[is_within_range] for field in radar_and_moisture])
+
+def join_dataset_pair(radar_h5_file, environment_file, chunk_size, resample_options=None):
+    with open_radar_file(radar_h5_file, 'random') as radar_file:
+        environment_information = load_environment_information(environment_file)
+        radar_and_moisture = data_files.get_overlap_as_aggregated(radar_file, environment_information,
+            environment_file, chunk_size, resample_options=resample_options)
+        # Copy out of the memory mapped cache so the arrays can be sent back to the parent process.
+        return data_files.RadarAndMoisture(*[np.array(field) for field in radar_and_moisture])
+
+def join_dataset_date_range(dataset_dir, date_range=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+    resample_options=None):
+    range_start, range_end = parse_date_range(date_range)
+    dataset_pairs = get_dataset_file_pairs(dataset_dir, date_range)
+    if len(dataset_pairs) == 0:
+        raise Exception('No overlapping radar and environment files in {} for date range... {}'
+            .format(dataset_dir, date_range))
+    logging.info('Joining {} radar and environment file pairs with {} workers'.format(len(dataset_pairs), workers))
+
+    # Stages within the worker processes are not recorded, the join is timed as a whole from here.
+    with profile_stage('join') as join_stage, ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_chunks = [
+            executor.submit(join_dataset_pair, radar_h5_file, environment_file, chunk_size, resample_options)
+            for radar_h5_file, environment_file in dataset_pairs
+        ]
+        # A pair that cannot be read is left out of the join rather than failing the pairs that can.
+        radar_and_moisture_chunks = []
+        for (radar_h5_file, environment_file), pending_chunk in zip(dataset_pairs, pending_chunks):
+            try:
+                radar_and_moisture_chunks.append(pending_chunk.result())
+            except Exception as e:
+                logging.warning('Could not join {} with {}, skipping the pair, was... {}'.format(
+                    radar_h5_file, environment_file, e))
+        if len(radar_and_moisture_chunks) == 0:
+            raise Exception('None of the {} radar and environment file pairs in {} could be joined'.format(
+                len(dataset_pairs), dataset_dir))
+        radar_and_moisture = select_radar_and_moisture_in_range(
+            data_files.concatenate_radar_and_moisture(radar_and_moisture_chunks), range_start, range_end
+        )
+        join_stage.add_rows(radar_and_moisture.moistures.shape[0])
+    return radar_and_moisture
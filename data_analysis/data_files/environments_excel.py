@@ -1,30 +1,208 @@
+import os
+import uuid
+import logging
 import datetime
+import weakref
+import numpy as np
+import pandas as pd
+from data_files.radar_h5 import datetime_to_epoch_seconds, timedelta_to_seconds, find_nearest_sorted_positions
+from profiling import profile_stage
+
+ENVIRONMENT_TIMESTAMP_FORMAT = "%m/%d/%y %H:%M"
+ENVIRONMENT_EPOCH_COLUMN = 'EPOCH_NANOSECONDS'
+ENVIRONMENT_SIDECAR_SUFFIX = '.columns.npz'
+ENVIRONMENT_SIDECAR_VERSION = 1
+# Offsets from UTC change at quarter hours at the finest (on the hour in most time zones).
+UTC_OFFSET_STEP_NANOSECONDS = 15 * 60 * 10**9
 
 def environment_timestamp_to_datetime(environment_timestamp):
-    return datetime.datetime.strptime(environment_timestamp, "%m/%d/%y %H:%M")
+    return datetime.datetime.strptime(environment_timestamp, ENVIRONMENT_TIMESTAMP_FORMAT)
+
+def parse_environment_timestamps(environment_timestamps):
+    try:
+        return pd.to_datetime(environment_timestamps, format=ENVIRONMENT_TIMESTAMP_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(environment_timestamps)
+
+def read_environment_file(environment_file):
+    # The row after the header holds the units of each column.
+    if os.path.splitext(environment_file)[1].lower() == '.csv':
+        environment_information = pd.read_csv(environment_file, skiprows=[1], engine='c', low_memory=False)
+    else:
+        environment_information = pd.read_excel(environment_file).iloc[1:, :]
+    environment_information = environment_information.reset_index(drop=True)
+
+    environment_information['TIMESTAMP'] = parse_environment_timestamps(environment_information['TIMESTAMP']) \
+        .astype('datetime64[ns]')
+    for column_name in environment_information.columns[1:]:
+        numeric_column = pd.to_numeric(environment_information[column_name], errors='coerce')
+        if numeric_column.isna().sum() == environment_information[column_name].isna().sum():
+            environment_information[column_name] = numeric_column.astype(np.float64)
+    add_environment_epoch_column(environment_information)
+    return environment_information
+
+def add_environment_epoch_column(environment_information):
+    # The timestamps are naive local times, so the offset from UTC is found like `datetime_to_epoch_seconds` does,
+    # but once per distinct quarter hour and added to every row at once, rather than once per row.
+    local_nanoseconds = environment_information['TIMESTAMP'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    is_valid = local_nanoseconds != np.iinfo(np.int64).min
+    local_steps, step_positions = np.unique(local_nanoseconds[is_valid] // UTC_OFFSET_STEP_NANOSECONDS,
+        return_inverse=True)
+    step_offsets = np.array([
+        round(datetime_to_epoch_seconds(
+            datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=int(local_step) * UTC_OFFSET_STEP_NANOSECONDS // 1000)
+        ) * 1e9) - int(local_step) * UTC_OFFSET_STEP_NANOSECONDS
+        for local_step in local_steps
+    ], dtype=np.int64)
+    epoch_nanoseconds = local_nanoseconds.copy()
+    epoch_nanoseconds[is_valid] += step_offsets[step_positions.reshape(-1)]
+    environment_information[ENVIRONMENT_EPOCH_COLUMN] = epoch_nanoseconds
+
+def get_environment_file_identity(environment_file):
+    file_status = os.stat(environment_file)
+    return np.array([ENVIRONMENT_SIDECAR_VERSION, file_status.st_size, file_status.st_mtime_ns], dtype=np.int64)
+
+def load_environment_sidecar(sidecar_path, source_identity):
+    with np.load(sidecar_path) as sidecar_arrays:
+        if not np.array_equal(sidecar_arrays['source_identity'], source_identity):
+            return None
+        column_names = list(sidecar_arrays['column_names'])
+        environment_information = pd.DataFrame({
+            column_name: sidecar_arrays['column_{}'.format(column_index)]
+            for column_index, column_name in enumerate(column_names)
+        }, columns=column_names)
+    environment_information['TIMESTAMP'] = environment_information['TIMESTAMP'].astype('datetime64[ns]')
+    return environment_information
+
+def save_environment_sidecar(sidecar_path, source_identity, environment_information):
+    column_arrays = {}
+    for column_index, column_name in enumerate(environment_information.columns):
+        column_array = environment_information[column_name].to_numpy()
+        if column_array.dtype == object:
+            column_array = column_array.astype(str)
+        column_arrays['column_{}'.format(column_index)] = column_array
+    # Written next to the sidecar and renamed over it, so a crash or a worker saving the same sidecar at the
+    # same time never leaves a truncated one behind.
+    staging_path = '{}.{}.staging'.format(sidecar_path, uuid.uuid4().hex)
+    try:
+        with open(staging_path, 'wb') as sidecar_file:
+            np.savez(sidecar_file, source_identity=source_identity,
+                column_names=np.array(environment_information.columns, dtype=str), **column_arrays)
+        os.replace(staging_path, sidecar_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+def load_environment_information(environment_file):
+    sidecar_path = environment_file + ENVIRONMENT_SIDECAR_SUFFIX
+    source_identity = get_environment_file_identity(environment_file)
+    if os.path.isfile(sidecar_path):
+        try:
+            with profile_stage('load.environment_sidecar') as load_stage:
+                environment_information = load_environment_sidecar(sidecar_path, source_identity)
+                if environment_information is not None:
+                    load_stage.add_rows(environment_information.shape[0])
+        except Exception as e:
+            logging.warning('Could not read environment sidecar {}, was... {}'.format(sidecar_path, e))
+            environment_information = None
+        if environment_information is not None:
+            logging.info('Loaded parsed environment information from... {}'.format(sidecar_path))
+            return environment_information
+
+    with profile_stage('load.environment_parse') as load_stage:
+        environment_information = read_environment_file(environment_file)
+        load_stage.add_rows(environment_information.shape[0], os.path.getsize(environment_file))
+    try:
+        save_environment_sidecar(sidecar_path, source_identity, environment_information)
+        logging.info('Saved parsed environment information to... {}'.format(sidecar_path))
+    except OSError as e:
+        logging.warning('Could not write environment sidecar {}, was... {}'.format(sidecar_path, e))
+    return environment_information
+
+def get_environment_information_epoch_seconds(environment_information):
+    if ENVIRONMENT_EPOCH_COLUMN in environment_information.columns:
+        return environment_information[ENVIRONMENT_EPOCH_COLUMN].to_numpy(dtype=np.float64) / 1e9
+    def to_epoch_seconds(environment_timestamp):
+        if isinstance(environment_timestamp, str):
+            environment_timestamp = environment_timestamp_to_datetime(environment_timestamp)
+        return datetime_to_epoch_seconds(environment_timestamp)
+    return np.fromiter(
+        map(to_epoch_seconds, environment_information['TIMESTAMP']), 
+        dtype=np.float64, count=environment_information.shape[0]
+    )
+
+class EnvironmentTimeIndex:
+    def __init__(self, environment_information):
+        epoch_seconds = get_environment_information_epoch_seconds(environment_information)
+        if epoch_seconds.shape[0] > 1 and np.any(np.diff(epoch_seconds) < 0):
+            logging.warning('Environment timestamps are not monotonic, sorting a copy for lookups.')
+            self.sorted_order = np.argsort(epoch_seconds, kind='stable')
+            self.epoch_seconds = epoch_seconds[self.sorted_order]
+        else:
+            self.sorted_order = None
+            self.epoch_seconds = epoch_seconds
+        self.environment_information = environment_information
+        self.columns = {}
+
+    def __len__(self):
+        return self.epoch_seconds.shape[0]
+
+    def get_column(self, column_name):
+        # Columns are materialized in time order once, so range queries below are slices (views) of them.
+        if column_name not in self.columns:
+            column = self.environment_information[column_name].to_numpy()
+            self.columns[column_name] = column if self.sorted_order is None else column[self.sorted_order]
+        return self.columns[column_name]
+
+    def find_positions_between(self, start_timestamp, end_timestamp):
+        return (
+            int(np.searchsorted(self.epoch_seconds, datetime_to_epoch_seconds(start_timestamp), side='right')),
+            int(np.searchsorted(self.epoch_seconds, datetime_to_epoch_seconds(end_timestamp), side='left'))
+        )
+
+    def get_column_between_timestamps(self, column_name, start_timestamp, end_timestamp):
+        start_position, end_position = self.find_positions_between(start_timestamp, end_timestamp)
+        return self.get_column(column_name)[start_position:max(start_position, end_position)]
+
+    def find_nearest_row_position(self, center_datetime, leniency_timedelta):
+        nearest_position = find_nearest_sorted_positions(
+            self.epoch_seconds, [datetime_to_epoch_seconds(center_datetime)],
+            timedelta_to_seconds(leniency_timedelta), self.sorted_order
+        )[0]
+        return None if nearest_position < 0 else int(nearest_position)
+
+# Keyed on the identity of the data frame, so in place edits of a loaded frame are not picked up.
+_environment_time_indices = {}
+def get_environment_time_index(environment_information):
+    environment_key = id(environment_information)
+    environment_time_index = _environment_time_indices.get(environment_key)
+    if environment_time_index is None:
+        environment_time_index = EnvironmentTimeIndex(environment_information)
+        _environment_time_indices[environment_key] = environment_time_index
+        weakref.finalize(environment_information, _environment_time_indices.pop, environment_key, None)
+    return environment_time_index
 
 def get_environment_information_start_timestamp(environment_information):
-    return min(environment_information.iloc[:, 0])
+    return environment_information.iloc[:, 0].min()
 
 def get_environment_information_end_timestamp(environment_information):
-    return max(environment_information.iloc[:, 0])
+    return environment_information.iloc[:, 0].max()
 
 def get_environment_information_around_timestamp(environment_information, center_datetime, leniency_timedelta):
-    closest_row, smallest_timedelta = None, None
-    for row_information in environment_information.iterrows():      
-        row_timestamp = row_information[1]['TIMESTAMP'] 
-        candidate_timedelta = center_datetime - row_timestamp
-        if abs(candidate_timedelta.total_seconds()) < leniency_timedelta.total_seconds():
-            if (closest_row is None and smallest_timedelta is None) \
-            or (abs(candidate_timedelta.total_seconds()) < smallest_timedelta.total_seconds()):
-                closest_row, smallest_timedelta = row_information, candidate_timedelta
-    return closest_row
+    row_position = get_environment_time_index(environment_information) \
+        .find_nearest_row_position(center_datetime, leniency_timedelta)
+    if row_position is None:
+        return None
+    return (environment_information.index[row_position], environment_information.iloc[row_position])
 
 def get_environment_information_between_timestamps(environment_information, start_timestamp, end_timestamp):
-    def allow_between_start_and_end(position_and_row):
-        if position_and_row[1]['TIMESTAMP'] > start_timestamp \
-        and position_and_row[1]['TIMESTAMP'] < end_timestamp:
-            return True
-        else:
-            return False 
-    return list(filter(allow_between_start_and_end, list(environment_information.iterrows())))
+    environment_time_index = get_environment_time_index(environment_information)
+    start_position, end_position = environment_time_index.find_positions_between(start_timestamp, end_timestamp)
+    row_positions = np.arange(start_position, max(start_position, end_position))
+    if environment_time_index.sorted_order is not None:
+        row_positions = environment_time_index.sorted_order[row_positions]
+    return list(environment_information.iloc[row_positions].iterrows())
+
+def get_environment_column_between_timestamps(environment_information, column_name, start_timestamp, end_timestamp):
+    return get_environment_time_index(environment_information) \
+        .get_column_between_timestamps(column_name, start_timestamp, end_timestamp)
@@ -0,0 +1,132 @@
+import os
+import uuid
+import logging
+import numpy as np
+import h5py
+from data_files.radar_h5 import iterate_radar_data_chunks, get_radar_sample_count, open_radar_file
+from miscellaneous import DEFAULT_CHUNK_SIZE, DEFAULT_FEATURE_NAME
+from profiling import profile_stage
+
+FEATURE_STORE_VERSION = 1
+FEATURE_STORE_SUFFIX = '.features.h5'
+# Rows per chunk of every feature dataset, so reading a span of samples touches few chunks of each.
+FEATURE_STORE_CHUNK_ROWS = 4096
+FEATURE_STORE_COMPRESSIONS = ['gzip', 'lzf', 'none']
+
+def parse_level_bands(level_bands):
+    # Bands are 1-based and inclusive like the power levels of `plot versus`, e.g., '1-50,51-120,121-414'.
+    parsed_bands = []
+    for level_band in level_bands.split(','):
+        band_bounds = level_band.strip().split('-')
+        if len(band_bounds) != 2 or not all(band_bound.isnumeric() for band_bound in band_bounds) \
+        or int(band_bounds[0]) < 1 or int(band_bounds[0]) > int(band_bounds[1]):
+            raise Exception('Level bands should be like \'1-50,51-414\', was... {}'.format(level_bands))
+        parsed_bands.append((int(band_bounds[0]), int(band_bounds[1])))
+    return np.array(parsed_bands, dtype=np.int64)
+
+def get_band_sums(radar_levels, level_bands):
+    # Prefix sums over the levels make every band a difference of two columns, whatever its width.
+    level_prefix_sums = np.concatenate([
+        np.zeros((radar_levels.shape[0], 1)), np.cumsum(radar_levels, axis=1, dtype=np.float64)
+    ], axis=1)
+    return level_prefix_sums[:, level_bands[:, 1]] - level_prefix_sums[:, level_bands[:, 0] - 1]
+
+def get_normalized_spectra(radar_levels, level_sums):
+    normalized_spectra = np.zeros(radar_levels.shape, dtype=np.float32)
+    np.divide(radar_levels, level_sums, out=normalized_spectra, where=level_sums != 0, casting='unsafe')
+    return normalized_spectra
+
+def create_feature_dataset(feature_file, feature_name, sample_count, column_count, data_type, compression):
+    return feature_file.create_dataset(
+        feature_name, (sample_count, column_count), dtype=data_type,
+        chunks=(max(1, min(sample_count, FEATURE_STORE_CHUNK_ROWS)), column_count),
+        compression=None if compression == 'none' else compression,
+        shuffle=compression != 'none'
+    )
+
+def build_feature_store(radar_file, feature_store_path, level_bands=None, pca_projection=None,
+    chunk_size=DEFAULT_CHUNK_SIZE, compression='gzip', workers=1):
+    if compression not in FEATURE_STORE_COMPRESSIONS:
+        raise Exception('Compression should be one of {}, was... {}'.format(FEATURE_STORE_COMPRESSIONS, compression))
+    sample_count = get_radar_sample_count(radar_file)
+    level_count = radar_file['data'].shape[-1]
+    if level_bands is not None and np.any(level_bands[:, 1] > level_count):
+        raise Exception('Level bands should be within the {} levels of the radar file, were... {}'
+            .format(level_count, level_bands.tolist()))
+
+    staging_path = '{}.{}.staging'.format(feature_store_path, uuid.uuid4().hex)
+    try:
+        with h5py.File(staging_path, 'w') as feature_file:
+            radar_status = os.stat(radar_file.filename)
+            feature_file.attrs['feature_store_version'] = FEATURE_STORE_VERSION
+            feature_file.attrs['radar_h5_file'] = os.path.basename(radar_file.filename)
+            feature_file.attrs['radar_identity'] = np.array([radar_status.st_size, radar_status.st_mtime_ns], dtype=np.int64)
+            feature_file['timestamp'] = radar_file['timestamp'][()]
+            sample_times = feature_file.create_dataset('sample_times', (sample_count,), dtype=np.float64,
+                chunks=(max(1, min(sample_count, FEATURE_STORE_CHUNK_ROWS)),))
+
+            feature_datasets = {
+                'level_sums': create_feature_dataset(feature_file, 'level_sums', sample_count, 1, np.float64, compression),
+                'normalized_spectra': create_feature_dataset(feature_file, 'normalized_spectra', sample_count,
+                    level_count, np.float32, compression)
+            }
+            if level_bands is not None:
+                feature_datasets['band_sums'] = create_feature_dataset(feature_file, 'band_sums', sample_count,
+                    level_bands.shape[0], np.float64, compression)
+                feature_datasets['band_sums'].attrs['level_bands'] = level_bands
+            if pca_projection is not None:
+                pca_model = pca_projection.named_steps['pca']
+                feature_datasets['pca_scores'] = create_feature_dataset(feature_file, 'pca_scores', sample_count,
+                    pca_model.n_components_, np.float64, compression)
+                feature_datasets['pca_scores'].attrs['explained_variance'] = pca_model.explained_variance_
+
+            chunk_start = 0
+            for chunk_times, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, workers=workers):
+                radar_levels = sensors_data.transpose()
+                chunk_stop = chunk_start + radar_levels.shape[0]
+                level_sums = radar_levels.sum(axis=1, dtype=np.float64)[:, np.newaxis]
+                sample_times[chunk_start:chunk_stop] = chunk_times
+                feature_datasets['level_sums'][chunk_start:chunk_stop] = level_sums
+                feature_datasets['normalized_spectra'][chunk_start:chunk_stop] = get_normalized_spectra(radar_levels, level_sums)
+                if level_bands is not None:
+                    feature_datasets['band_sums'][chunk_start:chunk_stop] = get_band_sums(radar_levels, level_bands)
+                if pca_projection is not None:
+                    feature_datasets['pca_scores'][chunk_start:chunk_stop] = pca_projection.transform(radar_levels)
+                logging.debug('Derived features of samples %s to %s', chunk_start, chunk_stop)
+                chunk_start = chunk_stop
+        os.replace(staging_path, feature_store_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    logging.info('Wrote features {} of {} samples to... {}'.format(list(feature_datasets), sample_count, feature_store_path))
+
+def open_feature_store(feature_store_path, feature_name=DEFAULT_FEATURE_NAME):
+    feature_file = h5py.File(feature_store_path, 'r')
+    if feature_file.attrs.get('feature_store_version') != FEATURE_STORE_VERSION:
+        feature_file.close()
+        raise Exception('Not a feature store of version {}, rebuild it with \'features build\'... {}'
+            .format(FEATURE_STORE_VERSION, feature_store_path))
+    if feature_name not in feature_file or feature_name in ['timestamp', 'sample_times']:
+        feature_names = get_feature_names(feature_file)
+        feature_file.close()
+        raise Exception('The feature store has no feature {}, has... {}'.format(feature_name, feature_names))
+    return feature_file
+
+def get_feature_names(feature_file):
+    return [dataset_name for dataset_name in feature_file if dataset_name not in ['timestamp', 'sample_times']]
+
+def iterate_feature_chunks(feature_file, feature_name, chunk_size=DEFAULT_CHUNK_SIZE, region_start=0, region_stop=None):
+    sample_count = feature_file['sample_times'].shape[0]
+    region_stop = sample_count if region_stop is None else min(region_stop, sample_count)
+    for chunk_start in range(region_start, region_stop, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, region_stop)
+        with profile_stage('read.feature_chunks') as read_stage:
+            chunk_times = feature_file['sample_times'][chunk_start:chunk_stop]
+            feature_data = feature_file[feature_name][chunk_start:chunk_stop]
+            read_stage.add_rows(chunk_stop - chunk_start, chunk_times.nbytes + feature_data.nbytes)
+        yield chunk_times, feature_data
+
+def open_radar_or_feature_store(radar_h5_file, dataset_name='data'):
+    if dataset_name == 'data':
+        return open_radar_file(radar_h5_file, 'random')
+    return open_feature_store(radar_h5_file, dataset_name)
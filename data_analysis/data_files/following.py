@@ -0,0 +1,116 @@
+import io
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from data_files.radar_h5 import refresh_radar_file
+from data_files.environments_excel import ENVIRONMENT_EPOCH_COLUMN, parse_environment_timestamps, \
+    add_environment_epoch_column
+from miscellaneous import DEFAULT_FOLLOW_POLL_SECONDS
+
+# Bytes before the loaded size searched for the start of its last line, far longer than a row of the logger.
+ENVIRONMENT_LINE_LOOKBACK_BYTES = 64 * 1024
+
+def iterate_appended_regions(radar_file, region_start=0, poll_seconds=DEFAULT_FOLLOW_POLL_SECONDS, idle_seconds=None,
+    should_continue=None, wait=time.sleep):
+    # Yields the rows already in the file from the region start, then the rows appended since each previous poll,
+    # so callers only ever process new samples however large the file has grown.
+    processed_count = region_start
+    last_growth_time = time.monotonic()
+    while should_continue is None or should_continue():
+        sample_count = refresh_radar_file(radar_file)
+        if sample_count < processed_count:
+            raise Exception('The followed radar file shrank from {} to {} samples, was it replaced?... {}'.format(
+                processed_count, sample_count, radar_file.filename))
+        if sample_count > processed_count:
+            yield processed_count, sample_count
+            processed_count = sample_count
+            last_growth_time = time.monotonic()
+            continue
+        if idle_seconds is not None and time.monotonic() - last_growth_time >= idle_seconds:
+            logging.info('No samples were appended for {} seconds, stopped following... {}'.format(
+                idle_seconds, radar_file.filename))
+            return
+        wait(poll_seconds)
+
+class RunningLevelStatistics:
+    # Count, mean and spread per level of every sample followed so far, updated from each appended range alone.
+    def __init__(self):
+        self.count = 0
+        self.sums = None
+        self.square_sums = None
+
+    def update(self, sensors_data):
+        sensors_data = np.asarray(sensors_data, dtype=np.float64)
+        if self.sums is None:
+            self.sums = np.zeros(sensors_data.shape[0])
+            self.square_sums = np.zeros(sensors_data.shape[0])
+        self.count += sensors_data.shape[1]
+        self.sums += sensors_data.sum(axis=1)
+        self.square_sums += np.square(sensors_data).sum(axis=1)
+
+    def get_means(self):
+        return self.sums / max(self.count, 1)
+
+    def get_stds(self):
+        means = self.get_means()
+        return np.sqrt(np.maximum(self.square_sums / max(self.count, 1) - np.square(means), 0))
+
+class EnvironmentFileFollower:
+    # Reads the rows a logger appends to a csv environment file from where the previous read stopped, leaving
+    # partially written lines for the next read. The file size is the one measured before the environment
+    # information was loaded, so no row logged while loading is missed.
+    def __init__(self, environment_file, environment_information, loaded_file_size):
+        self.environment_file = environment_file
+        self.is_followable = os.path.splitext(environment_file)[1].lower() == '.csv'
+        if not self.is_followable:
+            logging.warning('Only csv environment files can be followed, not reading rows appended to... {}'
+                .format(environment_file))
+        self.column_names = [
+            column_name for column_name in environment_information.columns if column_name != ENVIRONMENT_EPOCH_COLUMN
+        ]
+        self.numeric_column_names = [
+            column_name for column_name in self.column_names[1:]
+            if environment_information[column_name].dtype == np.float64
+        ]
+        self.read_offset = self.get_line_start(loaded_file_size) if self.is_followable else loaded_file_size
+        # Rows written while the file was being loaded are read again, so only rows later than those loaded are kept.
+        self.last_epoch_nanoseconds = environment_information[ENVIRONMENT_EPOCH_COLUMN].max() \
+            if environment_information.shape[0] > 0 else None
+
+    def get_line_start(self, file_offset):
+        # A line being written when the size was measured is read again as a whole, rather than from its middle.
+        with open(self.environment_file, 'rb') as environment_file:
+            environment_file.seek(max(0, file_offset - ENVIRONMENT_LINE_LOOKBACK_BYTES))
+            preceding_bytes = environment_file.read(file_offset - environment_file.tell())
+        return file_offset - len(preceding_bytes) + preceding_bytes.rfind(b'\n') + 1
+
+    def read_appended_rows(self):
+        if not self.is_followable:
+            return None
+        file_size = os.path.getsize(self.environment_file)
+        if file_size < self.read_offset:
+            raise Exception('The followed environment file shrank, was it replaced?... {}'.format(self.environment_file))
+        if file_size == self.read_offset:
+            return None
+        with open(self.environment_file, 'rb') as environment_file:
+            environment_file.seek(self.read_offset)
+            appended_bytes = environment_file.read(file_size - self.read_offset)
+        complete_length = appended_bytes.rfind(b'\n') + 1
+        if complete_length == 0:
+            return None
+        self.read_offset += complete_length
+
+        appended_rows = pd.read_csv(io.BytesIO(appended_bytes[:complete_length]), names=self.column_names, header=None)
+        appended_rows['TIMESTAMP'] = parse_environment_timestamps(appended_rows['TIMESTAMP']).astype('datetime64[ns]')
+        for column_name in self.numeric_column_names:
+            appended_rows[column_name] = pd.to_numeric(appended_rows[column_name], errors='coerce').astype(np.float64)
+        add_environment_epoch_column(appended_rows)
+        if self.last_epoch_nanoseconds is not None:
+            appended_rows = appended_rows[appended_rows[ENVIRONMENT_EPOCH_COLUMN] > self.last_epoch_nanoseconds]
+        if appended_rows.shape[0] == 0:
+            return None
+        self.last_epoch_nanoseconds = appended_rows[ENVIRONMENT_EPOCH_COLUMN].max()
+        logging.debug('Read %s rows appended to %s', appended_rows.shape[0], self.environment_file)
+        return appended_rows.reset_index(drop=True)
@@ -0,0 +1,138 @@
+import os
+import json
+import errno
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import numpy as np
+
+CACHE_DIRECTORY = os.path.join('data', 'cache')
+CACHE_MAXIMUM_BYTES = 1024 ** 3
+CACHE_FORMAT_VERSION = 1
+CACHE_METADATA_FILE = 'metadata.json'
+CACHE_STAGING_PREFIX = '.staging-'
+
+def get_file_identity(file_path):
+    file_status = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'size': file_status.st_size,
+        'mtime_ns': file_status.st_mtime_ns
+    }
+
+def get_cache_key(input_files, parameters):
+    key_source = json.dumps({
+        'version': CACHE_FORMAT_VERSION,
+        'inputs': [get_file_identity(input_file) for input_file in input_files],
+        'parameters': parameters
+    }, sort_keys=True)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def get_cache_entry_size(entry_directory):
+    return sum(
+        os.path.getsize(os.path.join(entry_directory, entry_file))
+        for entry_file in os.listdir(entry_directory)
+    )
+
+def load_cached_arrays(cache_key, cache_directory=CACHE_DIRECTORY):
+    entry_directory = os.path.join(cache_directory, cache_key)
+    metadata_path = os.path.join(entry_directory, CACHE_METADATA_FILE)
+    if not os.path.isfile(metadata_path):
+        return None
+    with open(metadata_path, 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    cached_arrays = {
+        array_name: np.load(os.path.join(entry_directory, array_name + '.npy'), mmap_mode='r')
+        for array_name in metadata['arrays']
+    }
+    # The modification time of the metadata file doubles as the last used time for eviction.
+    os.utime(metadata_path)
+    logging.info('Loaded cached arrays from... {}'.format(entry_directory))
+    return cached_arrays
+
+def store_cached_arrays(cache_key, arrays, description, cache_directory=CACHE_DIRECTORY,
+    maximum_bytes=CACHE_MAXIMUM_BYTES):
+    os.makedirs(cache_directory, exist_ok=True)
+    staging_directory = os.path.join(cache_directory, CACHE_STAGING_PREFIX + uuid.uuid4().hex)
+    try:
+        os.makedirs(staging_directory)
+        for array_name, array in arrays.items():
+            np.save(os.path.join(staging_directory, array_name + '.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(staging_directory, CACHE_METADATA_FILE), 'w') as metadata_file:
+            json.dump({
+                'key': cache_key,
+                'arrays': list(arrays.keys()),
+                'description': description,
+                'created': time.time()
+            }, metadata_file)
+
+        entry_directory = os.path.join(cache_directory, cache_key)
+        if os.path.isdir(entry_directory):
+            shutil.rmtree(entry_directory, ignore_errors=True)
+        try:
+            os.replace(staging_directory, entry_directory)
+            logging.info('Cached arrays to... {}'.format(entry_directory))
+        except OSError as e:
+            # Another process (like a worker joining the same pair) cached the key in between, with the same arrays.
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST) or not os.path.isdir(entry_directory):
+                raise
+            logging.info('Arrays were already cached to... {}'.format(entry_directory))
+    finally:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+
+    evict_cache_entries(cache_directory, maximum_bytes, kept_key=cache_key)
+
+def list_cache_entries(cache_directory=CACHE_DIRECTORY):
+    if not os.path.isdir(cache_directory):
+        return []
+    cache_entries = []
+    for cache_key in os.listdir(cache_directory):
+        metadata_path = os.path.join(cache_directory, cache_key, CACHE_METADATA_FILE)
+        if not os.path.isfile(metadata_path):
+            continue
+        # Another process (like a worker of a parallel join) may evict or replace the entry while it is listed.
+        try:
+            with open(metadata_path, 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+            cache_entries.append({
+                'key': cache_key,
+                'size': get_cache_entry_size(os.path.join(cache_directory, cache_key)),
+                'last_used': os.path.getmtime(metadata_path),
+                'created': metadata['created'],
+                'description': metadata['description']
+            })
+        except OSError as e:
+            logging.debug('Skipping cache entry %s that changed while listing, was... %s', cache_key, e)
+    return sorted(cache_entries, key=lambda cache_entry: cache_entry['last_used'], reverse=True)
+
+def evict_cache_entries(cache_directory=CACHE_DIRECTORY, maximum_bytes=CACHE_MAXIMUM_BYTES, kept_key=None):
+    cache_entries = list_cache_entries(cache_directory)
+    total_bytes = sum(cache_entry['size'] for cache_entry in cache_entries)
+    for cache_entry in reversed(cache_entries):
+        if total_bytes <= maximum_bytes:
+            break
+        # The entry just stored is kept even when it alone is over budget, or every run would join and write it again.
+        if cache_entry['key'] == kept_key:
+            if cache_entry['size'] > maximum_bytes:
+                logging.warning('Cache entry {} of {} bytes is larger than the cache budget of {} bytes'.format(
+                    cache_entry['key'], cache_entry['size'], maximum_bytes))
+            continue
+        logging.info('Evicting cache entry... {} ({} bytes)'.format(cache_entry['key'], cache_entry['size']))
+        # Workers storing at the same time may evict the same entry, whichever is second finds it gone.
+        shutil.rmtree(os.path.join(cache_directory, cache_entry['key']), ignore_errors=True)
+        total_bytes -= cache_entry['size']
+
+def clear_cache(cache_directory=CACHE_DIRECTORY):
+    if not os.path.isdir(cache_directory):
+        return 0
+    cleared_count = 0
+    for cache_key in os.listdir(cache_directory):
+        entry_directory = os.path.join(cache_directory, cache_key)
+        if os.path.isfile(os.path.join(entry_directory, CACHE_METADATA_FILE)):
+            cleared_count += 1
+        elif not cache_key.startswith(CACHE_STAGING_PREFIX):
+            continue
+        shutil.rmtree(entry_directory)
+    return cleared_count
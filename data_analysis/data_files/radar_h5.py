@@ -1,35 +1,345 @@
+import os
+import uuid
+import logging
 import datetime
-import bisect
+import math
+import weakref
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+from miscellaneous import DEFAULT_CHUNK_SIZE
+from profiling import profile_stage
+
+# Bytes of decompressed chunks HDF5 keeps per dataset, instead of its 1 MiB default, for scattered row reads
+# (joins, lookups around timestamps) and for panning back and forth over regions of the heatmap.
+RADAR_CHUNK_CACHE_BYTES = {
+    'random': 64 * 1024 * 1024,
+    'interactive': 256 * 1024 * 1024
+}
+RADAR_ACCESS_PATTERNS = ['sequential', 'random', 'interactive']
+# Rows per chunk of repacked recordings, about a MiB of 414 levels of 16 bit samples.
+REPACK_CHUNK_ROWS = 1024
+REPACK_COMPRESSIONS = ['lz4', 'gzip', 'lzf', 'none']
+# Repacked copies are written next to the radar file with this suffix, which the dataset catalog skips.
+REPACKED_RADAR_SUFFIX = '.repacked.h5'
 
 def reoriente_sensor_data(sensors_data):
     return sensors_data.swapaxes(0, 1)[:][0].swapaxes(0, 1)
 
+def datetime_to_epoch_seconds(center_datetime):
+    # Pandas treats naive timestamps as UTC, whereas the radar sample times are read back with
+    # `datetime.fromtimestamp` (local time), so always go through the standard library.
+    if hasattr(center_datetime, 'to_pydatetime'):
+        center_datetime = center_datetime.to_pydatetime()
+    return center_datetime.timestamp()
+
+def timedelta_to_seconds(leniency_timedelta):
+    if hasattr(leniency_timedelta, 'total_seconds'):
+        return leniency_timedelta.total_seconds()
+    return float(leniency_timedelta)
+
+def find_nearest_sorted_positions(sorted_times, center_epoch_seconds, leniency_seconds, sorted_order=None):
+    center_epoch_seconds = np.asarray(center_epoch_seconds, dtype=np.float64)
+    nearest_positions = np.full(center_epoch_seconds.shape, -1, dtype=np.int64)
+    if sorted_times.shape[0] == 0:
+        return nearest_positions
+
+    right_positions = np.searchsorted(sorted_times, center_epoch_seconds, side='left')
+    right_positions = np.clip(right_positions, 0, sorted_times.shape[0] - 1)
+    left_positions = np.clip(right_positions - 1, 0, sorted_times.shape[0] - 1)
+    right_deltas = np.abs(sorted_times[right_positions] - center_epoch_seconds)
+    left_deltas = np.abs(sorted_times[left_positions] - center_epoch_seconds)
+
+    is_left_closer = left_deltas < right_deltas
+    candidate_positions = np.where(is_left_closer, left_positions, right_positions)
+    candidate_deltas = np.where(is_left_closer, left_deltas, right_deltas)
+    is_within_leniency = candidate_deltas < leniency_seconds
+
+    if sorted_order is not None:
+        candidate_positions = sorted_order[candidate_positions]
+    nearest_positions[is_within_leniency] = candidate_positions[is_within_leniency]
+    return nearest_positions
+
+class RadarTimeIndex:
+    def __init__(self, radar_file):
+        self.sample_times = np.asarray(radar_file['sample_times'][:], dtype=np.float64)
+        self.sample_time_buffer = self.sample_times
+        # Feature stores share the sample times of their radar file but have no data cube of their own.
+        if 'data' in radar_file and self.sample_times.shape[0] != radar_file['data'].shape[0]:
+            logging.warning('Data and timestamps are not of the same length.')
+
+        if self.sample_times.shape[0] > 1 and np.any(np.diff(self.sample_times) < 0):
+            logging.warning('Radar sample times are not monotonic, sorting a copy for lookups.')
+            self.sorted_order = np.argsort(self.sample_times, kind='stable')
+            self.sorted_times = self.sample_times[self.sorted_order]
+        else:
+            self.sorted_order = None
+            self.sorted_times = self.sample_times
+
+    def __len__(self):
+        return self.sample_times.shape[0]
+
+    def refresh(self, radar_file):
+        # Appends the sample times written since the index was built, growing the buffer geometrically so that
+        # following a file that is still being recorded costs only the appended rows.
+        appended_times = np.asarray(radar_file['sample_times'][len(self):], dtype=np.float64)
+        if appended_times.shape[0] == 0:
+            return 0
+        sample_count = len(self)
+        if sample_count + appended_times.shape[0] > self.sample_time_buffer.shape[0]:
+            sample_time_buffer = np.empty(max(2 * self.sample_time_buffer.shape[0], sample_count + appended_times.shape[0]))
+            sample_time_buffer[:sample_count] = self.sample_times
+            self.sample_time_buffer = sample_time_buffer
+        self.sample_time_buffer[sample_count:sample_count + appended_times.shape[0]] = appended_times
+        self.sample_times = self.sample_time_buffer[:sample_count + appended_times.shape[0]]
+
+        is_appended_in_order = np.all(np.diff(appended_times) >= 0) and \
+            (sample_count == 0 or appended_times[0] >= self.sorted_times[-1])
+        if self.sorted_order is None and is_appended_in_order:
+            self.sorted_times = self.sample_times
+        else:
+            logging.warning('Appended radar sample times are not monotonic, sorting a copy for lookups.')
+            self.sorted_order = np.argsort(self.sample_times, kind='stable')
+            self.sorted_times = self.sample_times[self.sorted_order]
+        return appended_times.shape[0]
+
+    def get_start_epoch_seconds(self):
+        return self.sorted_times[0] if len(self) > 0 else None
+
+    def get_end_epoch_seconds(self):
+        return self.sorted_times[-1] if len(self) > 0 else None
+
+    def find_nearest_indices(self, center_epoch_seconds, leniency_seconds):
+        return find_nearest_sorted_positions(self.sorted_times, center_epoch_seconds, leniency_seconds, self.sorted_order)
+
+    def find_nearest_index(self, center_datetime, leniency_timedelta):
+        nearest_index = self.find_nearest_indices(
+            [datetime_to_epoch_seconds(center_datetime)],
+            timedelta_to_seconds(leniency_timedelta)
+        )[0]
+        return None if nearest_index < 0 else int(nearest_index)
+
+_radar_time_indices = weakref.WeakKeyDictionary()
+def get_radar_time_index(radar_file):
+    radar_time_index = _radar_time_indices.get(radar_file)
+    if radar_time_index is None:
+        radar_time_index = RadarTimeIndex(radar_file)
+        _radar_time_indices[radar_file] = radar_time_index
+        logging.debug('Built radar time index of {} samples for... {}'.format(len(radar_time_index), radar_file.filename))
+    return radar_time_index
+
+def refresh_radar_file(radar_file):
+    # Only files opened with `swmr=True` see the rows a writer appended since they were opened.
+    for dataset_name in ['sample_times', 'data']:
+        radar_file[dataset_name].refresh()
+    radar_time_index = _radar_time_indices.get(radar_file)
+    if radar_time_index is not None:
+        radar_time_index.refresh(radar_file)
+    return get_radar_sample_count(radar_file)
+
 def get_radar_file_start_timestamp(radar_file):
-    return datetime.datetime.fromtimestamp(
-        min(radar_file['sample_times'][:])
-    ) 
+    start_epoch_seconds = get_radar_time_index(radar_file).get_start_epoch_seconds()
+    if start_epoch_seconds is None:
+        return None
+    return datetime.datetime.fromtimestamp(start_epoch_seconds)
 
 def get_radar_file_end_timestamp(radar_file):
-    return datetime.datetime.fromtimestamp(
-        max(radar_file['sample_times'][:])
-    ) 
+    end_epoch_seconds = get_radar_time_index(radar_file).get_end_epoch_seconds()
+    if end_epoch_seconds is None:
+        return None
+    return datetime.datetime.fromtimestamp(end_epoch_seconds)
+
+def get_next_prime(number):
+    def is_prime(candidate):
+        return candidate > 1 and all(candidate % divisor != 0 for divisor in range(2, math.isqrt(candidate) + 1))
+    while not is_prime(number):
+        number += 1
+    return number
+
+def get_radar_chunk_cache_parameters(data_shape, data_chunks, item_size, access_pattern):
+    chunk_bytes = int(np.prod(data_chunks)) * item_size
+    if access_pattern == 'sequential':
+        # Every chunk is read once as whole rows go by, only the chunks straddling two reads need to stay cached.
+        chunks_across = int(np.prod([math.ceil(size / chunk) for size, chunk in zip(data_shape[1:], data_chunks[1:])]))
+        cache_bytes = max(1024 * 1024, 2 * chunks_across * chunk_bytes)
+        eviction_weight = 1.0
+    else:
+        cache_bytes = max(RADAR_CHUNK_CACHE_BYTES[access_pattern], 2 * chunk_bytes)
+        eviction_weight = 0.75
+    # HDF5 suggests a prime number of slots, around a hundred times the chunks that fit in the cache.
+    return {
+        'rdcc_nbytes': cache_bytes,
+        'rdcc_nslots': get_next_prime(max(521, 100 * (cache_bytes // chunk_bytes))),
+        'rdcc_w0': eviction_weight
+    }
+
+def import_compression_filters():
+    # Registers the filters of `repack --compression lz4` with HDF5 when the optional hdf5plugin is installed.
+    try:
+        import hdf5plugin
+        return True
+    except ImportError:
+        return False
+
+def open_radar_file(radar_h5_file, access_pattern='sequential', swmr=False):
+    if access_pattern not in RADAR_ACCESS_PATTERNS:
+        raise Exception('Access pattern should be one of {}, was... {}'.format(RADAR_ACCESS_PATTERNS, access_pattern))
+    with profile_stage('load.radar_h5'):
+        import_compression_filters()
+        with h5py.File(radar_h5_file, 'r', swmr=swmr) as radar_file:
+            radar_dataset = radar_file.get('data')
+            if radar_dataset is None or radar_dataset.chunks is None:
+                chunk_cache_parameters = {}
+            else:
+                chunk_cache_parameters = get_radar_chunk_cache_parameters(
+                    radar_dataset.shape, radar_dataset.chunks, radar_dataset.dtype.itemsize, access_pattern
+                )
+        logging.debug('Opening {} for {} access with chunk cache... {}'.format(
+            radar_h5_file, access_pattern, chunk_cache_parameters))
+        # Single writer, multiple reader mode lets a recording in progress be read as the logger appends to it.
+        return h5py.File(radar_h5_file, 'r', swmr=swmr, **chunk_cache_parameters)
 
 def get_radar_data_around_timestamp(radar_file, center_datetime, leniency_timedelta):
-    if radar_file['sample_times'].shape[0] != radar_file['data'].shape[0]:
-        logging.warning('Data and timestamps are not of the same length.')
-    
-    radar_timestamps = list(map(lambda x: datetime.datetime.fromtimestamp(x), radar_file['sample_times'][:]))
-    candidate_indices = [bisect.bisect_left(radar_timestamps, center_datetime),
-        bisect.bisect_right(radar_timestamps, center_datetime)]
-    get_delta = lambda x: abs((center_datetime - x).total_seconds())
-    candidate_index = min(candidate_indices, key=lambda x: get_delta(radar_timestamps[x]))
-    if get_delta(radar_timestamps[candidate_index]) \
-    >= leniency_timedelta.total_seconds():
+    candidate_index = get_radar_time_index(radar_file).find_nearest_index(center_datetime, leniency_timedelta)
+    if candidate_index is None:
         return None
 
     return radar_file['data'][candidate_index]
 
+def read_radar_data_at_indices(radar_file, radar_indices, chunk_size=DEFAULT_CHUNK_SIZE, dataset_name='data'):
+    radar_indices = np.asarray(radar_indices, dtype=np.int64)
+    radar_dataset = radar_file[dataset_name]
+    if radar_indices.shape[0] == 0:
+        return np.empty((0,) + radar_dataset.shape[1:], dtype=radar_dataset.dtype)
+    with profile_stage('read.radar_rows') as read_stage:
+        # h5py only supports increasing, unique fancy indices, so read those once and scatter back.
+        unique_indices, inverse_indices = np.unique(radar_indices, return_inverse=True)
+        unique_data = np.concatenate([
+            radar_dataset[unique_indices[chunk_start:chunk_start + chunk_size]]
+            for chunk_start in range(0, unique_indices.shape[0], chunk_size)
+        ])
+        read_stage.add_rows(unique_indices.shape[0], unique_data.nbytes)
+        return unique_data[inverse_indices]
+
+def get_radar_sample_count(radar_file):
+    return min(radar_file['sample_times'].shape[0], radar_file['data'].shape[0])
+
+def read_radar_sensor_data(radar_file, region_start, region_stop):
+    radar_dataset = radar_file['data']
+    if radar_dataset.ndim == 2:
+        # Repacked recordings have already dropped the middle axis.
+        return radar_dataset[region_start:region_stop].transpose()
+    # Only the first entry of the middle axis is kept by `reoriente_sensor_data`, so skip reading the rest.
+    return reoriente_sensor_data(radar_dataset[region_start:region_stop, :1])
+
+def read_radar_data_chunk(radar_h5_file, chunk_start, chunk_stop):
+    with open_radar_file(radar_h5_file, 'sequential') as radar_file:
+        return radar_file['sample_times'][chunk_start:chunk_stop], read_radar_sensor_data(radar_file, chunk_start, chunk_stop)
+
+def wait_for_radar_data_chunk(pending_chunk):
+    # Only the time spent waiting on the workers counts as reading, the rest overlaps with the caller.
+    with profile_stage('read.radar_chunks') as read_stage:
+        chunk_times, sensors_data = pending_chunk.result()
+        read_stage.add_rows(chunk_times.shape[0], chunk_times.nbytes + sensors_data.nbytes)
+    return chunk_times, sensors_data
+
+def iterate_radar_data_chunks(radar_file, chunk_size=DEFAULT_CHUNK_SIZE, region_start=0, region_stop=None, workers=1):
+    if chunk_size <= 0:
+        raise Exception('Chunk size should be positive, was... {}'.format(chunk_size))
+    sample_count = get_radar_sample_count(radar_file)
+    region_stop = sample_count if region_stop is None else min(region_stop, sample_count)
+    chunk_bounds = [
+        (chunk_start, min(chunk_start + chunk_size, region_stop)) for chunk_start in range(region_start, region_stop, chunk_size)
+    ]
+    if workers <= 1 or len(chunk_bounds) <= 1:
+        for chunk_start, chunk_stop in chunk_bounds:
+            with profile_stage('read.radar_chunks') as read_stage:
+                chunk_times = radar_file['sample_times'][chunk_start:chunk_stop]
+                sensors_data = read_radar_sensor_data(radar_file, chunk_start, chunk_stop)
+                read_stage.add_rows(chunk_stop - chunk_start, chunk_times.nbytes + sensors_data.nbytes)
+            yield chunk_times, sensors_data
+        return
+
+    # h5py serializes every call behind one lock, so reads (and decompression) only run in parallel across processes.
+    # At most two chunks per worker are in flight, keeping memory bounded while chunks are yielded in order.
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_chunks = collections.deque()
+        for chunk_start, chunk_stop in chunk_bounds:
+            pending_chunks.append(executor.submit(read_radar_data_chunk, radar_file.filename, chunk_start, chunk_stop))
+            if len(pending_chunks) >= 2 * workers:
+                yield wait_for_radar_data_chunk(pending_chunks.popleft())
+        while len(pending_chunks) > 0:
+            yield wait_for_radar_data_chunk(pending_chunks.popleft())
+
+def get_radar_data_overview(radar_file, overview_width, chunk_size=DEFAULT_CHUNK_SIZE, region_start=0, region_stop=None):
+    sample_count = get_radar_sample_count(radar_file)
+    region_stop = sample_count if region_stop is None else min(region_stop, sample_count)
+    bin_size = max(1, math.ceil((region_stop - region_start) / overview_width))
+    chunk_size = max(bin_size, chunk_size // bin_size * bin_size)
+
+    overview_columns = []
+    for _, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop):
+        bin_starts = np.arange(0, sensors_data.shape[1], bin_size)
+        bin_sizes = np.diff(np.append(bin_starts, sensors_data.shape[1]))
+        overview_columns.append(np.add.reduceat(sensors_data, bin_starts, axis=1, dtype=np.float64) / bin_sizes)
+    if len(overview_columns) == 0:
+        return np.empty((radar_file['data'].shape[-1], 0)), bin_size
+    return np.concatenate(overview_columns, axis=1), bin_size
+
 def get_radar_data_timestamp_from_index(radar_file, radar_index):
     return datetime.datetime.fromtimestamp(
         radar_file['sample_times'][radar_index]
-    ) 
+    )
+
+def get_repack_compression_options(compression):
+    if compression == 'lz4':
+        if not import_compression_filters():
+            raise Exception('Compressing with lz4 needs the hdf5plugin package, install it or use gzip.')
+        import hdf5plugin
+        return dict(hdf5plugin.LZ4())
+    if compression == 'gzip':
+        return {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+    if compression == 'lzf':
+        return {'compression': 'lzf', 'shuffle': True}
+    if compression == 'none':
+        return {}
+    raise Exception('Compression should be one of {}, was... {}'.format(REPACK_COMPRESSIONS, compression))
+
+def repack_radar_file(radar_file, repacked_path, compression='gzip', chunk_rows=REPACK_CHUNK_ROWS,
+    chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    compression_options = get_repack_compression_options(compression)
+    sample_count = get_radar_sample_count(radar_file)
+    level_count = radar_file['data'].shape[-1]
+    if radar_file['data'].ndim == 3 and radar_file['data'].shape[1] > 1:
+        logging.warning('Only the first of {} entries of the middle axis is kept, like `reoriente_sensor_data`'
+            .format(radar_file['data'].shape[1]))
+    # Whole chunks per read, so each chunk of the repacked file is compressed exactly once.
+    chunk_rows = max(1, min(chunk_rows, sample_count))
+    chunk_size = max(chunk_rows, chunk_size // chunk_rows * chunk_rows)
+
+    staging_path = '{}.{}.staging'.format(repacked_path, uuid.uuid4().hex)
+    try:
+        with h5py.File(staging_path, 'w') as repacked_file:
+            for dataset_name in radar_file:
+                if dataset_name not in ['data', 'sample_times']:
+                    radar_file.copy(dataset_name, repacked_file)
+            repacked_file.attrs.update(radar_file.attrs)
+            repacked_file.attrs['repacked_compression'] = compression
+            sample_times = repacked_file.create_dataset('sample_times', (sample_count,), dtype=np.float64,
+                chunks=(chunk_rows,), **compression_options)
+            sensors_dataset = repacked_file.create_dataset('data', (sample_count, level_count),
+                dtype=radar_file['data'].dtype, chunks=(chunk_rows, level_count), **compression_options)
+
+            chunk_start = 0
+            for chunk_times, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, workers=workers):
+                chunk_stop = chunk_start + chunk_times.shape[0]
+                sample_times[chunk_start:chunk_stop] = chunk_times
+                sensors_dataset[chunk_start:chunk_stop] = sensors_data.transpose()
+                logging.debug('Repacked samples %s to %s', chunk_start, chunk_stop)
+                chunk_start = chunk_stop
+        os.replace(staging_path, repacked_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    logging.info('Repacked {} samples with {} compression to... {}'.format(sample_count, compression, repacked_path))
@@ -0,0 +1,159 @@
+import os
+import math
+import uuid
+import logging
+import collections
+import numpy as np
+import h5py
+from data_files.radar_h5 import iterate_radar_data_chunks, get_radar_sample_count, read_radar_sensor_data, \
+    DEFAULT_CHUNK_SIZE
+
+RADAR_PYRAMID_SUFFIX = '.pyramid.h5'
+RADAR_PYRAMID_VERSION = 1
+# Samples per column of the finest stored level, and how many columns of a level make up one column of the next.
+RADAR_PYRAMID_BASE_BIN = 16
+RADAR_PYRAMID_FACTOR = 4
+
+RadarLevelOfDetail = collections.namedtuple('RadarLevelOfDetail', [
+    'minimums', 'maximums', 'means', 'bin_size', 'column_start'
+])
+
+def get_radar_pyramid_identity(radar_h5_file):
+    file_status = os.stat(radar_h5_file)
+    return np.array([
+        RADAR_PYRAMID_VERSION, RADAR_PYRAMID_BASE_BIN, RADAR_PYRAMID_FACTOR, file_status.st_size, file_status.st_mtime_ns
+    ], dtype=np.int64)
+
+def get_radar_pyramid_bin_size(pyramid_level):
+    return RADAR_PYRAMID_BASE_BIN * RADAR_PYRAMID_FACTOR ** pyramid_level
+
+def reduce_pyramid_columns(minimums, maximums, sums, counts, factor):
+    # Columns are along the first axis, every block of `factor` of them becomes one (the last may be partial).
+    block_starts = np.arange(0, counts.shape[0], factor)
+    return (
+        np.minimum.reduceat(minimums, block_starts, axis=0),
+        np.maximum.reduceat(maximums, block_starts, axis=0),
+        np.add.reduceat(sums, block_starts, axis=0),
+        np.add.reduceat(counts, block_starts)
+    )
+
+def append_pyramid_columns(level_group, minimums, maximums, sums, counts):
+    column_count = level_group['count'].shape[0]
+    for dataset_name, columns in [
+        ('minimum', minimums), ('maximum', maximums), ('mean', sums / counts[:, np.newaxis]), ('count', counts)
+    ]:
+        level_group[dataset_name].resize(column_count + counts.shape[0], axis=0)
+        level_group[dataset_name][column_count:] = columns
+
+def create_pyramid_level(pyramid_file, pyramid_level, level_count, data_type):
+    level_group = pyramid_file.create_group('level_{}'.format(pyramid_level))
+    level_group.attrs['bin_size'] = get_radar_pyramid_bin_size(pyramid_level)
+    # Time major chunks, so reading a span of columns touches as few chunks as possible.
+    for dataset_name, dataset_type in [('minimum', data_type), ('maximum', data_type), ('mean', np.float32)]:
+        level_group.create_dataset(dataset_name, (0, level_count), maxshape=(None, level_count), dtype=dataset_type,
+            chunks=(256, level_count))
+    level_group.create_dataset('count', (0,), maxshape=(None,), dtype=np.int64, chunks=(4096,))
+    return level_group
+
+def build_radar_pyramid(radar_file, sidecar_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    sample_count = get_radar_sample_count(radar_file)
+    level_count, data_type = radar_file['data'].shape[-1], radar_file['data'].dtype
+    chunk_size = max(RADAR_PYRAMID_BASE_BIN, chunk_size // RADAR_PYRAMID_BASE_BIN * RADAR_PYRAMID_BASE_BIN)
+
+    staging_path = '{}.{}.staging'.format(sidecar_path, uuid.uuid4().hex)
+    try:
+        with h5py.File(staging_path, 'w') as pyramid_file:
+            pyramid_file.attrs['identity'] = get_radar_pyramid_identity(radar_file.filename)
+            pyramid_file.attrs['sample_count'] = sample_count
+
+            level_group = create_pyramid_level(pyramid_file, 0, level_count, data_type)
+            for _, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size):
+                sensors_data = sensors_data.transpose()
+                append_pyramid_columns(level_group, *reduce_pyramid_columns(
+                    sensors_data, sensors_data, sensors_data.astype(np.float64),
+                    np.ones(sensors_data.shape[0], dtype=np.int64), RADAR_PYRAMID_BASE_BIN
+                ))
+
+            pyramid_level = 0
+            while level_group['count'].shape[0] > 1:
+                previous_group = level_group
+                pyramid_level += 1
+                level_group = create_pyramid_level(pyramid_file, pyramid_level, level_count, data_type)
+                column_chunk_size = max(RADAR_PYRAMID_FACTOR, chunk_size // RADAR_PYRAMID_FACTOR * RADAR_PYRAMID_FACTOR)
+                for column_start in range(0, previous_group['count'].shape[0], column_chunk_size):
+                    column_slice = slice(column_start, column_start + column_chunk_size)
+                    counts = previous_group['count'][column_slice]
+                    append_pyramid_columns(level_group, *reduce_pyramid_columns(
+                        previous_group['minimum'][column_slice], previous_group['maximum'][column_slice],
+                        previous_group['mean'][column_slice].astype(np.float64) * counts[:, np.newaxis],
+                        counts, RADAR_PYRAMID_FACTOR
+                    ))
+            pyramid_file.attrs['pyramid_levels'] = pyramid_level + 1
+        os.replace(staging_path, sidecar_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    logging.info('Built {} level radar pyramid over {} samples to... {}'.format(
+        pyramid_level + 1, sample_count, sidecar_path))
+
+class RadarPyramid:
+    def __init__(self, pyramid_file):
+        self.pyramid_file = pyramid_file
+        self.pyramid_levels = int(pyramid_file.attrs['pyramid_levels'])
+        self.sample_count = int(pyramid_file.attrs['sample_count'])
+
+    def select_pyramid_level(self, region_width, target_columns):
+        # The coarsest level that still has a column per pixel, None when raw samples are needed for that.
+        selected_level = None
+        for pyramid_level in range(self.pyramid_levels):
+            if get_radar_pyramid_bin_size(pyramid_level) * target_columns > region_width:
+                break
+            selected_level = pyramid_level
+        return selected_level
+
+    def get_region(self, pyramid_level, region_start, region_stop):
+        bin_size = get_radar_pyramid_bin_size(pyramid_level)
+        column_slice = slice(region_start // bin_size, math.ceil(region_stop / bin_size))
+        level_group = self.pyramid_file['level_{}'.format(pyramid_level)]
+        return RadarLevelOfDetail(
+            level_group['minimum'][column_slice].transpose(),
+            level_group['maximum'][column_slice].transpose(),
+            level_group['mean'][column_slice].transpose(),
+            bin_size,
+            column_slice.start
+        )
+
+    def close(self):
+        self.pyramid_file.close()
+
+def open_radar_pyramid(radar_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    sidecar_path = radar_file.filename + RADAR_PYRAMID_SUFFIX
+    source_identity = get_radar_pyramid_identity(radar_file.filename)
+    if os.path.isfile(sidecar_path):
+        try:
+            pyramid_file = h5py.File(sidecar_path, 'r')
+            if np.array_equal(pyramid_file.attrs['identity'], source_identity):
+                logging.info('Loaded radar pyramid from... {}'.format(sidecar_path))
+                return RadarPyramid(pyramid_file)
+            pyramid_file.close()
+        except Exception as e:
+            logging.warning('Could not read radar pyramid {}, was... {}'.format(sidecar_path, e))
+
+    try:
+        build_radar_pyramid(radar_file, sidecar_path, chunk_size)
+    except OSError as e:
+        logging.warning('Could not write radar pyramid {}, was... {}'.format(sidecar_path, e))
+        return None
+    return RadarPyramid(h5py.File(sidecar_path, 'r'))
+
+def get_radar_data_level_of_detail(radar_file, radar_pyramid, region_start, region_stop, target_columns):
+    region_stop = min(region_stop, get_radar_sample_count(radar_file))
+    pyramid_level = None
+    if radar_pyramid is not None:
+        pyramid_level = radar_pyramid.select_pyramid_level(region_stop - region_start, target_columns)
+    if pyramid_level is not None:
+        return radar_pyramid.get_region(pyramid_level, region_start, region_stop)
+
+    # Finer than the base bin, so at most RADAR_PYRAMID_BASE_BIN samples per column are read.
+    sensors_data = read_radar_sensor_data(radar_file, region_start, region_stop)
+    return RadarLevelOfDetail(sensors_data, sensors_data, sensors_data.astype(np.float32), 1, region_start)
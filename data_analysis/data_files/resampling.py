@@ -0,0 +1,149 @@
+import logging
+import collections
+import numpy as np
+from data_files.radar_h5 import get_radar_time_index, iterate_radar_data_chunks, DEFAULT_CHUNK_SIZE
+from data_files.environments_excel import get_environment_time_index
+from data_files.feature_store import iterate_feature_chunks
+
+RESAMPLE_STATISTICS = ['mean', 'median', 'std']
+
+# Statistics of the radar samples within each window, concatenated along the levels in the order given, and the
+# spacing of a fixed grid of windows in seconds (None for a window per environment row).
+ResampleOptions = collections.namedtuple('ResampleOptions', ['statistics', 'join_frequency_seconds'])
+
+# Contiguous windows between consecutive edges (epoch seconds), each joined to the environment row at its position.
+ResamplingWindows = collections.namedtuple('ResamplingWindows', [
+    'edges', 'is_right_closed', 'environment_positions', 'epoch_seconds'
+])
+
+ResampledRadar = collections.namedtuple('ResampledRadar', [
+    'environment_positions', 'epoch_seconds', 'first_radar_indices', 'sample_counts', 'radar_levels'
+])
+
+def parse_resample_statistics(statistics):
+    parsed_statistics = [statistic.strip() for statistic in statistics.split(',')]
+    if len(parsed_statistics) == 0 or any(statistic not in RESAMPLE_STATISTICS for statistic in parsed_statistics) \
+    or len(set(parsed_statistics)) != len(parsed_statistics):
+        raise Exception('Statistics should be distinct ones of {}, were... {}'.format(RESAMPLE_STATISTICS, statistics))
+    return parsed_statistics
+
+def get_environment_interval_windows(environment_information):
+    # Loggers stamp a row at the end of the interval it covers, so each row gets the samples since the previous row.
+    environment_time_index = get_environment_time_index(environment_information)
+    epoch_seconds = environment_time_index.epoch_seconds
+    if epoch_seconds.shape[0] == 0:
+        raise Exception('The environment information has no rows to resample the radar data over.')
+    environment_positions = np.arange(epoch_seconds.shape[0]) if environment_time_index.sorted_order is None \
+        else environment_time_index.sorted_order
+    first_width = float(np.median(np.diff(epoch_seconds))) if epoch_seconds.shape[0] > 1 else 0.0
+    return ResamplingWindows(
+        edges=np.concatenate([epoch_seconds[:1] - first_width, epoch_seconds]),
+        is_right_closed=True,
+        environment_positions=environment_positions,
+        epoch_seconds=epoch_seconds
+    )
+
+def get_grid_windows(environment_information, overlap_start_seconds, overlap_end_seconds, join_frequency_seconds):
+    if join_frequency_seconds <= 0:
+        raise Exception('Join frequency should be positive, was... {}'.format(join_frequency_seconds))
+    window_count = int(np.ceil((overlap_end_seconds - overlap_start_seconds) / join_frequency_seconds))
+    edges = overlap_start_seconds + np.arange(max(window_count, 1) + 1) * join_frequency_seconds
+    window_centers = edges[:-1] + join_frequency_seconds / 2
+    # Each step of the grid is joined to the environment row whose interval holds its center.
+    environment_windows = get_environment_interval_windows(environment_information)
+    interval_positions = np.searchsorted(environment_windows.edges, window_centers, side='left') - 1
+    is_within_intervals = (interval_positions >= 0) & (interval_positions < environment_windows.epoch_seconds.shape[0])
+    return ResamplingWindows(
+        edges=edges,
+        is_right_closed=False,
+        environment_positions=np.where(
+            is_within_intervals, environment_windows.environment_positions[np.clip(interval_positions, 0, None)], -1
+        ),
+        epoch_seconds=window_centers
+    )
+
+def iterate_dataset_rows(radar_file, dataset_name, chunk_size, region_start, region_stop):
+    if dataset_name != 'data':
+        yield from iterate_feature_chunks(radar_file, dataset_name, chunk_size, region_start, region_stop)
+        return
+    for sample_times, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop):
+        yield sample_times, sensors_data.transpose()
+
+def resample_radar_over_windows(radar_file, resampling_windows, statistics, chunk_size=DEFAULT_CHUNK_SIZE,
+    dataset_name='data'):
+    radar_time_index = get_radar_time_index(radar_file)
+    if radar_time_index.sorted_order is not None:
+        raise Exception('Resampling reads the radar file in one pass, so needs monotonic sample times... {}'
+            .format(radar_file.filename))
+    edges = resampling_windows.edges
+    window_count = edges.shape[0] - 1
+    # Samples on an edge belong to the window ending there when windows are right closed, else to the next one.
+    region_side = 'right' if resampling_windows.is_right_closed else 'left'
+    window_side = 'left' if resampling_windows.is_right_closed else 'right'
+    region_start = int(np.searchsorted(radar_time_index.sorted_times, edges[0], side=region_side))
+    region_stop = int(np.searchsorted(radar_time_index.sorted_times, edges[-1], side=region_side))
+
+    sample_counts = np.zeros(window_count, dtype=np.int64)
+    first_radar_indices = np.full(window_count, -1, dtype=np.int64)
+    sums, square_sums, medians = None, None, None
+    # Samples of the last window of a chunk, which may continue into the next chunk, for its median.
+    open_window, open_window_rows = None, []
+
+    def close_median_window():
+        if open_window is not None:
+            medians[open_window] = np.median(np.concatenate(open_window_rows), axis=0)
+
+    chunk_offset = region_start
+    for sample_times, radar_rows in iterate_dataset_rows(radar_file, dataset_name, chunk_size, region_start, region_stop):
+        if sums is None:
+            sums = np.zeros((window_count, radar_rows.shape[1]))
+            square_sums = np.zeros(sums.shape) if 'std' in statistics else None
+            medians = np.zeros(sums.shape) if 'median' in statistics else None
+        # Sample times are sorted, so the samples of each window form one run and the runs of a chunk are distinct.
+        window_indices = np.searchsorted(edges, sample_times, side=window_side) - 1
+        run_starts = np.flatnonzero(np.diff(window_indices, prepend=-1) != 0)
+        run_windows = window_indices[run_starts]
+        radar_rows = np.asarray(radar_rows, dtype=np.float64)
+
+        sample_counts[run_windows] += np.diff(np.append(run_starts, window_indices.shape[0]))
+        first_radar_indices[run_windows] = np.where(
+            first_radar_indices[run_windows] < 0, chunk_offset + run_starts, first_radar_indices[run_windows]
+        )
+        sums[run_windows] += np.add.reduceat(radar_rows, run_starts, axis=0)
+        if square_sums is not None:
+            square_sums[run_windows] += np.add.reduceat(np.square(radar_rows), run_starts, axis=0)
+        if medians is not None:
+            run_stops = np.append(run_starts[1:], window_indices.shape[0])
+            for run_window, run_start, run_stop in zip(run_windows, run_starts, run_stops):
+                if run_window != open_window:
+                    close_median_window()
+                    open_window, open_window_rows = run_window, []
+                open_window_rows.append(radar_rows[run_start:run_stop])
+        chunk_offset += sample_times.shape[0]
+    if medians is not None:
+        close_median_window()
+
+    is_joined = (sample_counts > 0) & (resampling_windows.environment_positions >= 0)
+    logging.info('Resampled {} radar samples into {} windows, with a median of {} samples each'.format(
+        region_stop - region_start, np.count_nonzero(is_joined),
+        np.median(sample_counts[is_joined]) if np.any(is_joined) else 0
+    ))
+    if sums is None:
+        level_count = radar_file[dataset_name].shape[-1]
+        radar_levels = np.empty((0, level_count * len(statistics)))
+    else:
+        joined_counts = sample_counts[is_joined][:, np.newaxis]
+        means = sums[is_joined] / joined_counts
+        statistic_levels = {'mean': means}
+        if square_sums is not None:
+            statistic_levels['std'] = np.sqrt(np.maximum(square_sums[is_joined] / joined_counts - np.square(means), 0))
+        if medians is not None:
+            statistic_levels['median'] = medians[is_joined]
+        radar_levels = np.concatenate([statistic_levels[statistic] for statistic in statistics], axis=1)
+    return ResampledRadar(
+        environment_positions=resampling_windows.environment_positions[is_joined],
+        epoch_seconds=resampling_windows.epoch_seconds[is_joined],
+        first_radar_indices=first_radar_indices[is_joined],
+        sample_counts=sample_counts[is_joined],
+        radar_levels=radar_levels
+    )
@@ -4,12 +4,23 @@ import logging
 import datetime
 import itertools
 import argparse
-from subcommands.plot import attach_plot_subcommand 
-from subcommands.model import attach_model_subcommand 
+import profiling
+from subcommands.plot import attach_plot_subcommand
+from subcommands.model import attach_model_subcommand
+from subcommands.cache import attach_cache_subcommand
+from subcommands.catalog import attach_catalog_subcommand
+from subcommands.features import attach_features_subcommand
+from subcommands.repack import attach_repack_subcommand
 
-def main():
+def build_argument_parser():
     root_argument_parser = argparse.ArgumentParser()
     root_argument_parser.add_argument('-l', '--log_level')
+    root_argument_parser.add_argument('--profile', action='store_true',
+        help='Time the stages of the subcommand and write a JSON summary of them to stderr (or --profile-output).')
+    root_argument_parser.add_argument('--profile-output', default='-',
+        help='Path to write the JSON summary of --profile to.')
+    root_argument_parser.add_argument('--profile-dump',
+        help='Path to dump a cProfile of the subcommand to, or a pyinstrument profile if it ends with .html.')
     def root_function(program_arguments):
         root_argument_parser.print_help()
     root_argument_parser.set_defaults(func=root_function)
@@ -19,9 +30,27 @@ def main():
 
     attach_plot_subcommand(root_subcommands),
     attach_model_subcommand(root_subcommands)
+    attach_cache_subcommand(root_subcommands)
+    attach_catalog_subcommand(root_subcommands)
+    attach_features_subcommand(root_subcommands)
+    attach_repack_subcommand(root_subcommands)
+    return root_argument_parser
+
+def select_matplotlib_backend(program_arguments):
+    # Matplotlib reads MPLBACKEND when first imported, which only happens once a subcommand runs.
+    if 'MPLBACKEND' in os.environ:
+        return
+    has_no_display = sys.platform.startswith('linux') and \
+        not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')
+    is_exporting = getattr(program_arguments, 'export_dir', None) is not None
+    if has_no_display or is_exporting or not sys.stdin.isatty():
+        logging.debug('Selecting the headless Agg backend for matplotlib')
+        os.environ['MPLBACKEND'] = 'Agg'
 
+def main():
+    root_argument_parser = build_argument_parser()
     program_arguments = root_argument_parser.parse_args()
-        
+
     if program_arguments.log_level is None:
         program_arguments.log_level = logging.INFO
     try:
@@ -32,7 +61,23 @@ def main():
     logging.basicConfig(level=program_arguments.log_level, format='%(asctime)s '
     '- %(name)s - %(levelname)s - %(message)s')
 
-    program_arguments.func(program_arguments)
+    select_matplotlib_backend(program_arguments)
+    run_subcommand(program_arguments)
+
+def run_subcommand(program_arguments):
+    if not program_arguments.profile and program_arguments.profile_dump is None:
+        program_arguments.func(program_arguments)
+        return
+
+    profiling.start_profiling()
+    try:
+        if program_arguments.profile_dump is None:
+            program_arguments.func(program_arguments)
+        else:
+            profiling.run_with_profiler_dump(program_arguments.func, program_arguments.profile_dump, program_arguments)
+    finally:
+        if program_arguments.profile:
+            profiling.write_profile_summary(program_arguments.profile_output, sys.argv[1:])
 
 if __name__ == '__main__':
     main()
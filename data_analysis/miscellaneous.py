@@ -3,3 +3,10 @@ def is_string_relative_numeric(string):
         return True 
     else:
         return False
+
+# Number of radar samples read from the h5 file at a time, kept here so registering subcommands needs no data libraries.
+DEFAULT_CHUNK_SIZE = 100000
+# Feature of a feature store (see `features build`) that commands read when given one.
+DEFAULT_FEATURE_NAME = 'normalized_spectra'
+# Seconds between checks for rows appended to a recording that is being followed (see --follow).
+DEFAULT_FOLLOW_POLL_SECONDS = 1.0
@@ -0,0 +1,137 @@
+import sys
+import json
+import time
+import logging
+import functools
+import contextlib
+
+# Only the standard library is imported here, so main.py can enable profiling before any subcommand loads its libraries.
+
+class ProfileStage:
+    __slots__ = ['seconds', 'calls', 'rows', 'bytes_read']
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.bytes_read = 0
+
+    def add_rows(self, row_count, byte_count=0):
+        self.rows += int(row_count)
+        self.bytes_read += int(byte_count)
+
+class DisabledProfileStage:
+    def add_rows(self, row_count, byte_count=0):
+        pass
+
+_disabled_profile_stage = DisabledProfileStage()
+# Stages by name while profiling, None otherwise so that instrumented code only pays for one check.
+_profile_stages = None
+_profile_start_time = None
+
+def is_profiling():
+    return _profile_stages is not None
+
+def start_profiling():
+    global _profile_stages, _profile_start_time
+    _profile_stages = {}
+    _profile_start_time = time.perf_counter()
+
+@contextlib.contextmanager
+def profile_stage(stage_name):
+    # Stages may nest (e.g., reads within a join), so their seconds are inclusive and do not add up to the total.
+    if _profile_stages is None:
+        yield _disabled_profile_stage
+        return
+    stage_counters = _profile_stages.get(stage_name)
+    if stage_counters is None:
+        stage_counters = _profile_stages[stage_name] = ProfileStage()
+    stage_start_time = time.perf_counter()
+    try:
+        yield stage_counters
+    finally:
+        stage_counters.seconds += time.perf_counter() - stage_start_time
+        stage_counters.calls += 1
+
+def get_peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports kibibytes and macOS bytes, children are worker processes of the process pools.
+    byte_multiplier = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * byte_multiplier,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * byte_multiplier
+    }
+
+def get_process_io_bytes():
+    # Bytes read and written by the process, including the page cache, where the platform reports them.
+    try:
+        with open('/proc/self/io', 'r') as process_io:
+            io_counters = dict(line.split(': ') for line in process_io.read().splitlines())
+        return {'read': int(io_counters['rchar']), 'written': int(io_counters['wchar'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def get_profile_summary(command=None):
+    return {
+        'command': command,
+        'total_seconds': None if _profile_start_time is None else time.perf_counter() - _profile_start_time,
+        'stages': {
+            stage_name: {
+                'seconds': stage_counters.seconds,
+                'calls': stage_counters.calls,
+                'rows': stage_counters.rows,
+                'bytes_read': stage_counters.bytes_read
+            }
+            for stage_name, stage_counters in sorted((_profile_stages or {}).items())
+        },
+        'peak_rss_bytes': get_peak_rss_bytes(),
+        'process_io_bytes': get_process_io_bytes()
+    }
+
+def write_profile_summary(output_path, command=None):
+    profile_summary = json.dumps(get_profile_summary(command), indent=2)
+    if output_path == '-':
+        # Standard output may carry the results of the command, e.g., predictions printed as csv.
+        print(profile_summary, file=sys.stderr)
+        return
+    with open(output_path, 'w') as output_file:
+        output_file.write(profile_summary + '\n')
+    logging.info('Wrote profile summary to... {}'.format(output_path))
+
+def run_with_profiler_dump(function, dump_path, *args):
+    # An .html dump uses pyinstrument when installed, anything else is cProfile stats for pstats or snakeviz.
+    if dump_path.endswith('.html'):
+        try:
+            import pyinstrument
+        except ImportError:
+            logging.warning('Install pyinstrument for an html profile, dumping cProfile stats instead')
+        else:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                return function(*args)
+            finally:
+                profiler.stop()
+                with open(dump_path, 'w') as dump_file:
+                    dump_file.write(profiler.output_html())
+                logging.info('Wrote pyinstrument profile to... {}'.format(dump_path))
+
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(dump_path)
+        logging.info('Wrote cProfile stats to... {}'.format(dump_path))
+
+def profiled(stage_name):
+    def profile_function(function):
+        @functools.wraps(function)
+        def profiled_function(*args, **kwargs):
+            with profile_stage(stage_name):
+                return function(*args, **kwargs)
+        return profiled_function
+    return profile_function
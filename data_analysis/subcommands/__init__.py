@@ -1,5 +1,6 @@
 import os
 import logging
+import importlib
 
 def validate_arguments_for_radar_file(program_arguments):
     logging.info('Path to radar file is... {}'.format(program_arguments.radar_h5_file))
@@ -13,3 +14,31 @@ def validate_arguments_for_environments_file(program_arguments):
     if program_arguments.environment_file is None or not os.path.isfile(program_arguments.environment_file):
         raise Exception('Path to environments file does not point to a real file, was... {}'
         .format(program_arguments.environment_file))
+
+def validate_arguments_for_feature_store(program_arguments):
+    logging.info('Path to feature store is... {}'.format(program_arguments.features))
+    if not os.path.isfile(program_arguments.features):
+        raise Exception('The path to the feature store does not exist, path was... {}'.format(
+            program_arguments.features
+        ))
+
+def get_radar_source(program_arguments):
+    # A feature store stands in for the radar file, with one of its features in place of the data cube.
+    if getattr(program_arguments, 'features', None) is not None:
+        return program_arguments.features, program_arguments.feature
+    return program_arguments.radar_h5_file, 'data'
+
+def get_resample_options(program_arguments):
+    # None keeps the join of each environment row to its nearest radar sample.
+    if program_arguments.resample is None:
+        if program_arguments.join_frequency is not None:
+            raise Exception('A join frequency is only used when resampling, add --resample.')
+        return None
+    from data_files.resampling import ResampleOptions, parse_resample_statistics
+    return ResampleOptions(parse_resample_statistics(program_arguments.resample), program_arguments.join_frequency)
+
+def run_lazily(module_name, function_name):
+    # Implementations (and the libraries they import) are only loaded once their subcommand is chosen.
+    def run_subcommand(program_arguments):
+        return getattr(importlib.import_module(module_name), function_name)(program_arguments)
+    return run_subcommand
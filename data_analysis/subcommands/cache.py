@@ -0,0 +1,41 @@
+import logging
+import datetime
+
+def attach_cache_subcommand(root_subcommands):
+    cache_parser = root_subcommands.add_parser('cache')
+    cache_parser.add_argument('-d', '--cache-dir',
+        help='Path to the directory containing the preprocessed data cache, data/cache by default.')
+    cache_parser.set_defaults(func=lambda program_arguments: cache_parser.print_help())
+    cache_subcommands = cache_parser.add_subparsers(title='subcommands')
+
+    ls_parser = cache_subcommands.add_parser('ls')
+    ls_parser.set_defaults(func=run_cache_ls_subcommand)
+
+    clear_parser = cache_subcommands.add_parser('clear')
+    clear_parser.set_defaults(func=run_cache_clear_subcommand)
+
+def get_cache_directory(program_arguments):
+    from data_files import preprocessed_cache
+    if program_arguments.cache_dir is None:
+        return preprocessed_cache.CACHE_DIRECTORY
+    return program_arguments.cache_dir
+
+def run_cache_ls_subcommand(program_arguments):
+    from data_files import preprocessed_cache
+    cache_entries = preprocessed_cache.list_cache_entries(get_cache_directory(program_arguments))
+    for cache_entry in cache_entries:
+        print('{}  {:>12}  {}  {}'.format(
+            cache_entry['key'][:16],
+            cache_entry['size'],
+            datetime.datetime.fromtimestamp(cache_entry['last_used']).strftime('%Y-%m-%d %H:%M:%S'),
+            cache_entry['description']
+        ))
+    print('{} entries, {} bytes in total'.format(
+        len(cache_entries), sum(cache_entry['size'] for cache_entry in cache_entries)
+    ))
+
+def run_cache_clear_subcommand(program_arguments):
+    from data_files import preprocessed_cache
+    cache_directory = get_cache_directory(program_arguments)
+    cleared_count = preprocessed_cache.clear_cache(cache_directory)
+    logging.info('Cleared {} entries from cache directory... {}'.format(cleared_count, cache_directory))
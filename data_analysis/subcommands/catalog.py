@@ -0,0 +1,27 @@
+import os
+import logging
+import datetime
+
+def attach_catalog_subcommand(root_subcommands):
+    catalog_parser = root_subcommands.add_parser('catalog')
+    catalog_parser.add_argument('-d', '--dataset-dir', required=True,
+        help='Path to the directory of radar and environment files to index.')
+    catalog_parser.set_defaults(func=run_catalog_subcommand)
+
+def run_catalog_subcommand(program_arguments):
+    from data_files import catalog
+    if not os.path.isdir(program_arguments.dataset_dir):
+        raise Exception('The dataset directory is invalid... {}'.format(program_arguments.dataset_dir))
+    dataset_catalog = catalog.build_catalog(program_arguments.dataset_dir)
+    logging.info('Indexed {} files to... {}'.format(
+        len(dataset_catalog['entries']), catalog.get_catalog_path(program_arguments.dataset_dir)
+    ))
+    for catalog_entry in dataset_catalog['entries']:
+        print('{:<12} {:<20} {:<20} {}'.format(
+            catalog_entry['kind'],
+            '' if catalog_entry['start'] is None else str(datetime.datetime.fromtimestamp(catalog_entry['start'])),
+            '' if catalog_entry['end'] is None else str(datetime.datetime.fromtimestamp(catalog_entry['end'])),
+            catalog_entry['name']
+        ))
+    for radar_name, environment_name in catalog.find_overlapping_pairs(dataset_catalog):
+        print('Overlapping pair... {} and {}'.format(radar_name, environment_name))
@@ -0,0 +1,54 @@
+import os
+import logging
+from miscellaneous import DEFAULT_CHUNK_SIZE
+
+def attach_features_subcommand(root_subcommands):
+    features_parser = root_subcommands.add_parser('features')
+    features_parser.set_defaults(func=lambda program_arguments: features_parser.print_help())
+    features_subcommands = features_parser.add_subparsers(title='subcommands')
+
+    build_parser = features_subcommands.add_parser('build')
+    build_parser.add_argument('-r', '--radar-h5-file', required=True,
+        help='Path to the h5 radar file to derive the features of.')
+    build_parser.add_argument('-o', '--output',
+        help='Path to write the feature store to, next to the radar file (.features.h5) by default.')
+    build_parser.add_argument('-b', '--bands',
+        help='Level bands to sum per sample, 1-based and inclusive, e.g., \'1-50,51-120,121-414\'.')
+    build_parser.add_argument('--pca-model',
+        help='Path to a pickled PCA projection (see \'plot pca\') to store the scores of.')
+    build_parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help='Number of radar samples to read from the h5 file at a time.')
+    build_parser.add_argument('--compression', choices=['gzip', 'lzf', 'none'], default='gzip',
+        help='Compression of the feature datasets.')
+    build_parser.add_argument('-w', '--workers', type=int, default=1,
+        help='Number of processes reading chunks of the radar file in parallel.')
+    build_parser.set_defaults(func=run_features_build_subcommand)
+
+def validate_features_build_arguments(program_arguments):
+    if not os.path.isfile(program_arguments.radar_h5_file):
+        raise Exception('The path to the radar file does not exist, path was... {}'.format(
+            program_arguments.radar_h5_file
+        ))
+    if program_arguments.pca_model is not None and not os.path.isfile(program_arguments.pca_model):
+        raise Exception('The PCA model file is invalid... {}'.format(program_arguments.pca_model))
+
+def run_features_build_subcommand(program_arguments):
+    from data_files import feature_store
+    from data_files.radar_h5 import open_radar_file
+    from subcommands.plot.pca import load_pca_projection
+    validate_features_build_arguments(program_arguments)
+
+    output = program_arguments.output
+    if output is None:
+        output = program_arguments.radar_h5_file + feature_store.FEATURE_STORE_SUFFIX
+    level_bands = None
+    if program_arguments.bands is not None:
+        level_bands = feature_store.parse_level_bands(program_arguments.bands)
+    pca_projection = None
+    if program_arguments.pca_model is not None:
+        pca_projection = load_pca_projection(program_arguments.pca_model)
+
+    with open_radar_file(program_arguments.radar_h5_file, 'sequential') as radar_file:
+        logging.info('Shape of data in radar file is... {}'.format(radar_file['data'].shape))
+        feature_store.build_feature_store(radar_file, output, level_bands, pca_projection,
+            program_arguments.chunk_size, program_arguments.compression, program_arguments.workers)
@@ -0,0 +1,98 @@
+import os
+import logging
+import argparse
+from subcommands import run_lazily
+from miscellaneous import DEFAULT_CHUNK_SIZE, DEFAULT_FEATURE_NAME, DEFAULT_FOLLOW_POLL_SECONDS
+
+def attach_model_subcommand(root_subcommands):
+    model_parser = root_subcommands.add_parser('model')
+    model_parser.add_argument('-r', '--radar_h5_file',
+      help='Path to the h5 radar file.')
+    model_parser.add_argument('-e', '--environment_file',
+      help='Path to the csv that contains the moisture data.')
+    model_parser.add_argument('-g', '--guess_for',
+      help='Path to a file containing radar data to be fed to the model.')
+    model_parser.add_argument('-m', '--model',
+      help='Path to a file containing the model.')
+    model_parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+      help='Number of radar samples to read from the h5 file at a time.')
+    model_parser.add_argument('-s', '--score', action='store_true',
+      help='Whether to log the score of the model against the radar and environment files after guessing.')
+    model_parser.add_argument('-n', '--incremental', action='store_true',
+      help='Train chunk by chunk from sufficient statistics, folding the radar and environment files into '
+      'the incremental model supplied with --model if any.')
+    model_parser.add_argument('-d', '--dataset-dir',
+      help='Path to a directory of radar and environment files to train on instead of a single pair.')
+    model_parser.add_argument('--date-range',
+      help='Range of dates to train on from the dataset directory, e.g., \'2023-10-30,2023-11-02\' (end exclusive).')
+    model_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+      help='Number of processes used to join the files of the dataset directory.')
+    model_parser.add_argument('-f', '--features',
+      help='Path to a feature store (see \'features build\') to train on, guess or predict from instead of the radar file.')
+    model_parser.add_argument('--feature', default=DEFAULT_FEATURE_NAME,
+      help='Name of the feature in the feature store to use.')
+    model_parser.add_argument('--resample',
+      help='Statistics of all radar samples within each environment interval (or step of --join-frequency) '
+      'to join instead of the nearest sample, e.g., \'mean\' or \'mean,std\' (of mean, median and std).')
+    model_parser.add_argument('--join-frequency', type=float,
+      help='Seconds per step of a fixed grid to resample the radar data over, instead of the environment intervals.')
+    model_parser.add_argument('--model-format', choices=['pickle', 'npz'], default='pickle',
+      help='Format to save trained models in, npz is a versioned artifact of linear (or PCA pipeline) models '
+      'that predicts without scikit-learn, but cannot be trained further with --incremental.')
+    model_parser.set_defaults(func=run_lazily('subcommands.model.training', 'run_model_subcommand'))
+    model_subcommands = model_parser.add_subparsers(title='subcommands')
+
+    attach_predict_subcommand(model_subcommands)
+    attach_serve_subcommand(model_subcommands)
+    attach_select_subcommand(model_subcommands)
+    attach_export_subcommand(model_subcommands)
+
+def attach_predict_subcommand(model_subcommands):
+    predict_parser = model_subcommands.add_parser('predict')
+    predict_parser.add_argument('-i', '--input', required=True,
+        help='Path to the radar data to predict for, either a h5 radar file, a feature store (read with --feature), '
+        'a .npy array of samples by levels, or newline delimited json vectors.')
+    predict_parser.add_argument('--region',
+        help='Slice of the h5 radar file to predict for, e.g., \'3000,400\'.')
+    predict_parser.add_argument('-o', '--output',
+        help='Path to write the predictions to, either .csv or .h5, printed as csv if excluded.')
+    predict_parser.add_argument('--follow', action='store_true',
+        help='Keep predicting for the samples appended to a h5 radar file that is still being recorded, '
+        'reading only the rows appended since the last poll.')
+    predict_parser.add_argument('--poll-interval', type=float, default=DEFAULT_FOLLOW_POLL_SECONDS,
+        help='Seconds between checks for appended samples when following.')
+    predict_parser.add_argument('--idle-timeout', type=float,
+        help='Seconds without appended samples after which to stop following, until interrupted if excluded.')
+    predict_parser.set_defaults(func=run_lazily('subcommands.model.predict', 'run_predict_subcommand'))
+
+def attach_serve_subcommand(model_subcommands):
+    serve_parser = model_subcommands.add_parser('serve')
+    serve_parser.add_argument('-s', '--socket',
+        help='Path of a unix socket to listen on, reads from stdin if excluded.')
+    serve_parser.set_defaults(func=run_lazily('subcommands.model.predict', 'run_serve_subcommand'))
+
+def attach_select_subcommand(model_subcommands):
+    select_parser = model_subcommands.add_parser('select')
+    select_parser.add_argument('--estimators', default='ridge,pls,pca_linear,gbr',
+        help='Estimators to cross validate over their grids of hyperparameters, of ridge, pls (partial least squares), '
+        'pca_linear (principal components then linear) and gbr (gradient boosting). Gradient boosting is left out '
+        'with --model-format npz, which holds linear models alone.')
+    select_parser.add_argument('--folds', type=int, default=5,
+        help='Number of folds, each tests on the block of time after the blocks it was trained on.')
+    select_parser.add_argument('--gap', type=float, default=0.0,
+        help='Seconds of samples before each test block left out of training, so neighbouring samples do not leak.')
+    select_parser.add_argument('--report',
+        help='Path to write the metrics and fit times of every fold to, either .csv or .json (with a summary per '
+        'candidate), printed as csv if excluded.')
+    select_parser.set_defaults(func=run_lazily('subcommands.model.selection', 'run_select_subcommand'))
+
+def attach_export_subcommand(model_subcommands):
+    export_parser = model_subcommands.add_parser('export')
+    export_parser.add_argument('-o', '--output',
+        help='Path to write the npz artifact of the pickled --model to, next to it if excluded.')
+    export_parser.set_defaults(func=run_lazily('subcommands.model.artifact', 'run_export_subcommand'))
+
+def validate_loaded_model_arguments(program_arguments):
+    moisture_model = program_arguments.model
+    if moisture_model is None or not os.path.isfile(moisture_model):
+        raise Exception('The model file is invalid... {}'.format(moisture_model))
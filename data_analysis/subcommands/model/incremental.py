@@ -0,0 +1,49 @@
+import logging
+import numpy as np
+
+class IncrementalLinearModel:
+    def __init__(self, feature_count):
+        # Normal equations of a linear model with an intercept, the last feature being the constant one.
+        self.gram_matrix = np.zeros((feature_count + 1, feature_count + 1), dtype=np.float64)
+        self.moment_vector = np.zeros(feature_count + 1, dtype=np.float64)
+        self.moisture_sum = 0.0
+        self.moisture_square_sum = 0.0
+        self.sample_count = 0
+        self.folded_inputs = []
+        self.coef_ = np.zeros(feature_count, dtype=np.float64)
+        self.intercept_ = 0.0
+
+    def partial_fit(self, radar_levels, moistures):
+        radar_levels = np.asarray(radar_levels, dtype=np.float64)
+        moistures = np.asarray(moistures, dtype=np.float64)
+        augmented_levels = np.hstack([radar_levels, np.ones((radar_levels.shape[0], 1))])
+        self.gram_matrix += augmented_levels.transpose() @ augmented_levels
+        self.moment_vector += augmented_levels.transpose() @ moistures
+        self.moisture_sum += moistures.sum()
+        self.moisture_square_sum += np.square(moistures).sum()
+        self.sample_count += moistures.shape[0]
+        return self
+
+    def solve(self):
+        if self.sample_count == 0:
+            raise Exception('Cannot solve a model that has not been fitted to any samples.')
+        # Least squares keeps rank deficient systems (e.g., constant levels) solvable, like LinearRegression.
+        coefficients = np.linalg.lstsq(self.gram_matrix, self.moment_vector, rcond=None)[0]
+        self.coef_, self.intercept_ = coefficients[:-1], coefficients[-1]
+        logging.info('Solved incremental model over {} samples'.format(self.sample_count))
+        return self
+
+    def get_training_score(self):
+        coefficients = np.append(self.coef_, self.intercept_)
+        residual_square_sum = self.moisture_square_sum - 2 * coefficients @ self.moment_vector \
+            + coefficients @ self.gram_matrix @ coefficients
+        total_square_sum = self.moisture_square_sum - self.moisture_sum ** 2 / self.sample_count
+        return 1 - residual_square_sum / total_square_sum
+
+    def predict(self, radar_levels):
+        return np.asarray(radar_levels, dtype=np.float64) @ self.coef_ + self.intercept_
+
+    def score(self, radar_levels, moistures):
+        moistures = np.asarray(moistures, dtype=np.float64)
+        residual_square_sum = np.square(moistures - self.predict(radar_levels)).sum()
+        return 1 - residual_square_sum / np.square(moistures - moistures.mean()).sum()
@@ -0,0 +1,189 @@
+import os
+import sys
+import csv
+import json
+import stat
+import logging
+import socketserver
+import numpy as np
+import h5py
+import subcommands.model
+from subcommands.model.artifact import load_moisture_model
+from data_files.radar_h5 import iterate_radar_data_chunks, open_radar_file
+from data_files.following import iterate_appended_regions
+from data_files.feature_store import open_feature_store, iterate_feature_chunks
+from miscellaneous import DEFAULT_FEATURE_NAME
+from profiling import profile_stage
+
+def validate_predict_arguments(program_arguments):
+    subcommands.model.validate_loaded_model_arguments(program_arguments)
+    if not os.path.isfile(program_arguments.input):
+        raise Exception('The prediction input file is invalid... {}'.format(program_arguments.input))
+    if program_arguments.follow and program_arguments.region is not None:
+        raise Exception('Following predicts for every appended sample, so can not be limited to a --region.')
+
+def parse_region(region):
+    if region is None:
+        return 0, None
+    if len(region.split(',')) != 2 or not all(bound.isnumeric() for bound in region.split(',')):
+        raise Exception('Region program argument is invalid, was... {}'.format(region))
+    region_start, region_width = map(int, region.split(','))
+    return region_start, region_start + region_width
+
+def iterate_followed_prediction_inputs(input_file, chunk_size, poll_seconds, idle_seconds):
+    with open_radar_file(input_file, 'sequential', swmr=True) as radar_file:
+        if 'feature_store_version' in radar_file.attrs:
+            raise Exception('Only radar files that are being recorded can be followed, not feature stores.')
+        for region_start, region_stop in iterate_appended_regions(radar_file, 0, poll_seconds, idle_seconds):
+            for sample_times, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop):
+                yield sample_times, sensors_data.transpose()
+
+def iterate_prediction_inputs(input_file, chunk_size, region, feature_name=DEFAULT_FEATURE_NAME):
+    input_extension = os.path.splitext(input_file)[1].lower()
+    if input_extension in ['.h5', '.hdf5']:
+        region_start, region_stop = parse_region(region)
+        with h5py.File(input_file, 'r') as radar_file:
+            is_feature_store = 'feature_store_version' in radar_file.attrs
+        if is_feature_store:
+            with open_feature_store(input_file, feature_name) as feature_file:
+                yield from iterate_feature_chunks(feature_file, feature_name, chunk_size, region_start, region_stop)
+            return
+        with open_radar_file(input_file, 'sequential') as radar_file:
+            for sample_times, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop):
+                yield sample_times, sensors_data.transpose()
+    elif input_extension == '.npy':
+        radar_levels = np.load(input_file, mmap_mode='r')
+        for chunk_start in range(0, radar_levels.shape[0], chunk_size):
+            yield None, np.asarray(radar_levels[chunk_start:chunk_start + chunk_size])
+    else:
+        with open(input_file, 'r') as json_lines:
+            radar_levels = []
+            for json_line in json_lines:
+                if json_line.strip() == '':
+                    continue
+                radar_levels.append(json.loads(json_line))
+                if len(radar_levels) == chunk_size:
+                    yield None, np.array(radar_levels, dtype=np.float64)
+                    radar_levels = []
+            if len(radar_levels) > 0:
+                yield None, np.array(radar_levels, dtype=np.float64)
+
+class CsvPredictionWriter:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.csv_writer = csv.writer(output_file)
+        self.csv_writer.writerow(['index', 'sample_time', 'moisture'])
+        self.written_count = 0
+
+    def write(self, sample_times, predictions):
+        row_indices = range(self.written_count, self.written_count + predictions.shape[0])
+        if sample_times is None:
+            sample_times = [''] * predictions.shape[0]
+        self.csv_writer.writerows(zip(row_indices, sample_times, predictions))
+        self.written_count += predictions.shape[0]
+
+    def flush(self):
+        self.output_file.flush()
+
+    def close(self):
+        if self.output_file is not sys.stdout:
+            self.output_file.close()
+
+class H5PredictionWriter:
+    def __init__(self, output_path):
+        self.output_file = h5py.File(output_path, 'w')
+        self.predictions = self.output_file.create_dataset('predictions', (0,), maxshape=(None,), dtype=np.float64)
+        self.sample_times = self.output_file.create_dataset('sample_times', (0,), maxshape=(None,), dtype=np.float64)
+
+    def write(self, sample_times, predictions):
+        written_count = self.predictions.shape[0]
+        self.predictions.resize((written_count + predictions.shape[0],))
+        self.predictions[written_count:] = predictions
+        self.sample_times.resize((written_count + predictions.shape[0],))
+        self.sample_times[written_count:] = np.nan if sample_times is None else sample_times
+
+    def flush(self):
+        self.output_file.flush()
+
+    def close(self):
+        self.output_file.close()
+
+def open_prediction_writer(output_path):
+    if output_path is None:
+        return CsvPredictionWriter(sys.stdout)
+    if os.path.splitext(output_path)[1].lower() in ['.h5', '.hdf5']:
+        return H5PredictionWriter(output_path)
+    return CsvPredictionWriter(open(output_path, 'w', newline=''))
+
+def run_predict_subcommand(program_arguments):
+    validate_predict_arguments(program_arguments)
+    moisture_model = load_moisture_model(program_arguments.model)
+
+    if program_arguments.follow:
+        prediction_inputs = iterate_followed_prediction_inputs(program_arguments.input, program_arguments.chunk_size,
+            program_arguments.poll_interval, program_arguments.idle_timeout)
+    else:
+        prediction_inputs = iterate_prediction_inputs(program_arguments.input, program_arguments.chunk_size,
+            program_arguments.region, program_arguments.feature)
+    prediction_writer = open_prediction_writer(program_arguments.output)
+    try:
+        predicted_count = 0
+        prediction_sum = 0.0
+        for sample_times, radar_levels in prediction_inputs:
+            with profile_stage('predict') as predict_stage:
+                predictions = moisture_model.predict(radar_levels)
+                predict_stage.add_rows(radar_levels.shape[0])
+            with profile_stage('write'):
+                prediction_writer.write(sample_times, predictions)
+                if program_arguments.follow:
+                    # Readers of the output see each prediction as soon as its sample was appended.
+                    prediction_writer.flush()
+            predicted_count += radar_levels.shape[0]
+            prediction_sum += float(np.sum(predictions))
+            logging.debug('Predicted %s samples so far, with a running mean moisture of %s',
+                predicted_count, prediction_sum / predicted_count)
+    except KeyboardInterrupt:
+        if not program_arguments.follow:
+            raise
+        logging.info('Stopped following')
+    finally:
+        prediction_writer.close()
+    logging.info('Predicted moisture for {} samples'.format(predicted_count))
+
+def predict_json_line(moisture_model, json_line):
+    try:
+        radar_levels = np.array(json.loads(json_line), dtype=np.float64)
+        if radar_levels.ndim == 1:
+            radar_levels = radar_levels[np.newaxis]
+        return json.dumps(moisture_model.predict(radar_levels).tolist())
+    except Exception as e:
+        return json.dumps({'error': str(e)})
+
+def run_serve_subcommand(program_arguments):
+    subcommands.model.validate_loaded_model_arguments(program_arguments)
+    moisture_model = load_moisture_model(program_arguments.model)
+
+    if program_arguments.socket is None:
+        logging.info('Serving predictions for json vectors read from stdin')
+        for json_line in sys.stdin:
+            if json_line.strip() != '':
+                print(predict_json_line(moisture_model, json_line), flush=True)
+        return
+
+    class PredictionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for json_line in self.rfile:
+                if json_line.strip() != '':
+                    self.wfile.write((predict_json_line(moisture_model, json_line) + '\n').encode('utf-8'))
+                    self.wfile.flush()
+
+    if os.path.exists(program_arguments.socket):
+        if not stat.S_ISSOCK(os.stat(program_arguments.socket).st_mode):
+            raise Exception('The socket path exists and is not a socket... {}'.format(program_arguments.socket))
+        os.remove(program_arguments.socket)
+    with socketserver.ThreadingUnixStreamServer(program_arguments.socket, PredictionHandler) as prediction_server:
+        logging.info('Serving predictions on unix socket... {}'.format(program_arguments.socket))
+        try:
+            prediction_server.serve_forever()
+        finally:
+            os.remove(program_arguments.socket)
@@ -0,0 +1,237 @@
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import tempfile
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import subcommands
+import subcommands.model.training
+from profiling import profile_stage
+
+# Hyperparameters tried for each estimator, every combination of a grid is a candidate.
+ESTIMATOR_GRIDS = {
+    'ridge': {'alpha': [0.1, 1.0, 10.0, 100.0, 1000.0]},
+    'pls': {'n_components': [2, 5, 10, 20]},
+    'pca_linear': {'n_components': [5, 10, 20, 50]},
+    'gbr': {'learning_rate': [0.05, 0.1], 'max_leaf_nodes': [15, 31]}
+}
+# Estimators that are affine in the levels, the only ones a --model-format npz artifact can hold.
+EXPORTABLE_ESTIMATORS = ['ridge', 'pls', 'pca_linear']
+SELECTION_MATRIX_FILE = 'radar_levels.npy'
+SELECTION_MOISTURES_FILE = 'moistures.npy'
+
+Candidate = collections.namedtuple('Candidate', ['estimator_name', 'parameters'])
+Fold = collections.namedtuple('Fold', ['fold_index', 'train_stop', 'test_start', 'test_stop'])
+
+def build_estimator(candidate):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    parameters = candidate.parameters
+    if candidate.estimator_name == 'ridge':
+        from sklearn.linear_model import Ridge
+        return make_pipeline(StandardScaler(), Ridge(**parameters))
+    if candidate.estimator_name == 'pls':
+        from sklearn.cross_decomposition import PLSRegression
+        return PLSRegression(**parameters)
+    if candidate.estimator_name == 'pca_linear':
+        from sklearn.decomposition import PCA
+        from sklearn.linear_model import LinearRegression
+        return make_pipeline(StandardScaler(), PCA(**parameters), LinearRegression())
+    if candidate.estimator_name == 'gbr':
+        # The histogram variant bins the levels once, which keeps boosting tractable over days of samples.
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        return HistGradientBoostingRegressor(max_iter=200, early_stopping=False, **parameters)
+    raise Exception('Estimator should be one of {}, was... {}'.format(list(ESTIMATOR_GRIDS), candidate.estimator_name))
+
+def parse_estimator_names(estimator_names):
+    parsed_names = [estimator_name.strip() for estimator_name in estimator_names.split(',')]
+    if any(estimator_name not in ESTIMATOR_GRIDS for estimator_name in parsed_names):
+        raise Exception('Estimators should be ones of {}, were... {}'.format(list(ESTIMATOR_GRIDS), estimator_names))
+    return parsed_names
+
+def get_exportable_estimator_names(estimator_names, model_format):
+    if model_format != 'npz':
+        return estimator_names
+    # Checked before cross validating, as the best candidate is only known (and exported) after every fit.
+    exportable_names = [estimator_name for estimator_name in estimator_names if estimator_name in EXPORTABLE_ESTIMATORS]
+    if len(exportable_names) == 0:
+        raise Exception('Only estimators of {} can be saved as npz artifacts, were... {}'.format(
+            EXPORTABLE_ESTIMATORS, ','.join(estimator_names)))
+    if len(exportable_names) < len(estimator_names):
+        logging.warning('Leaving out estimators that cannot be saved as npz artifacts... {}'.format(
+            ','.join(estimator_name for estimator_name in estimator_names if estimator_name not in exportable_names)))
+    return exportable_names
+
+def get_candidates(estimator_names, feature_count, smallest_train_count):
+    candidates = []
+    for estimator_name in estimator_names:
+        parameter_grid = ESTIMATOR_GRIDS[estimator_name]
+        for parameter_values in itertools.product(*parameter_grid.values()):
+            parameters = dict(zip(parameter_grid.keys(), parameter_values))
+            # Components beyond the levels (or the samples of the first fold) cannot be fitted.
+            if parameters.get('n_components', 0) > min(feature_count, smallest_train_count):
+                continue
+            candidates.append(Candidate(estimator_name, parameters))
+    return candidates
+
+def get_blocked_folds(sample_times, fold_count, gap_seconds=0.0):
+    # Forward chaining over blocks of time sorted samples, every fold tests on the block after the ones it trains on,
+    # leaving out training samples within the gap before the test block so neighbouring samples do not leak.
+    sample_count = sample_times.shape[0]
+    block_bounds = np.linspace(0, sample_count, fold_count + 2).astype(np.int64)
+    folds = []
+    for fold_index in range(fold_count):
+        test_start, test_stop = block_bounds[fold_index + 1], block_bounds[fold_index + 2]
+        train_stop = int(np.searchsorted(sample_times, sample_times[test_start] - gap_seconds, side='left'))
+        if train_stop == 0 or test_stop == test_start:
+            raise Exception('Fold {} has no samples to train or test on, use fewer folds or a smaller gap.'.format(fold_index))
+        folds.append(Fold(fold_index, train_stop, int(test_start), int(test_stop)))
+    return folds
+
+def open_selection_arrays(selection_dir):
+    return (
+        np.load(os.path.join(selection_dir, SELECTION_MATRIX_FILE), mmap_mode='r'),
+        np.load(os.path.join(selection_dir, SELECTION_MOISTURES_FILE), mmap_mode='r')
+    )
+
+_selection_arrays = None
+def load_selection_arrays(selection_dir):
+    # Every worker maps the joined arrays once, so tasks carry only the bounds of their fold. Workers already
+    # run side by side, so the native thread pools of each are limited to one thread to not oversubscribe cores.
+    global _selection_arrays
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    _selection_arrays = open_selection_arrays(selection_dir)
+
+def evaluate_candidate_fold(candidate, fold):
+    radar_levels, moistures = _selection_arrays
+    estimator = build_estimator(candidate)
+    fit_start_time = time.perf_counter()
+    estimator.fit(radar_levels[:fold.train_stop], moistures[:fold.train_stop])
+    fit_seconds = time.perf_counter() - fit_start_time
+
+    predict_start_time = time.perf_counter()
+    predictions = np.ravel(estimator.predict(radar_levels[fold.test_start:fold.test_stop]))
+    predict_seconds = time.perf_counter() - predict_start_time
+    test_moistures = moistures[fold.test_start:fold.test_stop]
+    residuals = test_moistures - predictions
+    total_square_sum = np.square(test_moistures - test_moistures.mean()).sum()
+    return {
+        'estimator': candidate.estimator_name,
+        'parameters': json.dumps(candidate.parameters, sort_keys=True),
+        'fold': fold.fold_index,
+        'train_samples': fold.train_stop,
+        'test_samples': fold.test_stop - fold.test_start,
+        'r_squared': float(1 - np.square(residuals).sum() / total_square_sum) if total_square_sum > 0 else float('nan'),
+        'rmse': float(np.sqrt(np.mean(np.square(residuals)))),
+        'mae': float(np.mean(np.abs(residuals))),
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds
+    }
+
+def summarize_candidates(fold_rows):
+    candidate_rows = {}
+    for fold_row in fold_rows:
+        candidate_rows.setdefault((fold_row['estimator'], fold_row['parameters']), []).append(fold_row)
+    summary_rows = [
+        {
+            'estimator': estimator_name,
+            'parameters': parameters,
+            'mean_rmse': float(np.mean([fold_row['rmse'] for fold_row in candidate_fold_rows])),
+            'std_rmse': float(np.std([fold_row['rmse'] for fold_row in candidate_fold_rows])),
+            'mean_r_squared': float(np.nanmean([fold_row['r_squared'] for fold_row in candidate_fold_rows])),
+            'mean_mae': float(np.mean([fold_row['mae'] for fold_row in candidate_fold_rows])),
+            'total_fit_seconds': float(np.sum([fold_row['fit_seconds'] for fold_row in candidate_fold_rows]))
+        }
+        for (estimator_name, parameters), candidate_fold_rows in candidate_rows.items()
+    ]
+    # The error in moisture percentage is what matters downstream, so candidates are ranked on it.
+    return sorted(summary_rows, key=lambda summary_row: summary_row['mean_rmse'])
+
+def write_selection_report(fold_rows, summary_rows, report_path):
+    if report_path is not None and os.path.splitext(report_path)[1].lower() == '.json':
+        with open(report_path, 'w') as report_file:
+            json.dump({'candidates': summary_rows, 'folds': fold_rows}, report_file, indent=2)
+    else:
+        report_file = sys.stdout if report_path is None else open(report_path, 'w', newline='')
+        try:
+            csv_writer = csv.DictWriter(report_file, fieldnames=list(fold_rows[0].keys()))
+            csv_writer.writeheader()
+            csv_writer.writerows(fold_rows)
+        finally:
+            if report_file is not sys.stdout:
+                report_file.close()
+    if report_path is not None:
+        logging.info('Wrote metrics of {} fits to... {}'.format(len(fold_rows), report_path))
+
+def run_select_subcommand(program_arguments):
+    subcommands.model.training.validate_model_arguments(program_arguments)
+    if program_arguments.folds < 2:
+        raise Exception('Cross validation needs at least 2 folds, was... {}'.format(program_arguments.folds))
+    estimator_names = get_exportable_estimator_names(
+        parse_estimator_names(program_arguments.estimators), program_arguments.model_format
+    )
+    radar_and_moisture = subcommands.model.training.join_training_data(
+        program_arguments, subcommands.get_resample_options(program_arguments)
+    )
+
+    # Folds are contiguous blocks of time, so the joined samples are sorted once and folds are slices of them.
+    time_order = np.argsort(radar_and_moisture.environment_epoch_seconds, kind='stable')
+    sample_times = radar_and_moisture.environment_epoch_seconds[time_order]
+    folds = get_blocked_folds(sample_times, program_arguments.folds, program_arguments.gap)
+    smallest_train_count = min(fold.train_stop for fold in folds)
+    candidates = get_candidates(estimator_names, radar_and_moisture.radar_levels.shape[1], smallest_train_count)
+    if len(candidates) == 0:
+        raise Exception('No candidate of {} can be fitted on folds of {} samples, use fewer folds or a smaller gap'
+            .format(','.join(estimator_names), smallest_train_count))
+    tasks = [(candidate, fold) for candidate in candidates for fold in folds]
+    logging.info('Cross validating {} candidates over {} folds of {} samples with {} workers'.format(
+        len(candidates), len(folds), sample_times.shape[0], program_arguments.workers))
+
+    with tempfile.TemporaryDirectory(prefix='model_select_') as selection_dir:
+        with profile_stage('write'):
+            np.save(os.path.join(selection_dir, SELECTION_MATRIX_FILE),
+                np.asarray(radar_and_moisture.radar_levels[time_order], dtype=np.float64))
+            np.save(os.path.join(selection_dir, SELECTION_MOISTURES_FILE),
+                np.asarray(radar_and_moisture.moistures[time_order], dtype=np.float64))
+        del radar_and_moisture
+
+        with profile_stage('fit') as fit_stage:
+            fold_rows = []
+            with ProcessPoolExecutor(max_workers=program_arguments.workers, initializer=load_selection_arrays,
+                initargs=(selection_dir,)) as executor:
+                # The slowest candidates are submitted first, so they do not end up alone at the end.
+                tasks.sort(key=lambda task: task[0].estimator_name != 'gbr')
+                pending_rows = [executor.submit(evaluate_candidate_fold, candidate, fold) for candidate, fold in tasks]
+                for pending_row in pending_rows:
+                    fold_row = pending_row.result()
+                    logging.debug('Fold %s of %s %s, rmse of %s in %s seconds', fold_row['fold'], fold_row['estimator'],
+                        fold_row['parameters'], fold_row['rmse'], fold_row['fit_seconds'])
+                    fold_rows.append(fold_row)
+            fit_stage.add_rows(sum(fold.train_stop for fold in folds) * len(candidates))
+
+        summary_rows = summarize_candidates(fold_rows)
+        for summary_row in summary_rows:
+            logging.info('{estimator} {parameters}: rmse {mean_rmse:.4f} (± {std_rmse:.4f}), r² {mean_r_squared:.4f}, '
+                'fit in {total_fit_seconds:.2f} seconds'.format(**summary_row))
+        with profile_stage('write'):
+            write_selection_report(fold_rows, summary_rows, program_arguments.report)
+
+        best_candidate = Candidate(summary_rows[0]['estimator'], json.loads(summary_rows[0]['parameters']))
+        logging.info('Refitting the best candidate, {} {}, to all {} samples'.format(
+            best_candidate.estimator_name, best_candidate.parameters, sample_times.shape[0]))
+        with profile_stage('fit') as fit_stage:
+            radar_levels, moistures = open_selection_arrays(selection_dir)
+            best_model = build_estimator(best_candidate).fit(radar_levels, moistures)
+            fit_stage.add_rows(moistures.shape[0])
+    subcommands.model.training.save_moisture_model(best_model, program_arguments.model_format,
+        lambda: subcommands.model.training.get_training_information(program_arguments, sample_times.shape[0], {
+            'cross_validated_rmse': summary_rows[0]['mean_rmse'],
+            'cross_validated_r_squared': summary_rows[0]['mean_r_squared'],
+            'folds': len(folds)
+        }))
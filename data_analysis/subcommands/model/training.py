@@ -0,0 +1,198 @@
+import os
+import logging
+import datetime
+import pickle
+import uuid
+import json
+from subcommands.model.incremental import IncrementalLinearModel
+from subcommands.model.artifact import load_moisture_model, save_model_artifact, MODEL_ARTIFACT_SUFFIX
+from subcommands import validate_arguments_for_radar_file, validate_arguments_for_environments_file, \
+    validate_arguments_for_feature_store, get_radar_source, get_resample_options
+import data_files
+from data_files import preprocessed_cache
+import data_files.catalog
+from data_files.environments_excel import load_environment_information
+from data_files.feature_store import open_radar_or_feature_store
+from profiling import profile_stage
+
+def validate_model_arguments(program_arguments):
+    if program_arguments.dataset_dir is not None:
+        if not os.path.isdir(program_arguments.dataset_dir):
+            raise Exception('The dataset directory is invalid... {}'.format(program_arguments.dataset_dir))
+        if program_arguments.features is not None:
+            raise Exception('Feature stores are built per radar file, so cannot be used with a dataset directory.')
+    elif program_arguments.guess_for is None or program_arguments.score:
+        if program_arguments.features is None:
+            validate_arguments_for_radar_file(program_arguments)
+        else:
+            validate_arguments_for_feature_store(program_arguments)
+        validate_arguments_for_environments_file(program_arguments)
+    moisture_model = program_arguments.model
+    if moisture_model is not None and not os.path.isfile(moisture_model):
+        raise Exception('The model file is invalid... {}'.format(moisture_model))
+    guessing_input = program_arguments.guess_for
+    if guessing_input is not None and not os.path.isfile(guessing_input):
+        raise Exception('The guessing input file is invalid... {}'.format(guessing_input))
+
+def run_model_subcommand(program_arguments):
+    validate_model_arguments(program_arguments)
+    resample_options = get_resample_options(program_arguments)
+
+    logging.info('Path to file containing radar data feed model... {}'.format(program_arguments.guess_for))
+    logging.info('Path to model file is... {}'.format(program_arguments.model))
+    if program_arguments.guess_for is not None and program_arguments.model is not None:
+        moisture_model = load_moisture_model(program_arguments.model)
+        
+        with open(program_arguments.guess_for, 'r') as guess_for:
+            _guess_for = [json.loads(guess_for.read())]
+        print("Moisture prediction:", moisture_model.predict(_guess_for))
+
+        if not program_arguments.score:
+            return
+        radar_h5_file, dataset_name = get_radar_source(program_arguments)
+        radar_file = open_radar_or_feature_store(radar_h5_file, dataset_name)
+        environment_information = load_environment_information(program_arguments.environment_file)
+        radar_and_moisture = data_files.get_overlap_as_aggregated(radar_file, environment_information,
+            program_arguments.environment_file, program_arguments.chunk_size, dataset_name=dataset_name,
+            resample_options=resample_options)
+        with profile_stage('predict') as predict_stage:
+            model_score = moisture_model.score(radar_and_moisture.radar_levels, radar_and_moisture.moistures)
+            predict_stage.add_rows(radar_and_moisture.moistures.shape[0])
+        logging.info("Accuracy: {}".format(model_score))
+
+        return
+
+    if program_arguments.incremental:
+        if program_arguments.dataset_dir is not None:
+            moisture_model = train_incremental_model(program_arguments, data_files.catalog.get_dataset_file_pairs(
+                program_arguments.dataset_dir, program_arguments.date_range
+            ), data_files.catalog.parse_date_range(program_arguments.date_range))
+        else:
+            radar_h5_file, dataset_name = get_radar_source(program_arguments)
+            moisture_model = train_incremental_model(program_arguments, [
+                (radar_h5_file, program_arguments.environment_file)
+            ], dataset_name=dataset_name)
+        if moisture_model is not None:
+            save_moisture_model(moisture_model, program_arguments.model_format, lambda: get_training_information(
+                program_arguments, moisture_model.sample_count,
+                {'training_r_squared': float(moisture_model.get_training_score())}
+            ))
+        return
+
+    from sklearn.linear_model import LinearRegression
+    radar_and_moisture = join_training_data(program_arguments, resample_options)
+    with profile_stage('fit') as fit_stage:
+        moisture_model = LinearRegression()
+        moisture_model.fit(radar_and_moisture.radar_levels, radar_and_moisture.moistures)
+        fit_stage.add_rows(radar_and_moisture.moistures.shape[0])
+
+    save_moisture_model(moisture_model, program_arguments.model_format, lambda: get_training_information(
+        program_arguments, radar_and_moisture.moistures.shape[0],
+        {'training_r_squared': float(moisture_model.score(radar_and_moisture.radar_levels, radar_and_moisture.moistures))}
+    ))
+
+def join_training_data(program_arguments, resample_options=None):
+    if program_arguments.dataset_dir is not None:
+        return data_files.catalog.join_dataset_date_range(program_arguments.dataset_dir,
+            program_arguments.date_range, program_arguments.workers, program_arguments.chunk_size, resample_options)
+
+    radar_h5_file, dataset_name = get_radar_source(program_arguments)
+    radar_file = open_radar_or_feature_store(radar_h5_file, dataset_name)
+    start_timestamp = radar_file['timestamp'][()]
+    sensors_dataset = radar_file[dataset_name]
+    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
+    logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
+
+    environment_information = load_environment_information(program_arguments.environment_file)
+    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
+    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+
+    return data_files.get_overlap_as_aggregated(radar_file, environment_information,
+        program_arguments.environment_file, program_arguments.chunk_size, dataset_name=dataset_name,
+        resample_options=resample_options)
+
+def get_training_information(program_arguments, sample_count, metrics):
+    # Identifies the files and join a model was trained on, the fingerprint is keyed like the cached joins.
+    if program_arguments.dataset_dir is not None:
+        input_files = [
+            input_file for file_pair in data_files.catalog.get_dataset_file_pairs(
+                program_arguments.dataset_dir, program_arguments.date_range
+            ) for input_file in file_pair
+        ]
+    else:
+        input_files = [get_radar_source(program_arguments)[0], program_arguments.environment_file]
+    resample_options = get_resample_options(program_arguments)
+    parameters = {
+        'dataset_name': get_radar_source(program_arguments)[1],
+        'date_range': program_arguments.date_range,
+        'resample': None if resample_options is None else resample_options._asdict()
+    }
+    return {
+        'fingerprint': preprocessed_cache.get_cache_key(input_files, parameters),
+        'inputs': [os.path.basename(input_file) for input_file in input_files],
+        'parameters': parameters,
+        'samples': int(sample_count),
+        'metrics': metrics
+    }
+
+def save_moisture_model(moisture_model, model_format='pickle', describe_training=None):
+    # What the model was trained on is only described for artifacts, as describing it may need another prediction pass.
+    if model_format == 'npz':
+        file_name = 'moisture_model_{}_{}{}'.format(datetime.datetime.now(), uuid.uuid4(), MODEL_ARTIFACT_SUFFIX)
+        save_model_artifact(file_name, moisture_model, None if describe_training is None else describe_training())
+        print('Saved model artifact to {}'.format(file_name))
+        return
+    file_name = 'moisture_model_{}_{}.pkl'.format(datetime.datetime.now(), uuid.uuid4())
+    with open(file_name, 'wb') as save_file:
+        pickle.dump(moisture_model, save_file) 
+        print('Pickled model to {}'.format(file_name))
+
+def train_incremental_model(program_arguments, file_pairs, date_range=(None, None), dataset_name='data'):
+    resample_options = get_resample_options(program_arguments)
+    moisture_model = None
+    if program_arguments.model is not None:
+        moisture_model = load_moisture_model(program_arguments.model)
+        if not isinstance(moisture_model, IncrementalLinearModel):
+            raise Exception('Only incremental models can be trained further, was... {}'.format(type(moisture_model)))
+
+    folded_count = 0
+    for radar_h5_file, environment_file in file_pairs:
+        input_identities = [
+            preprocessed_cache.get_file_identity(radar_h5_file),
+            preprocessed_cache.get_file_identity(environment_file)
+        ]
+        if moisture_model is not None and input_identities in moisture_model.folded_inputs:
+            logging.warning('The files {} and {} were already folded into the model, skipping'.format(
+                radar_h5_file, environment_file))
+            continue
+
+        with open_radar_or_feature_store(radar_h5_file, dataset_name) as radar_file:
+            environment_information = load_environment_information(environment_file)
+            if resample_options is None:
+                radar_and_moisture_chunks = data_files.iterate_environment_and_radar_as_of(
+                    radar_file, environment_information, chunk_size=program_arguments.chunk_size, dataset_name=dataset_name
+                )
+            else:
+                # One row per window, so the whole resampled pair is folded in at once.
+                radar_and_moisture_chunks = [data_files.join_environment_and_radar_resampled(
+                    radar_file, environment_information, resample_options, program_arguments.chunk_size, dataset_name
+                )]
+            for radar_and_moisture in radar_and_moisture_chunks:
+                radar_and_moisture = data_files.catalog.select_radar_and_moisture_in_range(radar_and_moisture, *date_range)
+                if moisture_model is None:
+                    moisture_model = IncrementalLinearModel(radar_and_moisture.radar_levels.shape[1])
+                with profile_stage('fit') as fit_stage:
+                    moisture_model.partial_fit(radar_and_moisture.radar_levels, radar_and_moisture.moistures)
+                    fit_stage.add_rows(radar_and_moisture.moistures.shape[0])
+                logging.debug('Folded %s samples into the model', moisture_model.sample_count)
+        moisture_model.folded_inputs.append(input_identities)
+        folded_count += 1
+
+    if folded_count == 0:
+        return None
+    with profile_stage('fit'):
+        moisture_model.solve()
+    logging.info('Training score over {} samples from {} file pairs... {}'.format(
+        moisture_model.sample_count, len(moisture_model.folded_inputs), moisture_model.get_training_score()
+    ))
+    return moisture_model
@@ -1,161 +1,91 @@
+import os
 import logging
 import argparse
-import readline
-import csv
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt, mpld3
-import numpy as np 
-import h5py
-import subcommands.plot.versus
-import subcommands.plot.pca
-import subcommands
-from subcommands import validate_arguments_for_radar_file, validate_arguments_for_environments_file
-import data_files
-from data_files.radar_h5 import reoriente_sensor_data, get_radar_data_timestamp_from_index
-from data_files.environments_excel import get_environment_information_between_timestamps
-from miscellaneous import is_string_relative_numeric
+from subcommands import validate_arguments_for_radar_file, validate_arguments_for_environments_file, \
+    validate_arguments_for_feature_store, run_lazily
+from miscellaneous import DEFAULT_CHUNK_SIZE, DEFAULT_FEATURE_NAME, DEFAULT_FOLLOW_POLL_SECONDS
 
 def attach_plot_subcommand(root_subcommands):
     plot_parser = root_subcommands.add_parser('plot')
-    plot_parser.add_argument('-r', '--radar-h5-file', 
+    plot_parser.add_argument('-r', '--radar-h5-file',
         help='Path to the h5 radar file.')
     plot_parser.add_argument('-e', '--environment-file',
         help='Path to the csv that contains the moisture data.')
-    plot_parser.add_argument('-i', '--initial-region', 
+    plot_parser.add_argument('-i', '--initial-region',
         help='Slice of initial viewing region of radar data, e.g., '
         'can exclude or set like \'3000,400\' (no relative start)')
-    plot_parser.set_defaults(func=run_plot_subcommand)
+    plot_parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help='Number of radar samples to read from the h5 file at a time.')
+    plot_parser.add_argument('--pca-model',
+        help='Path to a pickled PCA projection, reused by \'pca\' (or saved to if missing) and used to '
+        'project the radar data when plotting.')
+    plot_parser.add_argument('-f', '--features',
+        help='Path to a feature store (see \'features build\') that \'versus\' and \'pca\' read instead of the radar file.')
+    plot_parser.add_argument('--feature', default=DEFAULT_FEATURE_NAME,
+        help='Name of the feature in the feature store that \'versus\' plots against moisture.')
+    plot_parser.add_argument('--resample',
+        help='Statistics of all radar samples within each environment interval (or step of --join-frequency) '
+        'to join instead of the nearest sample, e.g., \'mean\' or \'mean,std\' (of mean, median and std).')
+    plot_parser.add_argument('--join-frequency', type=float,
+        help='Seconds per step of a fixed grid to resample the radar data over, instead of the environment intervals.')
+    plot_parser.add_argument('--follow', action='store_true',
+        help='Keep the heatmap and moisture panes on the latest samples of a radar file that is still being recorded, '
+        'reading only the rows appended since the last update (the width of --initial-region sets how many are shown).')
+    plot_parser.add_argument('--poll-interval', type=float, default=DEFAULT_FOLLOW_POLL_SECONDS,
+        help='Seconds between checks for appended samples when following.')
+    plot_parser.add_argument('--idle-timeout', type=float,
+        help='Seconds without appended samples after which to stop following, until the window is closed if excluded.')
+    plot_parser.set_defaults(func=run_lazily('subcommands.plot.heatmap', 'run_plot_subcommand'))
     plot_subcommands = plot_parser.add_subparsers(title='subcommands')
-    
-    subcommands.plot.versus.attach_versus_subcommand(plot_subcommands)
-    subcommands.plot.pca.attach_pca_subcommand(plot_subcommands)
+
+    attach_versus_subcommand(plot_subcommands)
+    attach_pca_subcommand(plot_subcommands)
+
+def attach_versus_subcommand(plot_subcommands):
+    versus_parser = plot_subcommands.add_parser('versus')
+    versus_parser.add_argument('-p', '--power-levels',
+        help='Whether or not, and to determine which levels of power'
+        'to plot.')
+    versus_parser.add_argument('-x', '--export-dir',
+        help='If specified, will save the plot image to the supplied directory')
+    versus_parser.add_argument('-b', '--batch', action='store_true',
+        help='Save one plot per power level (all levels unless --power-levels is given) to the export directory.')
+    versus_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+        help='Number of processes used to render plots in batch mode and to join dataset files.')
+    versus_parser.add_argument('-d', '--dataset-dir',
+        help='Path to a directory of radar and environment files to plot instead of a single pair.')
+    versus_parser.add_argument('--date-range',
+        help='Range of dates to plot from the dataset directory, e.g., \'2023-10-30,2023-11-02\' (end exclusive).')
+    versus_parser.add_argument('--scan', action='store_true',
+        help='Fit every level (or those of --power-levels) against moisture at once, writing a table of the levels '
+        'ranked by R² and a summary plot instead of plotting the levels.')
+    versus_parser.add_argument('--scan-degree', type=int, default=1,
+        help='Highest degree of polynomial to fit when scanning, the R² of each degree is reported.')
+    versus_parser.add_argument('--bootstrap', type=int, default=0,
+        help='Number of bootstrap resamples for confidence intervals of the slopes and correlations when scanning.')
+    versus_parser.add_argument('--confidence', type=float, default=0.95,
+        help='Confidence of the bootstrap intervals.')
+    versus_parser.add_argument('--scan-output',
+        help='Path to write the ranked table of the scan to, either .csv or .json, to the export directory '
+        '(or printed as csv) if excluded.')
+    versus_parser.set_defaults(func=run_lazily('subcommands.plot.versus', 'run_versus_subcommand'))
+
+def attach_pca_subcommand(plot_subcommands):
+    pca_parser = plot_subcommands.add_parser('pca')
+    pca_parser.add_argument('-s', '--streaming', action='store_true',
+        help='Fit the projection block by block over the whole recording (or the initial region) '
+        'and plot the density of the projected samples.')
+    pca_parser.add_argument('-n', '--components', type=int, default=2,
+        help='Number of principal components to fit.')
+    pca_parser.set_defaults(func=run_lazily('subcommands.plot.pca', 'run_pca_subcommand'))
 
 def validate_plot_arguments(program_arguments):
     validate_arguments_for_radar_file(program_arguments)
     validate_arguments_for_environments_file(program_arguments)
 
-RADAR_RANGE_MATPLOTLIB_IMSHOW = {
-    'vmin': 0,
-    'vmax': 500
-}
-
-def run_plot_subcommand(program_arguments):
-    validate_plot_arguments(program_arguments)
-
-    radar_file = h5py.File(program_arguments.radar_h5_file, 'r')
-    start_timestamp = radar_file['timestamp'][()]
-    sensors_dataset = radar_file['data']
-    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
-    logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
-
-    environment_information = pd.read_excel(program_arguments.environment_file).iloc[1:, :]
-    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
-    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
-
-    logging.info('Initial region is... {}'.format(program_arguments.initial_region)) 
-    if program_arguments.initial_region is not None:
-        if len(program_arguments.initial_region.split(',')) == 2:
-            region_start, region_width = tuple(program_arguments.initial_region.split(','))
-            if not region_start.isnumeric():
-                raise Exception('Start of initial region program argument is inivalid, was... {}'
-                .format(region_start))             
-            if not region_width.isnumeric():
-                raise Exception('Width of initial region program argument is invalid, was... {}'
-                .format(region_width)) 
-        else:
-            raise Exception('Initial region program argument is invalid, was... {}'
-            .format(program_arguments.initial_region))
-
-        region_start = int(region_start)
-        region_width = int(region_width)
-
-    run_plotting_loop(program_arguments, (region_start, region_width), radar_file, environment_information)
-
-def run_plotting_loop(program_arguments, initial_region, radar_file, environment_information):
-    region_start, region_width = initial_region
-    
-    subplots_figure, subplots_ax = plt.subplots(ncols=2, tight_layout=True)
-    subplots_ax[0].set_title('Radar Heatmap')
-    subplots_ax[0].set_ylabel('Distance Level')
-    subplots_ax[0].set_xlabel('Time')
-    subplots_ax[1].set_title('Moisture')
-    subplots_ax[1].set_ylabel('Moisture Percentage')
-    subplots_ax[1].set_xlabel('Time')
-
-    if program_arguments.initial_region is None:
-        sensors_data = reoriente_sensor_data(radar_file['data'][:])
-        _environment_data = get_environment_information_between_timestamps(
-            get_radar_data_timestamp_from_index(radar_file, 0),
-            get_radar_data_timestamp_from_index(radar_file, -1)
-        )
-    else: 
-        sensors_data = reoriente_sensor_data(
-            radar_file['data'][region_start:region_start + region_width]
-        )
-        # TODO
-        sensors_data = list(list(sensors_data)[50])
-        # print(sensors_data)
-        _environment_data = get_environment_information_between_timestamps(
-            environment_information, 
-            get_radar_data_timestamp_from_index(radar_file, region_start),
-            get_radar_data_timestamp_from_index(radar_file, region_start + region_width)
-        )
-    # sensors_data = pca_model.transform(sensors_data.transpose()).transpose()
-    # subplots_figure.colorbar(
-        # subplots_ax[0].imshow(sensors_data, aspect='auto', **RADAR_RANGE_MATPLOTLIB_IMSHOW),
-    # )
-    subplots_ax[0].plot(sensors_data),
-    _environment_data = list(map(lambda position_and_row: position_and_row[1]['Leaf Moisture'], _environment_data))
-    print(_environment_data)
-    subplots_ax[1].plot(_environment_data)
-    plt.show(block=False)
-    plt.draw()
-    plt.pause(0.25)
-    while True:
-        usage_hint = 'Invalid input ({})'
-        user_input = input('Load different region of data, can be relative (e.g., \'+2000,1000\') '
-        'or absolute (e.g., \'2000,1000\'): ')
-
-        logging.info('User input is... {}'.format(user_input))
-        
-        if user_input != '':
-            if len(user_input.split(',')) == 2:
-                candidate_region_start, candidate_region_width = tuple(user_input.split(','))
-                if not candidate_region_start.isnumeric() and \
-                not is_string_relative_numeric(candidate_region_start):
-                    print(usage_hint.format('start'))
-                    continue
-                if not candidate_region_width.isnumeric():
-                    print(usage_hint.format('width'))
-                    continue
-            else:
-                print(usage_hint.format('start and width'))            
-                continue
-
-            if is_string_relative_numeric(candidate_region_start):        
-                region_start = region_start + int(candidate_region_start) 
-            else:
-                region_start = int(candidate_region_start)
-            region_width = int(candidate_region_width)
-
-            sensors_data = reoriente_sensor_data(radar_file['data'][region_start:region_start + region_width]) 
-            _environment_data = get_environment_information_between_timestamps(
-                environment_information, 
-                get_radar_data_timestamp_from_index(radar_file, region_start),
-                get_radar_data_timestamp_from_index(radar_file, region_start + region_width)
-            )
-        else:
-            sensors_data = reoriente_sensor_data(radar_file['data'][:]) 
-            _environment_data = get_environment_information_between_timestamps(
-                get_radar_data_timestamp_from_index(radar_file, 0),
-                get_radar_data_timestamp_from_index(radar_file, -1)
-            )
-        # sensors_data = pca_model.transform(sensors_data.transpose()).transpose()
-        _environment_data = list(map(lambda position_and_row: position_and_row[1]['Leaf Moisture'], _environment_data))
-
-        subplots_ax[0].imshow(sensors_data, aspect='auto', **RADAR_RANGE_MATPLOTLIB_IMSHOW)
-        subplots_ax[1].plot(_environment_data)
-        plt.draw()
-        plt.pause(0.25)
-
+def validate_plot_feature_arguments(program_arguments):
+    if program_arguments.features is None:
+        validate_plot_arguments(program_arguments)
+        return
+    validate_arguments_for_feature_store(program_arguments)
+    validate_arguments_for_environments_file(program_arguments)
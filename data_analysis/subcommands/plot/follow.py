@@ -0,0 +1,148 @@
+import math
+import logging
+import datetime
+import matplotlib.pyplot as plt
+import numpy as np
+import subcommands.plot.pca
+from data_files.radar_h5 import iterate_radar_data_chunks, refresh_radar_file
+from data_files.environments_excel import get_environment_time_index
+from data_files.following import iterate_appended_regions, RunningLevelStatistics, EnvironmentFileFollower
+from subcommands.plot.heatmap import RADAR_RANGE_MATPLOTLIB_IMSHOW, get_heatmap_width
+from profiling import profile_stage
+
+# Samples shown by the heatmap when following, unless the width of --initial-region is given.
+DEFAULT_FOLLOW_REGION_WIDTH = 20000
+
+class FollowedHeatmap:
+    # The most recent columns of the heatmap, each the mean of a fixed number of samples. Samples that do not fill
+    # a column yet are carried to the next update, so every sample is read and averaged exactly once.
+    def __init__(self, region_width, heatmap_width):
+        self.bin_size = max(1, math.ceil(region_width / heatmap_width))
+        self.column_count = max(1, math.ceil(region_width / self.bin_size))
+        self.columns = None
+        self.column_times = np.full(self.column_count, np.nan)
+        self.pending_sums = None
+        self.pending_count = 0
+
+    def push_columns(self, column_means, column_times):
+        if self.columns is None:
+            self.columns = np.full((column_means.shape[0], self.column_count), np.nan)
+        pushed_count = min(column_means.shape[1], self.column_count)
+        self.columns = np.roll(self.columns, -pushed_count, axis=1)
+        self.columns[:, -pushed_count:] = column_means[:, -pushed_count:]
+        self.column_times = np.roll(self.column_times, -pushed_count)
+        self.column_times[-pushed_count:] = column_times[-pushed_count:]
+
+    def add_samples(self, sample_times, sensors_data, project_columns=None):
+        sensors_data = np.asarray(sensors_data, dtype=np.float64)
+        if self.pending_sums is None:
+            self.pending_sums = np.zeros(sensors_data.shape[0])
+        completed_means, completed_times = [], []
+
+        pending_take = min(self.bin_size - self.pending_count, sensors_data.shape[1])
+        self.pending_sums += sensors_data[:, :pending_take].sum(axis=1)
+        self.pending_count += pending_take
+        if self.pending_count == self.bin_size:
+            completed_means.append(self.pending_sums[:, np.newaxis] / self.bin_size)
+            completed_times.append(sample_times[pending_take - 1:pending_take])
+            self.pending_sums = np.zeros(sensors_data.shape[0])
+            self.pending_count = 0
+
+        remaining_data = sensors_data[:, pending_take:]
+        full_width = remaining_data.shape[1] // self.bin_size * self.bin_size
+        if full_width > 0:
+            completed_means.append(
+                remaining_data[:, :full_width].reshape(remaining_data.shape[0], -1, self.bin_size).mean(axis=2)
+            )
+            completed_times.append(sample_times[pending_take + self.bin_size - 1:pending_take + full_width:self.bin_size])
+        if full_width < remaining_data.shape[1]:
+            self.pending_sums += remaining_data[:, full_width:].sum(axis=1)
+            self.pending_count += remaining_data.shape[1] - full_width
+
+        if len(completed_means) > 0:
+            column_means = np.concatenate(completed_means, axis=1)
+            if project_columns is not None:
+                column_means = project_columns(column_means)
+            self.push_columns(column_means, np.concatenate(completed_times))
+
+def get_followed_moisture(environment_information):
+    environment_time_index = get_environment_time_index(environment_information)
+    return environment_time_index.epoch_seconds, environment_time_index.get_column('Leaf Moisture').astype(np.float64)
+
+def run_following_loop(program_arguments, initial_region, radar_file, environment_information, environment_file_size):
+    _region_start, region_width = initial_region
+    region_width = DEFAULT_FOLLOW_REGION_WIDTH if region_width is None else region_width
+
+    pca_projection = None
+    project_columns = None
+    if program_arguments.pca_model is not None:
+        pca_projection = subcommands.plot.pca.load_pca_projection(program_arguments.pca_model)
+        project_columns = lambda column_means: subcommands.plot.pca.project_sensors_data(pca_projection, column_means)
+
+    subplots_figure, subplots_ax = plt.subplots(ncols=2, tight_layout=True)
+    subplots_ax[0].set_ylabel('Distance Level')
+    subplots_ax[0].set_xlabel('Time')
+    subplots_ax[1].set_ylabel('Moisture Percentage')
+    subplots_ax[1].set_xlabel('Time')
+    followed_heatmap = FollowedHeatmap(region_width, get_heatmap_width(subplots_ax[0]))
+    heatmap_image = None
+    moisture_line, = subplots_ax[1].plot([], [])
+    level_statistics = RunningLevelStatistics()
+    environment_follower = EnvironmentFileFollower(
+        program_arguments.environment_file, environment_information, environment_file_size
+    )
+    moisture_epoch_seconds, moistures = get_followed_moisture(environment_information)
+
+    # Only the tail that fits in the heatmap is read when starting, later updates read the appended rows alone.
+    follow_start = max(0, refresh_radar_file(radar_file) - region_width)
+    logging.info('Following {} from sample {}, {} samples per heatmap column'.format(
+        radar_file.filename, follow_start, followed_heatmap.bin_size))
+    for region_start, region_stop in iterate_appended_regions(
+        radar_file, follow_start, program_arguments.poll_interval, program_arguments.idle_timeout,
+        should_continue=lambda: plt.fignum_exists(subplots_figure.number), wait=plt.pause
+    ):
+        for sample_times, sensors_data in iterate_radar_data_chunks(
+            radar_file, program_arguments.chunk_size, region_start, region_stop
+        ):
+            with profile_stage('aggregate') as aggregate_stage:
+                level_statistics.update(sensors_data)
+                followed_heatmap.add_samples(sample_times, sensors_data, project_columns)
+                aggregate_stage.add_rows(sensors_data.shape[1])
+        appended_rows = environment_follower.read_appended_rows()
+        if appended_rows is not None:
+            appended_epoch_seconds, appended_moistures = get_followed_moisture(appended_rows)
+            moisture_epoch_seconds = np.concatenate([moisture_epoch_seconds, appended_epoch_seconds])
+            moistures = np.concatenate([moistures, appended_moistures])
+        if followed_heatmap.columns is None:
+            continue
+
+        with profile_stage('render'):
+            if heatmap_image is None:
+                heatmap_image = subplots_ax[0].imshow(followed_heatmap.columns, aspect='auto',
+                    **({} if pca_projection is not None else RADAR_RANGE_MATPLOTLIB_IMSHOW))
+            else:
+                heatmap_image.set_data(followed_heatmap.columns)
+                if pca_projection is not None:
+                    heatmap_image.autoscale()
+            latest_epoch_seconds = np.nanmax(followed_heatmap.column_times)
+            subplots_ax[0].set_title('Radar Heatmap, {} samples to {:%H:%M:%S}, peak mean at level {}'.format(
+                level_statistics.count, datetime.datetime.fromtimestamp(latest_epoch_seconds),
+                int(np.argmax(level_statistics.get_means()))
+            ))
+
+            # The moisture pane spans the same time as the heatmap, found by bisection rather than a scan.
+            earliest_epoch_seconds = np.nanmin(followed_heatmap.column_times)
+            visible_start, visible_stop = np.searchsorted(
+                moisture_epoch_seconds, [earliest_epoch_seconds, latest_epoch_seconds], side='right'
+            )
+            visible_start = max(0, visible_start - 1)
+            moisture_line.set_data(
+                [datetime.datetime.fromtimestamp(epoch_seconds) for epoch_seconds in moisture_epoch_seconds[visible_start:visible_stop]],
+                moistures[visible_start:visible_stop]
+            )
+            subplots_ax[1].relim()
+            subplots_ax[1].autoscale_view()
+            subplots_ax[1].set_title('Moisture, latest {:.1f}%'.format(moistures[visible_stop - 1])
+                if visible_stop > visible_start else 'Moisture')
+            subplots_figure.canvas.draw_idle()
+        plt.pause(0.01)
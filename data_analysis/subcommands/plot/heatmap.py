@@ -0,0 +1,162 @@
+import os
+import logging
+import readline
+import functools
+import matplotlib.pyplot as plt
+import numpy as np 
+import subcommands.plot
+import subcommands.plot.pca
+from data_files.radar_h5 import get_radar_data_timestamp_from_index, get_radar_sample_count, open_radar_file
+from data_files.radar_pyramid import open_radar_pyramid, get_radar_data_level_of_detail
+from data_files.environments_excel import get_environment_column_between_timestamps, load_environment_information
+from subcommands.plot.region_cache import RegionCache, PlotRegion, get_neighbouring_regions
+from miscellaneous import is_string_relative_numeric
+from profiling import profile_stage, profiled
+
+RADAR_RANGE_MATPLOTLIB_IMSHOW = {
+    'vmin': 0,
+    'vmax': 500
+}
+
+def get_heatmap_width(heatmap_ax):
+    # One column of radar data per pixel of the heatmap is all the screen can show.
+    return max(1, int(heatmap_ax.get_window_extent().width))
+
+@profiled('load.plot_region')
+def load_plot_region(radar_file, radar_pyramid, environment_information, pca_projection, heatmap_width,
+    region_start, region_width):
+    sample_count = get_radar_sample_count(radar_file)
+    sensors_data = get_radar_data_level_of_detail(
+        radar_file, radar_pyramid, region_start, region_start + region_width, heatmap_width
+    ).means
+    if pca_projection is not None:
+        sensors_data = subcommands.plot.pca.project_sensors_data(pca_projection, sensors_data)
+    environment_data = get_environment_column_between_timestamps(
+        environment_information, 'Leaf Moisture',
+        get_radar_data_timestamp_from_index(radar_file, region_start),
+        get_radar_data_timestamp_from_index(radar_file, min(region_start + region_width, sample_count - 1))
+    )
+    return PlotRegion(sensors_data, environment_data)
+
+def run_plot_subcommand(program_arguments):
+    subcommands.plot.validate_plot_arguments(program_arguments)
+
+    radar_file = open_radar_file(program_arguments.radar_h5_file, 'interactive', swmr=program_arguments.follow)
+    start_timestamp = radar_file['timestamp'][()]
+    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
+    # No dataset is held on to, as a held dataset of a followed file fails reads of the rows appended after it.
+    logging.info('Shape of data in radar file is... {}'.format(radar_file['data'].shape))
+
+    # Measured before loading, so a follower reads the rows logged while loading instead of skipping them.
+    environment_file_size = os.path.getsize(program_arguments.environment_file)
+    environment_information = load_environment_information(program_arguments.environment_file)
+    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
+    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+
+    logging.info('Initial region is... {}'.format(program_arguments.initial_region)) 
+    region_start, region_width = 0, None
+    if program_arguments.initial_region is not None:
+        if len(program_arguments.initial_region.split(',')) == 2:
+            region_start, region_width = tuple(program_arguments.initial_region.split(','))
+            if not region_start.isnumeric():
+                raise Exception('Start of initial region program argument is inivalid, was... {}'
+                .format(region_start))             
+            if not region_width.isnumeric():
+                raise Exception('Width of initial region program argument is invalid, was... {}'
+                .format(region_width)) 
+        else:
+            raise Exception('Initial region program argument is invalid, was... {}'
+            .format(program_arguments.initial_region))
+
+        region_start = int(region_start)
+        region_width = int(region_width)
+
+    if program_arguments.follow:
+        from subcommands.plot.follow import run_following_loop
+        run_following_loop(
+            program_arguments, (region_start, region_width), radar_file, environment_information, environment_file_size
+        )
+        return
+    run_plotting_loop(program_arguments, (region_start, region_width), radar_file, environment_information)
+
+def run_plotting_loop(program_arguments, initial_region, radar_file, environment_information):
+    region_start, region_width = initial_region
+
+    pca_projection = None
+    if program_arguments.pca_model is not None:
+        pca_projection = subcommands.plot.pca.load_pca_projection(program_arguments.pca_model)
+    
+    subplots_figure, subplots_ax = plt.subplots(ncols=2, tight_layout=True)
+    subplots_ax[0].set_title('Radar Heatmap')
+    subplots_ax[0].set_ylabel('Distance Level')
+    subplots_ax[0].set_xlabel('Time')
+    subplots_ax[1].set_title('Moisture')
+    subplots_ax[1].set_ylabel('Moisture Percentage')
+    subplots_ax[1].set_xlabel('Time')
+
+    radar_pyramid = open_radar_pyramid(radar_file, program_arguments.chunk_size)
+    sample_count = get_radar_sample_count(radar_file)
+    # Regions are decoded for the width the heatmap has when opened, as the layout shifts slightly on every redraw.
+    with RegionCache(functools.partial(load_plot_region, radar_file, radar_pyramid,
+        environment_information, pca_projection, get_heatmap_width(subplots_ax[0]))) as region_cache:
+        if program_arguments.initial_region is None:
+            sensors_data, _environment_data = region_cache.get_region(0, sample_count)
+        else: 
+            sensors_data, _environment_data = region_cache.get_region(region_start, region_width)
+            if pca_projection is None:
+                # TODO
+                sensors_data = list(list(sensors_data)[50])
+            # print(sensors_data)
+        # subplots_figure.colorbar(
+            # subplots_ax[0].imshow(sensors_data, aspect='auto', **RADAR_RANGE_MATPLOTLIB_IMSHOW),
+        # )
+        subplots_ax[0].plot(np.transpose(sensors_data)),
+        print(_environment_data)
+        subplots_ax[1].plot(_environment_data)
+        plt.show(block=False)
+        plt.draw()
+        plt.pause(0.25)
+        previous_region_start = region_start
+        while True:
+            usage_hint = 'Invalid input ({})'
+            user_input = input('Load different region of data, can be relative (e.g., \'+2000,1000\') '
+            'or absolute (e.g., \'2000,1000\'): ')
+
+            logging.info('User input is... {}'.format(user_input))
+        
+            if user_input != '':
+                if len(user_input.split(',')) == 2:
+                    candidate_region_start, candidate_region_width = tuple(user_input.split(','))
+                    if not candidate_region_start.isnumeric() and \
+                    not is_string_relative_numeric(candidate_region_start):
+                        print(usage_hint.format('start'))
+                        continue
+                    if not candidate_region_width.isnumeric():
+                        print(usage_hint.format('width'))
+                        continue
+                else:
+                    print(usage_hint.format('start and width'))            
+                    continue
+
+                if is_string_relative_numeric(candidate_region_start):        
+                    region_start = region_start + int(candidate_region_start) 
+                else:
+                    region_start = int(candidate_region_start)
+                region_width = int(candidate_region_width)
+                viewed_region = (region_start, region_width)
+            else:
+                viewed_region = (0, sample_count)
+
+            sensors_data, _environment_data = region_cache.get_region(*viewed_region)
+            if user_input != '':
+                region_cache.prefetch_regions(get_neighbouring_regions(
+                    region_start, region_width, region_start - previous_region_start, sample_count
+                ))
+                previous_region_start = region_start
+    
+            with profile_stage('render'):
+                subplots_ax[0].imshow(sensors_data, aspect='auto', **RADAR_RANGE_MATPLOTLIB_IMSHOW)
+                subplots_ax[1].plot(_environment_data)
+                plt.draw()
+            plt.pause(0.25)
+
@@ -1,51 +1,115 @@
-import sys
 import os
 import logging
-import datetime
-import itertools
 import pickle
-import argparse
-import readline
-import csv
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt, mpld3
+import matplotlib.pyplot as plt
 import numpy as np 
-import h5py
-from subcommands import validate_arguments_for_radar_file, validate_arguments_for_environments_file
+import subcommands
 import subcommands.plot
-import data_files 
-from data_files.radar_h5 import reoriente_sensor_data, get_radar_data_timestamp_from_index
-from data_files.environments_excel import get_environment_information_between_timestamps
-from miscellaneous import is_string_relative_numeric
-
-def attach_pca_subcommand(plot_subcommands):
-    pca_parser = plot_subcommands.add_parser('pca')
-    pca_parser.set_defaults(func=run_pca_subcommand)
+from data_files.radar_h5 import iterate_radar_data_chunks, open_radar_file
+from data_files.environments_excel import load_environment_information
+from data_files.feature_store import open_feature_store, iterate_feature_chunks
+from profiling import profile_stage
 
 def validate_pca_subcommand(program_arguments):
-    subcommands.plot.validate_plot_arguments(program_arguments) 
+    if program_arguments.features is None:
+        subcommands.plot.validate_plot_arguments(program_arguments) 
+    else:
+        subcommands.validate_arguments_for_feature_store(program_arguments)
+    if program_arguments.components < 2:
+        raise Exception('At least two components are needed to plot, was... {}'.format(program_arguments.components))
 
 def run_pca_subcommand(program_arguments):
     validate_pca_subcommand(program_arguments)
+    if program_arguments.features is not None:
+        plot_pca_scores_of_feature_store(program_arguments.features, program_arguments.initial_region,
+            program_arguments.chunk_size)
+        return
     plot_pca_of_radar_data(
         program_arguments.radar_h5_file,
         program_arguments.environment_file,
-        program_arguments.initial_region
+        program_arguments.initial_region,
+        program_arguments.chunk_size,
+        program_arguments.streaming,
+        program_arguments.components,
+        program_arguments.pca_model
     )
 
-def plot_pca_of_radar_data(radar_h5_file, environment_file, initial_region):
-    radar_file = h5py.File(radar_h5_file, 'r')
-    start_timestamp = radar_file['timestamp'][()]
-    sensors_dataset = radar_file['data']
-    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
-    logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
+def load_pca_projection(pca_model_file):
+    with open(pca_model_file, 'rb') as save_file:
+        return pickle.load(save_file)
 
-    environment_information = pd.read_excel(environment_file).iloc[1:, :]
-    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
-    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+def save_pca_projection(pca_model_file, pca_projection):
+    with open(pca_model_file, 'wb') as save_file:
+        pickle.dump(pca_projection, save_file)
+        logging.info('Pickled PCA projection to {}'.format(pca_model_file))
+
+def project_sensors_data(pca_projection, sensors_data):
+    return pca_projection.transform(sensors_data.transpose()).transpose()
+
+def fit_incremental_pca_of_radar_data(radar_file, chunk_size, region_start, region_stop, components):
+    from sklearn.pipeline import Pipeline
+    from sklearn.decomposition import IncrementalPCA
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    for _, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop):
+        with profile_stage('fit'):
+            scaler.partial_fit(sensors_data.transpose())
+
+    pca_model = IncrementalPCA(n_components=components)
+    for chunk_index, (_, sensors_data) in enumerate(
+        iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop)
+    ):
+        if sensors_data.shape[1] < components:
+            logging.debug('Skipping chunk %s of %s samples, fewer than the number of components',
+                chunk_index, sensors_data.shape[1])
+            continue
+        with profile_stage('fit') as fit_stage:
+            pca_model.partial_fit(scaler.transform(sensors_data.transpose()))
+            fit_stage.add_rows(sensors_data.shape[1])
+        logging.debug('Fitted PCA to chunk %s', chunk_index)
+
+    return Pipeline([('scaler', scaler), ('pca', pca_model)])
 
+# Bins per axis of the density plot, and how many standard deviations of each component it spans.
+PCA_DENSITY_BINS = 400
+PCA_DENSITY_EXTENT = 4
+
+def get_pca_density(transformed_chunks, component_deviations):
+    density_edges = [
+        np.linspace(-PCA_DENSITY_EXTENT * component_deviation, PCA_DENSITY_EXTENT * component_deviation, PCA_DENSITY_BINS + 1)
+        for component_deviation in component_deviations
+    ]
+    density = np.zeros((PCA_DENSITY_BINS, PCA_DENSITY_BINS), dtype=np.int64)
+    for transformed_data in transformed_chunks:
+        # Samples beyond the extent are clipped onto the outermost bins instead of being dropped.
+        density += np.histogram2d(
+            np.clip(transformed_data[:, 0], density_edges[0][0], density_edges[0][-1]),
+            np.clip(transformed_data[:, 1], density_edges[1][0], density_edges[1][-1]),
+            bins=density_edges
+        )[0].astype(np.int64)
+    return density, density_edges
+
+def get_pca_density_of_radar_data(radar_file, pca_projection, chunk_size, region_start, region_stop):
+    return get_pca_density((
+        pca_projection.transform(sensors_data.transpose())
+        for _, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_start, region_stop)
+    ), np.sqrt(pca_projection.named_steps['pca'].explained_variance_[:2]))
+
+def show_pca_density(density, density_edges):
+    with profile_stage('render'):
+        plt.imshow(
+            np.log1p(density.transpose()), origin='lower', aspect='auto', cmap='viridis',
+            extent=(density_edges[0][0], density_edges[0][-1], density_edges[1][0], density_edges[1][-1])
+        )
+        plt.colorbar(label='log(1 + samples)')
+        plt.xlabel('Component 1')
+        plt.ylabel('Component 2')
+    plt.show()
+
+def parse_initial_region(initial_region):
     logging.info('Initial region is... {}'.format(initial_region)) 
+    region_start, region_width = 0, None
     if initial_region is not None:
         if len(initial_region.split(',')) == 2:
             region_start, region_width = tuple(initial_region.split(','))
@@ -61,11 +125,61 @@ def plot_pca_of_radar_data(radar_h5_file, environment_file, initial_region):
 
         region_start = int(region_start)
         region_width = int(region_width)
+    return region_start, None if region_width is None else region_start + region_width
 
-    from sklearn.pipeline import Pipeline
-    from sklearn.decomposition import PCA
-    from sklearn.preprocessing import StandardScaler
-    pca_model = PCA(n_components=2) 
-    transformed_data = Pipeline([('scaler', StandardScaler()), ('pca', pca_model)]).fit_transform(reoriente_sensor_data(radar_file['data'][:20000].transpose()))
-    plt.scatter(transformed_data[:,0], transformed_data[:,1])
-    plt.show()
+def plot_pca_scores_of_feature_store(feature_store_path, initial_region, chunk_size):
+    region_start, region_stop = parse_initial_region(initial_region)
+    with open_feature_store(feature_store_path, 'pca_scores') as feature_file:
+        # Scores were projected when the store was built, so no radar data is read or transformed here.
+        logging.info('Plotting PCA scores stored in... {}'.format(feature_store_path))
+        density, density_edges = get_pca_density(
+            (pca_scores for _, pca_scores in iterate_feature_chunks(feature_file, 'pca_scores', chunk_size,
+                region_start, region_stop)),
+            np.sqrt(feature_file['pca_scores'].attrs['explained_variance'][:2])
+        )
+    show_pca_density(density, density_edges)
+
+def plot_pca_of_radar_data(radar_h5_file, environment_file, initial_region, chunk_size, streaming=False, components=2,
+    pca_model_file=None):
+    radar_file = open_radar_file(radar_h5_file, 'sequential')
+    start_timestamp = radar_file['timestamp'][()]
+    sensors_dataset = radar_file['data']
+    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
+    logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
+
+    environment_information = load_environment_information(environment_file)
+    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
+    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+
+    region_start, region_stop = parse_initial_region(initial_region)
+
+    if not streaming:
+        from sklearn.pipeline import Pipeline
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+        sensors_data = np.concatenate([
+            sensors_data for _, sensors_data in iterate_radar_data_chunks(radar_file, chunk_size, region_stop=20000)
+        ], axis=1).transpose()
+        if pca_model_file is not None and os.path.isfile(pca_model_file):
+            pca_projection = load_pca_projection(pca_model_file)
+            transformed_data = pca_projection.transform(sensors_data)
+        else:
+            pca_projection = Pipeline([('scaler', StandardScaler()), ('pca', PCA(n_components=components))])
+            transformed_data = pca_projection.fit_transform(sensors_data)
+            if pca_model_file is not None:
+                save_pca_projection(pca_model_file, pca_projection)
+        plt.scatter(transformed_data[:,0], transformed_data[:,1])
+        plt.show()
+        return
+
+    if pca_model_file is not None and os.path.isfile(pca_model_file):
+        pca_projection = load_pca_projection(pca_model_file)
+        logging.info('Reusing PCA projection from... {}'.format(pca_model_file))
+    else:
+        pca_projection = fit_incremental_pca_of_radar_data(radar_file, chunk_size, region_start, region_stop, components)
+        if pca_model_file is not None:
+            save_pca_projection(pca_model_file, pca_projection)
+    logging.info('Explained variance ratio... {}'.format(pca_projection.named_steps['pca'].explained_variance_ratio_))
+
+    density, density_edges = get_pca_density_of_radar_data(radar_file, pca_projection, chunk_size, region_start, region_stop)
+    show_pca_density(density, density_edges)
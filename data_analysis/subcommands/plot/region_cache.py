@@ -0,0 +1,98 @@
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bound on the decoded regions kept in memory, the most recently viewed is kept even when larger.
+REGION_CACHE_MAXIMUM_BYTES = 256 * 1024 * 1024
+# Number of regions ahead of the current one, in the direction of navigation, that are loaded in the background.
+REGION_PREFETCH_DEPTH = 2
+
+PlotRegion = collections.namedtuple('PlotRegion', ['sensors_data', 'environment_data'])
+
+def get_plot_region_size(plot_region):
+    return plot_region.sensors_data.nbytes + plot_region.environment_data.nbytes
+
+def get_neighbouring_regions(region_start, region_width, region_step, sample_count, prefetch_depth=REGION_PREFETCH_DEPTH):
+    if region_step == 0:
+        return []
+    neighbouring_regions = []
+    for step_index in range(1, prefetch_depth + 1):
+        neighbouring_start = region_start + step_index * region_step
+        if neighbouring_start < 0 or neighbouring_start >= sample_count:
+            break
+        neighbouring_regions.append((neighbouring_start, region_width))
+    return neighbouring_regions
+
+class RegionCache:
+    def __init__(self, load_region, maximum_bytes=REGION_CACHE_MAXIMUM_BYTES):
+        self.load_region = load_region
+        self.maximum_bytes = maximum_bytes
+        self.cached_regions = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.pending_regions = {}
+        self.lock = threading.Lock()
+        # A single worker, h5py serializes reads anyway so more threads would only compete with the viewer.
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='region_prefetch')
+
+    def store_region(self, region_key, plot_region):
+        if region_key in self.cached_regions:
+            return
+        self.cached_regions[region_key] = plot_region
+        self.cached_bytes += get_plot_region_size(plot_region)
+        while self.cached_bytes > self.maximum_bytes and len(self.cached_regions) > 1:
+            evicted_key, evicted_region = self.cached_regions.popitem(last=False)
+            self.cached_bytes -= get_plot_region_size(evicted_region)
+            logging.debug('Evicted region %s from the region cache', evicted_key)
+
+    def get_region(self, region_start, region_width):
+        region_key = (region_start, region_width)
+        with self.lock:
+            plot_region = self.cached_regions.get(region_key)
+            if plot_region is not None:
+                self.cached_regions.move_to_end(region_key)
+                logging.debug('Region %s was in the region cache', region_key)
+                return plot_region
+            pending_region = self.pending_regions.get(region_key)
+
+        if pending_region is not None and not pending_region.cancelled():
+            try:
+                return pending_region.result()
+            except Exception as e:
+                logging.debug('Prefetch of region %s failed, loading it again, was... %s', region_key, e)
+        plot_region = self.load_region(region_start, region_width)
+        with self.lock:
+            self.store_region(region_key, plot_region)
+        return plot_region
+
+    def prefetch_regions(self, region_keys):
+        with self.lock:
+            # Regions queued for an earlier position are no longer ahead of the viewer.
+            for pending_key, pending_region in list(self.pending_regions.items()):
+                if pending_key not in region_keys and pending_region.cancel():
+                    del self.pending_regions[pending_key]
+            for region_key in region_keys:
+                if region_key in self.cached_regions or region_key in self.pending_regions:
+                    continue
+                self.pending_regions[region_key] = self.prefetch_executor.submit(self.load_pending_region, region_key)
+
+    def load_pending_region(self, region_key):
+        try:
+            plot_region = self.load_region(*region_key)
+            with self.lock:
+                self.store_region(region_key, plot_region)
+            logging.debug('Prefetched region %s', region_key)
+            return plot_region
+        finally:
+            with self.lock:
+                self.pending_regions.pop(region_key, None)
+
+    def close(self):
+        # Queued prefetches are dropped, but a read in progress is waited for so it never outlives the radar file.
+        self.prefetch_executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,237 @@
+import os
+import sys
+import csv
+import json
+import logging
+import tempfile
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from profiling import profile_stage
+
+SCAN_FILE_NAME = 'radar_versus_moisture_scan'
+# Levels marked on the summary plot, ranked by the R² of their linear fit.
+SCAN_HIGHLIGHTED_LEVELS = 10
+# Resamples of the bootstrap drawn per task, their weights are a (resamples, samples) matrix.
+SCAN_BOOTSTRAP_BATCH_SIZE = 64
+SCAN_FIGURE_SIZE = (10, 8)
+SCAN_MOISTURES_FILE = 'moistures.npy'
+SCAN_LEVELS_FILE = 'radar_levels.npy'
+
+# Fit of every scanned level, arrays of one entry per level, with the R² of each degree of polynomial by degree.
+LevelScan = collections.namedtuple('LevelScan', [
+    'levels', 'slopes', 'intercepts', 'r_squared', 'pearsons', 'r_squared_by_degree', 'slope_intervals',
+    'pearson_intervals'
+])
+
+def fit_polynomials_to_levels(moistures, radar_levels, degree):
+    # One least squares solve for every level, as they share the moistures and so the design matrix.
+    design_matrix = np.vander(moistures, degree + 1, increasing=True)
+    coefficients, _, _, _ = np.linalg.lstsq(design_matrix, radar_levels, rcond=None)
+    residuals = radar_levels - design_matrix @ coefficients
+    total_squares = np.square(radar_levels - radar_levels.mean(axis=0)).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = 1 - np.square(residuals).sum(axis=0) / total_squares
+    return coefficients, np.where(total_squares > 0, r_squared, np.nan)
+
+def get_weighted_linear_fits(sample_weights, moistures, radar_levels, square_levels):
+    # Slopes and correlations of every level under each row of sample weights, from weighted sums alone,
+    # so a batch of resamples is a few matrix products rather than a fit per resample and level.
+    weight_totals = sample_weights.sum(axis=1)[:, np.newaxis]
+    moisture_sums = (sample_weights @ moistures)[:, np.newaxis]
+    moisture_square_sums = (sample_weights @ np.square(moistures))[:, np.newaxis]
+    level_sums = sample_weights @ radar_levels
+    level_square_sums = sample_weights @ square_levels
+    cross_sums = (sample_weights * moistures) @ radar_levels
+
+    moisture_variations = weight_totals * moisture_square_sums - np.square(moisture_sums)
+    level_variations = weight_totals * level_square_sums - np.square(level_sums)
+    covariations = weight_totals * cross_sums - moisture_sums * level_sums
+    # Levels (or resamples of moistures) without any variation have no slope or correlation.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.where(moisture_variations > 0, covariations / moisture_variations, np.nan)
+        pearsons = np.where((moisture_variations > 0) & (level_variations > 0),
+            covariations / np.sqrt(moisture_variations * level_variations), np.nan)
+    return slopes, pearsons
+
+def bootstrap_linear_fits(resample_count, seed, moistures, radar_levels, square_levels):
+    random_generator = np.random.default_rng(seed)
+    sample_count = moistures.shape[0]
+    # Drawing n samples with replacement is the same as weighting each sample by a multinomial count.
+    sample_weights = random_generator.multinomial(
+        sample_count, np.full(sample_count, 1 / sample_count), size=resample_count
+    ).astype(np.float64)
+    return get_weighted_linear_fits(sample_weights, moistures, radar_levels, square_levels)
+
+_scan_arrays = None
+def load_scan_arrays(scan_dir):
+    # Every worker maps the fitted arrays once, so tasks carry only the size and seed of their batch. Workers
+    # already run side by side, so the native thread pools of each are limited to one thread.
+    global _scan_arrays
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    radar_levels = np.load(os.path.join(scan_dir, SCAN_LEVELS_FILE), mmap_mode='r')
+    _scan_arrays = (np.load(os.path.join(scan_dir, SCAN_MOISTURES_FILE), mmap_mode='r'), radar_levels,
+        np.square(radar_levels))
+
+def bootstrap_shared_linear_fits(resample_count, seed):
+    return bootstrap_linear_fits(resample_count, seed, *_scan_arrays)
+
+def get_bootstrap_intervals(moistures, radar_levels, resample_count, confidence, workers, seed=0):
+    batch_sizes = [
+        min(SCAN_BOOTSTRAP_BATCH_SIZE, resample_count - batch_start)
+        for batch_start in range(0, resample_count, SCAN_BOOTSTRAP_BATCH_SIZE)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    logging.info('Bootstrapping {} resamples in {} batches with {} workers'.format(resample_count, len(batch_sizes), workers))
+    if workers <= 1 or len(batch_sizes) <= 1:
+        square_levels = np.square(radar_levels)
+        bootstrap_fits = [
+            bootstrap_linear_fits(batch_size, batch_seed, moistures, radar_levels, square_levels)
+            for batch_size, batch_seed in zip(batch_sizes, seeds)
+        ]
+    else:
+        with tempfile.TemporaryDirectory(prefix='plot_scan_') as scan_dir:
+            np.save(os.path.join(scan_dir, SCAN_MOISTURES_FILE), moistures)
+            np.save(os.path.join(scan_dir, SCAN_LEVELS_FILE), radar_levels)
+            with ProcessPoolExecutor(max_workers=workers, initializer=load_scan_arrays,
+                initargs=(scan_dir,)) as executor:
+                bootstrap_fits = list(executor.map(bootstrap_shared_linear_fits, batch_sizes, seeds))
+    bootstrap_slopes = np.concatenate([slopes for slopes, _ in bootstrap_fits])
+    bootstrap_pearsons = np.concatenate([pearsons for _, pearsons in bootstrap_fits])
+
+    tail_percent = 100 * (1 - confidence) / 2
+    return (
+        np.nanpercentile(bootstrap_slopes, [tail_percent, 100 - tail_percent], axis=0).transpose(),
+        np.nanpercentile(bootstrap_pearsons, [tail_percent, 100 - tail_percent], axis=0).transpose()
+    )
+
+def scan_levels(moistures, radar_levels, levels, degree=1, bootstrap_resamples=0, confidence=0.95, workers=1):
+    moistures = np.asarray(moistures, dtype=np.float64)
+    radar_levels = np.asarray(radar_levels, dtype=np.float64)
+    if moistures.shape[0] <= degree:
+        raise Exception('Fitting polynomials of degree {} needs more than {} joined samples, there were {}'.format(
+            degree, degree, moistures.shape[0]))
+
+    with profile_stage('fit') as fit_stage:
+        r_squared_by_degree = []
+        for fitted_degree in range(1, degree + 1):
+            coefficients, r_squared = fit_polynomials_to_levels(moistures, radar_levels, fitted_degree)
+            if fitted_degree == 1:
+                intercepts, slopes = coefficients
+            r_squared_by_degree.append(r_squared)
+        _, pearsons = get_weighted_linear_fits(
+            np.ones((1, moistures.shape[0])), moistures, radar_levels, np.square(radar_levels)
+        )
+        fit_stage.add_rows(radar_levels.shape[0] * degree)
+
+    slope_intervals, pearson_intervals = None, None
+    if bootstrap_resamples > 0:
+        with profile_stage('bootstrap') as bootstrap_stage:
+            slope_intervals, pearson_intervals = get_bootstrap_intervals(
+                moistures, radar_levels, bootstrap_resamples, confidence, workers
+            )
+            bootstrap_stage.add_rows(bootstrap_resamples)
+    return LevelScan(
+        levels=np.asarray(levels),
+        slopes=slopes,
+        intercepts=intercepts,
+        r_squared=r_squared_by_degree[0],
+        pearsons=pearsons[0],
+        r_squared_by_degree=r_squared_by_degree,
+        slope_intervals=slope_intervals,
+        pearson_intervals=pearson_intervals
+    )
+
+def get_ranked_scan_rows(level_scan):
+    # Levels that could not be fitted (constant over the recording) are ranked last.
+    ranked_positions = np.argsort(np.where(np.isnan(level_scan.r_squared), -np.inf, level_scan.r_squared))[::-1]
+    scan_rows = []
+    for rank, level_position in enumerate(ranked_positions, start=1):
+        scan_row = {
+            'rank': rank,
+            'level': int(level_scan.levels[level_position]),
+            'slope': float(level_scan.slopes[level_position]),
+            'intercept': float(level_scan.intercepts[level_position]),
+            'r_squared': float(level_scan.r_squared[level_position]),
+            'pearson': float(level_scan.pearsons[level_position])
+        }
+        for degree, r_squared in enumerate(level_scan.r_squared_by_degree[1:], start=2):
+            scan_row['r_squared_degree_{}'.format(degree)] = float(r_squared[level_position])
+        if level_scan.slope_intervals is not None:
+            scan_row['slope_low'], scan_row['slope_high'] = map(float, level_scan.slope_intervals[level_position])
+            scan_row['pearson_low'], scan_row['pearson_high'] = map(float, level_scan.pearson_intervals[level_position])
+        scan_rows.append(scan_row)
+    return scan_rows
+
+def write_scan_rows(scan_rows, output_path):
+    if output_path is not None and os.path.splitext(output_path)[1].lower() == '.json':
+        # Fits that are undefined are written as null, as JSON has no NaN.
+        json_rows = [
+            {column_name: None if isinstance(value, float) and np.isnan(value) else value for column_name, value in scan_row.items()}
+            for scan_row in scan_rows
+        ]
+        with open(output_path, 'w') as output_file:
+            json.dump(json_rows, output_file, indent=2)
+    else:
+        output_file = sys.stdout if output_path is None else open(output_path, 'w', newline='')
+        try:
+            csv_writer = csv.DictWriter(output_file, fieldnames=list(scan_rows[0].keys()))
+            csv_writer.writeheader()
+            csv_writer.writerows(scan_rows)
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
+    if output_path is not None:
+        logging.info('Wrote scan of {} levels to... {}'.format(len(scan_rows), output_path))
+
+def render_scan_summary(figure, level_scan, confidence):
+    r_squared_ax, slope_ax = figure.subplots(nrows=2, sharex=True)
+    figure.suptitle('Radar Levels Versus Moisture')
+    for degree, r_squared in enumerate(level_scan.r_squared_by_degree, start=1):
+        r_squared_ax.plot(level_scan.levels, r_squared, linewidth=1, label='Degree {}'.format(degree))
+    highlighted_positions = np.argsort(np.where(np.isnan(level_scan.r_squared), -np.inf, level_scan.r_squared))[::-1] \
+        [:SCAN_HIGHLIGHTED_LEVELS]
+    r_squared_ax.scatter(level_scan.levels[highlighted_positions], level_scan.r_squared[highlighted_positions],
+        marker='x', color='black', label='Top {}'.format(len(highlighted_positions)))
+    r_squared_ax.set_ylabel('R²')
+    r_squared_ax.legend(fontsize=8)
+
+    slope_ax.plot(level_scan.levels, level_scan.slopes, linewidth=1, label='Slope')
+    if level_scan.slope_intervals is not None:
+        slope_ax.fill_between(level_scan.levels, level_scan.slope_intervals[:, 0], level_scan.slope_intervals[:, 1],
+            alpha=0.3, label='{:.0%} interval'.format(confidence))
+    slope_ax.axhline(0, color='grey', linewidth=0.5)
+    slope_ax.set_xlabel('Power Level')
+    slope_ax.set_ylabel('Radar Intensity per Moisture Percentage')
+    slope_ax.legend(fontsize=8)
+
+def run_level_scan(program_arguments, radar_and_moisture, power_levels):
+    level_count = radar_and_moisture.radar_levels.shape[1]
+    levels = np.arange(1, level_count + 1) if power_levels is None else np.asarray(power_levels)
+    logging.info('Scanning {} levels over {} joined samples'.format(levels.shape[0], radar_and_moisture.moistures.shape[0]))
+    level_scan = scan_levels(
+        radar_and_moisture.moistures, radar_and_moisture.radar_levels[:, levels - 1], levels,
+        program_arguments.scan_degree, program_arguments.bootstrap, program_arguments.confidence,
+        program_arguments.workers
+    )
+
+    scan_output = program_arguments.scan_output
+    if scan_output is None and program_arguments.export_dir is not None:
+        scan_output = os.path.join(program_arguments.export_dir, SCAN_FILE_NAME + '.csv')
+    with profile_stage('write'):
+        write_scan_rows(get_ranked_scan_rows(level_scan), scan_output)
+
+    if program_arguments.export_dir is not None:
+        from matplotlib.figure import Figure
+        with profile_stage('render'):
+            figure = Figure(figsize=SCAN_FIGURE_SIZE, tight_layout=True)
+            render_scan_summary(figure, level_scan, program_arguments.confidence)
+            export_path = os.path.join(program_arguments.export_dir, SCAN_FILE_NAME + '.png')
+            figure.savefig(export_path)
+        logging.info('Saved scan summary to... {}'.format(export_path))
+        return
+    import matplotlib.pyplot as plt
+    with profile_stage('render'):
+        render_scan_summary(plt.figure(figsize=SCAN_FIGURE_SIZE, tight_layout=True), level_scan, program_arguments.confidence)
+    plt.show()
@@ -1,51 +1,79 @@
-import sys
 import os
 import logging
-import datetime
-import itertools
-import pickle
-import argparse
-import readline
-import csv
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt, mpld3
+import matplotlib.pyplot as plt
 import numpy as np 
-import h5py
+import subcommands
 import subcommands.plot
-from subcommands import validate_arguments_for_radar_file, validate_arguments_for_environments_file
 import data_files
-from data_files.radar_h5 import reoriente_sensor_data, get_radar_data_timestamp_from_index
-from data_files.environments_excel import get_environment_information_between_timestamps
-from miscellaneous import is_string_relative_numeric
-
-def attach_versus_subcommand(plot_subcommands):
-    versus_parser = plot_subcommands.add_parser('versus')
-    versus_parser.add_argument('-p', '--power-levels', 
-        help='Whether or not, and to determine which levels of power'
-        'to plot.')
-    versus_parser.add_argument('-x', '--export-dir', 
-        help='If specified, will save the plot image to the supplied directory')
-    versus_parser.set_defaults(func=run_versus_subcommand)
-    
+import data_files.catalog
+from data_files.environments_excel import load_environment_information
+from data_files.feature_store import open_radar_or_feature_store
+from profiling import profile_stage
+
 def validate_versus_subcommand(program_arguments):
-    subcommands.plot.validate_plot_arguments(program_arguments) 
-    # TODO: Check between 1 and 414 
+    if program_arguments.dataset_dir is not None:
+        if not os.path.isdir(program_arguments.dataset_dir):
+            raise Exception("Value of dataset directory does not point to an actual directory.")
+        if program_arguments.features is not None:
+            raise Exception("Feature stores are built per radar file, so cannot be used with a dataset directory.")
+    else:
+        subcommands.plot.validate_plot_feature_arguments(program_arguments)
     if program_arguments.export_dir is not None and not os.path.isdir(program_arguments.export_dir):
         raise Exception("Value of export directory does not point to an actual directory.")
+    if program_arguments.batch and program_arguments.export_dir is None:
+        raise Exception("Batch mode requires an export directory.")
+    if program_arguments.scan:
+        if program_arguments.batch:
+            raise Exception("Scan mode summarizes every level in one plot, so cannot be combined with batch mode.")
+        if program_arguments.scan_degree < 1 or program_arguments.bootstrap < 0:
+            raise Exception("The scan degree should be positive and the bootstrap resamples not negative.")
+        if not 0 < program_arguments.confidence < 1:
+            raise Exception("The confidence should be between 0 and 1, was... {}".format(program_arguments.confidence))
 
-def run_versus_subcommand(program_arguments):
-    validate_versus_subcommand(program_arguments)
+def get_radar_versus_moisture_file_name(power_levels, suffix=None):
+    file_name = "radar_versus_moisture"
+    if power_levels is not None:
+        file_name += "_p={}".format(power_levels)
+    if suffix is not None:
+        file_name += "__{}".format(suffix)
+    return file_name + ".png"
 
-    radar_file = h5py.File(program_arguments.radar_h5_file, 'r')
-    start_timestamp = radar_file['timestamp'][()]
-    sensors_dataset = radar_file['data']
-    logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
-    logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
+def render_radar_versus_moisture_level(export_dir, power_level, moistures, radar_intensities):
+    # Figures are created without pyplot so workers only ever use the non-interactive Agg canvas.
+    from matplotlib.figure import Figure
+    figure = Figure(tight_layout=True)
+    sub_ax = figure.add_subplot()
+    figure.suptitle('Radar Level Versus Moisture')
+    sub_ax.tick_params(axis='both', which='major', labelsize=10)
+    sub_ax.plot(moistures, radar_intensities, linewidth=1)
+    if moistures.shape[0] > 1:
+        best_fitter = np.poly1d(np.polyfit(moistures, radar_intensities, 1))
+        sub_ax.plot(moistures, best_fitter(moistures), linewidth=1)
+    export_path = os.path.join(export_dir, get_radar_versus_moisture_file_name(power_level))
+    figure.savefig(export_path)
+    return export_path
 
-    environment_information = pd.read_excel(program_arguments.environment_file).iloc[1:, :]
-    logging.info('Shape of the environment file... {}'.format(environment_information.shape))
-    logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+def export_radar_versus_moisture_levels(export_dir, moisture_aggregates, power_levels, workers):
+    from concurrent.futures import ProcessPoolExecutor
+    if power_levels is None:
+        power_levels = list(range(1, moisture_aggregates.means.shape[1] + 1))
+    selected_means = moisture_aggregates.means[:, np.asarray(power_levels) - 1]
+    logging.info('Rendering {} power levels with {} workers'.format(len(power_levels), workers))
+    with profile_stage('render') as render_stage, ProcessPoolExecutor(max_workers=workers) as executor:
+        export_paths = executor.map(
+            render_radar_versus_moisture_level,
+            [export_dir] * len(power_levels),
+            power_levels,
+            [moisture_aggregates.moistures] * len(power_levels),
+            selected_means.transpose(),
+            chunksize=max(1, len(power_levels) // (4 * workers))
+        )
+        for export_path in export_paths:
+            logging.debug('Saved plot to... %s', export_path)
+        render_stage.add_rows(len(power_levels))
+
+def run_versus_subcommand(program_arguments):
+    validate_versus_subcommand(program_arguments)
 
     power_levels = None
     if program_arguments.power_levels is not None:
@@ -56,48 +84,62 @@ def run_versus_subcommand(program_arguments):
     
     if power_levels == []:
         raise Exception('The input of power levels cannot be equivalent to an empty string')
-    
-    radar_and_moisture = data_files.get_overlap_as_aggregated(radar_file, environment_information)
-
-    radar_and_moisture_grouped_by_moisture = sorted(
-        map(
-            lambda x: (x[0], list(x[1])),
-            itertools.groupby(
-                radar_and_moisture,
-                lambda radar_and_moisture: radar_and_moisture[0][1]['Leaf Moisture']
-            )
-        ),
-        key=lambda x: x[0]
+    resample_options = subcommands.get_resample_options(program_arguments)
+
+    if program_arguments.dataset_dir is not None:
+        radar_and_moisture = data_files.catalog.join_dataset_date_range(program_arguments.dataset_dir,
+            program_arguments.date_range, program_arguments.workers, program_arguments.chunk_size, resample_options)
+    else:
+        radar_h5_file, dataset_name = subcommands.get_radar_source(program_arguments)
+        radar_file = open_radar_or_feature_store(radar_h5_file, dataset_name)
+        start_timestamp = radar_file['timestamp'][()]
+        sensors_dataset = radar_file[dataset_name]
+        logging.info('Start timestamp in radar file is... {}'.format(start_timestamp))
+        logging.info('Shape of data in radar file is... {}'.format(sensors_dataset.shape))
+
+        environment_information = load_environment_information(program_arguments.environment_file)
+        logging.info('Shape of the environment file... {}'.format(environment_information.shape))
+        logging.info('Initial slice of environment file... {}'.format(environment_information.iloc[:2, :]))
+
+        radar_and_moisture = data_files.get_overlap_as_aggregated(radar_file, environment_information,
+            program_arguments.environment_file, program_arguments.chunk_size, dataset_name=dataset_name,
+            resample_options=resample_options)
+
+    level_count = radar_and_moisture.radar_levels.shape[1]
+    if power_levels is not None and any(power_level < 1 or power_level > level_count for power_level in power_levels):
+        raise Exception('Power levels should be between 1 and {}, were... {}'.format(level_count, power_levels))
+
+    if program_arguments.scan:
+        from subcommands.plot.scan import run_level_scan
+        run_level_scan(program_arguments, radar_and_moisture, power_levels)
+        return
+
+    moisture_aggregates = data_files.aggregate_radar_by_moisture(
+        radar_and_moisture.moistures, radar_and_moisture.radar_levels
     )
-    def produce_radar_versus_moisture_lines(radar_and_moisture_grouped_by_moisture, power_levels, aggregate_or_individual):
-        from copy import deepcopy
-        radar_and_moisture = []
-        get_average = lambda x: np.add.reduce(x, axis=0) / len(x) 
-        for group_index, (moisture_percentage, radar_and_moisture_entry) in enumerate(radar_and_moisture_grouped_by_moisture):
-            radar_and_moisture.append((moisture_percentage, get_average(list(radar_and_moisture_entry)[0][1])))
+    if program_arguments.batch:
+        export_radar_versus_moisture_levels(
+            program_arguments.export_dir, moisture_aggregates, power_levels, program_arguments.workers
+        )
+        return
+
+    def produce_radar_versus_moisture_lines(moisture_aggregates, power_levels, aggregate_or_individual):
+        level_count = moisture_aggregates.means.shape[1]
+        level_indices = np.arange(level_count) if power_levels is None else np.asarray(power_levels) - 1
+        selected_means = moisture_aggregates.means[:, level_indices]
 
         radar_versus_moisture_lines = [] 
 
         if aggregate_or_individual == "aggregate":
-            def aggregate_radar_levels(radar_intensities):
-                aggregated_radar = 0
-                for power_level in (power_levels if power_levels is not None else range(1, 415)):
-                    aggregated_radar += radar_intensities[power_level - 1] 
-                return aggregated_radar 
-            radar_versus_moisture_lines.append((
-                list(map(lambda x: x[0], radar_and_moisture)),
-                list(map(lambda x: aggregate_radar_levels(x[1]), radar_and_moisture)),
-            ))
+            radar_versus_moisture_lines.append((moisture_aggregates.moistures, selected_means.sum(axis=1)))
         elif aggregate_or_individual == "individual":
-            for power_level in (power_levels if power_levels is not None else range(1, 415)):
-                moisture_percentages = list(map(lambda x: x[0], radar_and_moisture))
-                radar_intensities = list(map(lambda x: x[1][power_level - 1], radar_and_moisture))
-                radar_versus_moisture_lines.append((moisture_percentages, radar_intensities)) 
+            for level_position in range(selected_means.shape[1]):
+                radar_versus_moisture_lines.append((moisture_aggregates.moistures, selected_means[:, level_position])) 
         else:
             raise Exception("Invalid choice for aggregate or invididual.") 
         
         return radar_versus_moisture_lines
-    radar_versus_moisture_lines = produce_radar_versus_moisture_lines(radar_and_moisture_grouped_by_moisture, power_levels, "aggregate")
+    radar_versus_moisture_lines = produce_radar_versus_moisture_lines(moisture_aggregates, power_levels, "aggregate")
     best_fitter = np.poly1d(np.polyfit(radar_versus_moisture_lines[0][0], radar_versus_moisture_lines[0][1], 1))
     a = radar_versus_moisture_lines[0][0]
     b = best_fitter(radar_versus_moisture_lines[0][0])
@@ -132,11 +174,13 @@ def run_versus_subcommand(program_arguments):
             sub_ax = subplots_ax
             sub_ax.remove()
             
-    plot_radar_versus_moisture_lines(radar_versus_moisture_lines)
+    with profile_stage('render'):
+        plot_radar_versus_moisture_lines(radar_versus_moisture_lines)
 
     if program_arguments.export_dir is not None:
-        plt.savefig(os.path.join(program_arguments.export_dir, "radar_versus_moisture__fitted_1".format(
-            program_arguments.power_levels
-        )))
+        with profile_stage('render'):
+            plt.savefig(os.path.join(program_arguments.export_dir, get_radar_versus_moisture_file_name(
+                program_arguments.power_levels, "fitted_1"
+            )))
     else:
         plt.show()
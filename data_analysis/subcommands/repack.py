@@ -0,0 +1,44 @@
+import os
+import logging
+from miscellaneous import DEFAULT_CHUNK_SIZE
+
+def attach_repack_subcommand(root_subcommands):
+    repack_parser = root_subcommands.add_parser('repack')
+    repack_parser.add_argument('-r', '--radar-h5-file', required=True,
+        help='Path to the h5 radar file to rewrite.')
+    repack_parser.add_argument('-o', '--output',
+        help='Path to write the repacked radar file to, next to the radar file (.repacked.h5) by default. The dataset '
+        'catalog skips .repacked.h5 files and pairs the original recording alone, an output named otherwise within a '
+        'dataset directory would be paired as well and join every sample twice.')
+    repack_parser.add_argument('--compression', choices=['lz4', 'gzip', 'lzf', 'none'], default='gzip',
+        help='Compression of the repacked radar data, lz4 needs the hdf5plugin package to write and read.')
+    repack_parser.add_argument('--chunk-rows', type=int, default=1024,
+        help='Number of samples per chunk of the repacked radar data.')
+    repack_parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help='Number of radar samples to read from the h5 file at a time.')
+    repack_parser.add_argument('-w', '--workers', type=int, default=1,
+        help='Number of processes reading chunks of the radar file in parallel.')
+    repack_parser.set_defaults(func=run_repack_subcommand)
+
+def validate_repack_arguments(program_arguments):
+    if not os.path.isfile(program_arguments.radar_h5_file):
+        raise Exception('The path to the radar file does not exist, path was... {}'.format(
+            program_arguments.radar_h5_file
+        ))
+    if program_arguments.chunk_rows <= 0:
+        raise Exception('Chunk rows should be positive, was... {}'.format(program_arguments.chunk_rows))
+
+def run_repack_subcommand(program_arguments):
+    from data_files.radar_h5 import open_radar_file, repack_radar_file, REPACKED_RADAR_SUFFIX
+    validate_repack_arguments(program_arguments)
+
+    output = program_arguments.output
+    if output is None:
+        output = os.path.splitext(program_arguments.radar_h5_file)[0] + REPACKED_RADAR_SUFFIX
+    if os.path.abspath(output) == os.path.abspath(program_arguments.radar_h5_file):
+        raise Exception('The repacked radar file should not overwrite the radar file... {}'.format(output))
+
+    with open_radar_file(program_arguments.radar_h5_file, 'sequential') as radar_file:
+        logging.info('Shape of data in radar file is... {}'.format(radar_file['data'].shape))
+        repack_radar_file(radar_file, output, program_arguments.compression, program_arguments.chunk_rows,
+            program_arguments.chunk_size, program_arguments.workers)